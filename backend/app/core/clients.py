@@ -0,0 +1,187 @@
+"""
+Registro de clientes externos (Voyage, OpenAI) con ciclo de vida de aplicación.
+
+Los clientes y sus pools HTTP se crean una vez al arrancar y se comparten entre
+peticiones, así las conexiones TLS a los proveedores se reutilizan. Se cierran en
+el shutdown de la app. Fuera de la app (scripts, workers) se crean al primer uso.
+"""
+import asyncio
+import threading
+from typing import List, Optional
+
+import aiohttp
+import httpx
+import requests
+import voyageai
+from requests.adapters import HTTPAdapter
+from voyageai import AsyncClient, Client
+from langchain_openai import ChatOpenAI
+from langchain.prompts import ChatPromptTemplate
+from langchain.chains.combine_documents import create_stuff_documents_chain
+
+from app.core.environment import settings
+
+
+ANSWER_PROMPT = """
+        Use the following context to answer the question.
+        If the answer is not in the context, say: "I don't have that information."
+
+        Context:
+        {context}
+
+        Question:
+        {input}
+        """
+
+
+class ClientRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._voyage: Optional[Client] = None
+        self._voyage_batch: Optional[Client] = None
+        self._avoyage: Optional[AsyncClient] = None
+        self._aiohttp_session: Optional[aiohttp.ClientSession] = None
+        self._aiohttp_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        self._llm: Optional[ChatOpenAI] = None
+        self._answer_chain = None
+
+    # Ciclo de vida
+
+    async def startup(self) -> None:
+        """Crea todos los clientes; se llama desde el lifespan de FastAPI"""
+        self._ensure_sync_clients()
+        self._ensure_llm()
+        await self._ensure_aiohttp_session()
+
+    async def aclose(self) -> None:
+        if self._aiohttp_session is not None and not self._aiohttp_session.closed:
+            await self._aiohttp_session.close()
+        if self._http_async_client is not None:
+            await self._http_async_client.aclose()
+        if self._http_client is not None:
+            self._http_client.close()
+        voyageai.requestssession = None
+        # Volver al estado inicial para que un nuevo startup cree clientes nuevos
+        self.__init__()
+
+    # Voyage
+
+    @property
+    def voyage(self) -> Client:
+        self._ensure_sync_clients()
+        return self._voyage
+
+    @property
+    def voyage_batch(self) -> Client:
+        """Cliente sin reintentos propios: el EmbeddingBatcher reintenta pasando por su rate limiter"""
+        self._ensure_sync_clients()
+        return self._voyage_batch
+
+    @property
+    def avoyage(self) -> AsyncClient:
+        self._ensure_sync_clients()
+        return self._avoyage
+
+    async def aembed(self, texts: List[str], model: str, input_type: Optional[str] = None):
+        """Embedding async reutilizando la sesión aiohttp compartida"""
+        session = await self._ensure_aiohttp_session()
+        # Una sesión aiohttp solo sirve en el loop que la creó (p. ej. asyncio.run en un worker)
+        if self._aiohttp_loop is not asyncio.get_running_loop():
+            session = None
+        token = voyageai.aiosession.set(session)
+        try:
+            return await self.avoyage.embed(texts=texts, model=model, input_type=input_type)
+        finally:
+            voyageai.aiosession.reset(token)
+
+    # OpenAI
+
+    @property
+    def llm(self) -> ChatOpenAI:
+        self._ensure_llm()
+        return self._llm
+
+    @property
+    def answer_chain(self):
+        """Cadena stuff-documents con el prompt de respuesta, construida una sola vez"""
+        self._ensure_llm()
+        return self._answer_chain
+
+    # Creación perezosa
+
+    def _ensure_sync_clients(self) -> None:
+        if self._voyage is not None:
+            return
+        with self._lock:
+            if self._voyage is not None:
+                return
+            # voyageai guarda una sesión requests por hilo creada con esta factory
+            voyageai.requestssession = _make_requests_session
+            self._avoyage = AsyncClient(
+                api_key=settings.VOYAGE_API_KEY,
+                max_retries=settings.voyage_max_retries,
+                timeout=settings.http_timeout_seconds,
+            )
+            self._voyage_batch = Client(
+                api_key=settings.VOYAGE_API_KEY,
+                max_retries=0,
+                timeout=settings.http_timeout_seconds,
+            )
+            self._voyage = Client(
+                api_key=settings.VOYAGE_API_KEY,
+                max_retries=settings.voyage_max_retries,
+                timeout=settings.http_timeout_seconds,
+            )
+
+    def _ensure_llm(self) -> None:
+        if self._llm is not None:
+            return
+        with self._lock:
+            if self._llm is not None:
+                return
+            limits = httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive_connections,
+            )
+            timeout = httpx.Timeout(settings.http_timeout_seconds, connect=settings.http_connect_timeout_seconds)
+            self._http_client = httpx.Client(limits=limits, timeout=timeout)
+            self._http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+            llm = ChatOpenAI(
+                model="gpt-4o-mini",
+                temperature=0.0,
+                api_key=settings.OPENAI_API_KEY,
+                max_retries=settings.llm_max_retries,
+                http_client=self._http_client,
+                http_async_client=self._http_async_client,
+            )
+            prompt = ChatPromptTemplate.from_template(ANSWER_PROMPT)
+            self._answer_chain = create_stuff_documents_chain(llm=llm, prompt=prompt)
+            self._llm = llm
+
+    async def _ensure_aiohttp_session(self) -> aiohttp.ClientSession:
+        # La sesión aiohttp debe crearse dentro de un event loop
+        if self._aiohttp_session is None or self._aiohttp_session.closed:
+            self._aiohttp_loop = asyncio.get_running_loop()
+            connector = aiohttp.TCPConnector(limit=settings.http_max_connections)
+            self._aiohttp_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(
+                    total=settings.http_timeout_seconds,
+                    connect=settings.http_connect_timeout_seconds,
+                ),
+            )
+        return self._aiohttp_session
+
+
+def _make_requests_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=settings.http_max_keepalive_connections)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+clients = ClientRegistry()
@@ -1,12 +1,50 @@
 # SQL alchemy database setup
 
+from typing import Any, Dict, Optional
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from app.core.environment import settings  
 
-engine = create_engine(settings.database_url, echo=True)
+
+def _connect_args(statement_timeout_ms: Optional[int] = None) -> Dict[str, Any]:
+    """Parámetros de conexión de psycopg: nombre de la app y timeout por sentencia"""
+    timeout = settings.db_statement_timeout_ms if statement_timeout_ms is None else statement_timeout_ms
+    args: Dict[str, Any] = {"application_name": settings.db_application_name}
+    if timeout:
+        args["options"] = f"-c statement_timeout={timeout}"
+    return args
+
+
+def _engine_options(pool_size: int, max_overflow: int) -> Dict[str, Any]:
+    """
+    Opciones de pool del engine sync y del async.
+
+    Cada engine tiene su propio presupuesto de conexiones (pool_size + max_overflow): el
+    máximo por proceso es la suma de ambos más la conexión sin pool de create_maintenance_engine.
+    """
+    return {
+        "echo": settings.db_echo,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": settings.db_pool_timeout_seconds,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "connect_args": _connect_args(),
+    }
+
+
+engine = create_engine(settings.database_url, **_engine_options(settings.db_pool_size, settings.db_max_overflow))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine async (psycopg 3 soporta ambos modos con la misma URL) para los endpoints async
+async_engine = create_async_engine(
+    settings.database_url,
+    **_engine_options(settings.db_async_pool_size, settings.db_async_max_overflow)
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # Dependency
@@ -17,7 +55,30 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def create_maintenance_engine():
+    # Migraciones e índices ANN pueden tardar más que el statement_timeout de las peticiones:
+    # usan un engine propio sin timeout ni pool
+    return create_engine(
+        settings.database_url,
+        echo=settings.db_echo,
+        poolclass=NullPool,
+        connect_args=_connect_args(statement_timeout_ms=0)
+    )
+
+
 def init_db():
+    maintenance_engine = create_maintenance_engine()
+    try:
+        _init_db(maintenance_engine)
+    finally:
+        maintenance_engine.dispose()
+
+
+def _init_db(engine):
     # ✅ Activar la extensión pgvector (solo la primera vez)
     with engine.connect() as conn:
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
@@ -26,7 +87,16 @@ def init_db():
     import app.modules.users.models
     import app.modules.documents.models
     import app.modules.analytics.models  # Importar modelo Document,Embedding
+    from app.modules.documents.vector_index import ensure_vector_index, ensure_tenant_vector_indexes
+    from app.core.migrations import run_migrations
     
     #Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+
+    # Columnas nuevas en tablas existentes (create_all no toca tablas existentes)
+    run_migrations(engine)
+
+    # Índice ANN para tablas creadas antes de configurarlo
+    ensure_vector_index(engine)
+    ensure_tenant_vector_indexes(engine)
     
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 import os
 
@@ -10,9 +11,135 @@ class Settings(BaseSettings):
     access_token_expire_minutes: int
     VOYAGE_API_KEY: str
     OPENAI_API_KEY: str
-    SUPABASE_URL: str
-    SUPABASE_KEY: str
-    SUPABASE_BUCKET: str
+    # Storage de archivos: supabase | local (SUPABASE_* solo son necesarias con supabase)
+    storage_backend: str = "supabase"
+    local_storage_path: str = "./storage"
+    SUPABASE_URL: Optional[str] = None
+    SUPABASE_KEY: Optional[str] = None
+    SUPABASE_BUCKET: Optional[str] = None
+
+    # Engines / pools de conexiones. Cada proceso abre como máximo
+    #   (db_pool_size + db_max_overflow) + (db_async_pool_size + db_async_max_overflow)
+    # más una conexión sin pool para migraciones/índices al arrancar (30 + 1 por defecto)
+    # Engine sync: endpoints sync, streaming y sesiones de los workers de ingestion (workers x concurrency)
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    # Engine async: /chat/answer, /chat/answer/batch y /chat/search
+    db_async_pool_size: int = 5
+    db_async_max_overflow: int = 5
+    db_pool_timeout_seconds: float = 30
+    db_pool_recycle_seconds: int = 1800  # reabrir conexiones antes de que las corte un proxy/PgBouncer
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_ms: int = 30000  # 0 = sin límite
+    db_application_name: str = "eka-backend"
+    db_echo: bool = False  # loguea cada sentencia SQL (incluidos los vectores)
+
+    # Vector index (pgvector): hnsw | ivfflat | none
+    vector_index_type: str = "hnsw"
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+    ivfflat_lists: int = 100
+    # Parámetros por consulta (deben ser >= top_k para no perder resultados)
+    hnsw_ef_search: int = 40
+    ivfflat_probes: int = 10
+    # pgvector >= 0.8: strict_order | relaxed_order, sigue buscando si el filtro por usuario descarta candidatos
+    hnsw_iterative_scan: Optional[str] = None
+    # Usuarios grandes con índice ANN parcial propio (WHERE user_id = X)
+    dedicated_vector_index_user_ids: List[int] = []
+    # Almacenamiento de vectores: vector (float32) | halfvec (float16) | binary (índice sobre
+    # binary_quantize + rescoring con el vector completo). Cambiarlo requiere migrar la columna:
+    # python -m app.modules.documents.vector_storage <modo>
+    vector_storage_mode: str = "vector"
+    binary_rescore_factor: int = 10  # candidatos por Hamming = top_k x factor
+
+    # Recuperación: vector | hybrid (vector + full-text de Postgres fusionados con RRF)
+    retrieval_mode: str = "vector"
+    hybrid_candidates: int = 20  # candidatos de cada rama antes de fusionar
+    hybrid_rrf_k: int = 60
+    # Configuración de to_tsvector de la columna text_search ("simple" no quita stopwords ni
+    # aplica stemming: conserva códigos e identificadores). Cambiarla requiere recrear la columna
+    text_search_config: str = "simple"
+
+    # Reranking de candidatos: none | lexical (BM25 + similitud, sin dependencias) |
+    # cross_encoder (modelo local en CPU, requiere sentence-transformers)
+    reranker: str = "lexical"
+    rerank_candidates: int = 20  # se recuperan N candidatos y se reordenan hasta top_k
+    rerank_timeout_ms: int = 200  # pasado el presupuesto se mantiene el orden de la recuperación
+    rerank_lexical_weight: float = 0.5  # peso de BM25 frente a la similitud coseno
+    rerank_workers: int = 2
+    cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+    # Contexto enviado al LLM: se recuperan context_candidates chunks y se eligen por MMR
+    # hasta context_max_chunks sin pasar de context_token_budget tokens
+    context_candidates: int = 10
+    context_max_chunks: int = 5
+    context_token_budget: int = 3000
+    context_mmr_lambda: float = 0.7  # 1 = solo relevancia, 0 = solo diversidad
+    context_duplicate_similarity: float = 0.9  # chunks casi idénticos a uno elegido se descartan
+    context_min_chunk_tokens: int = 100  # por debajo no merece la pena truncar un chunk para que quepa
+
+    # /chat/answer/batch
+    chat_batch_max_queries: int = 200
+    chat_batch_llm_concurrency: int = 8  # llamadas simultáneas al LLM por lote
+
+    # /chat/search (solo recuperación, paginado por cursor)
+    search_default_limit: int = 10
+    search_max_limit: int = 50
+    # Resultados alcanzables paginando (cursores más profundos dan 400). Sin búsqueda iterativa se
+    # reduce a lo que alcanza hnsw.ef_search: 999, o 1000 / BINARY_RESCORE_FACTOR - 1 en modo binary
+    search_max_depth: int = 1000
+    # Búsqueda iterativa de HNSW (requiere pgvector >= 0.8) para que los filtros por metadata no
+    # dejen páginas cortas; usar strict_order, que mantiene el orden exacto que necesita el cursor
+    search_iterative_scan: Optional[str] = None
+
+    # Caché de embeddings de consultas (0 desactiva la expiración)
+    query_embedding_cache_size: int = 2048
+    query_embedding_cache_ttl_seconds: int = 3600
+
+    # Caché semántica de respuestas (similitud coseno entre consultas del mismo usuario)
+    answer_cache_enabled: bool = True
+    answer_cache_similarity_threshold: float = 0.97
+    answer_cache_max_entries_per_user: int = 256
+    answer_cache_ttl_seconds: int = 86400
+
+    # Clientes HTTP compartidos hacia Voyage / OpenAI
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_timeout_seconds: float = 60.0
+    http_connect_timeout_seconds: float = 10.0
+    voyage_max_retries: int = 3
+    llm_max_retries: int = 2
+
+    # Indexación en segundo plano (POST /documents encola y responde de inmediato)
+    ingestion_background: bool = True
+    ingestion_workers: int = 2
+    ingestion_max_attempts: int = 3
+    ingestion_retry_backoff_seconds: float = 30.0
+    ingestion_poll_interval_seconds: float = 1.0
+    ingestion_job_stale_seconds: float = 300.0
+    # Documentos procesados en paralelo por job (1 = secuencial) y procesos para el parsing
+    ingestion_concurrency: int = 4
+    ingestion_parse_processes: int = 2
+
+    # Embeddings de documentos: lotes (Voyage admite 1000 textos / 320K tokens por petición)
+    embedding_batch_max_items: int = 128
+    embedding_batch_max_tokens: int = 100000
+    embedding_concurrency: int = 4
+    embedding_requests_per_minute: float = 300  # 0 = sin límite
+    embedding_max_retries: int = 5
+    embedding_retry_backoff_seconds: float = 1.0
+    # Escritura en bloque de embeddings: "copy" (COPY binario) o "insert" (INSERT multi-fila)
+    embedding_insert_method: str = "copy"
+    embedding_insert_batch_size: int = 1000
+
+    # Subidas: se vuelcan a disco por bloques y el pipeline lee ese archivo directamente
+    upload_chunk_size_bytes: int = 1024 * 1024
+    upload_spool_dir: Optional[str] = None  # None = directorio temporal del sistema
+    upload_spool_ttl_seconds: float = 3600
+    upload_concurrency: int = 8  # subidas simultáneas al storage por petición
+    # Caché de metadata de archivos del storage (tamaño, tipo) por ruta
+    file_info_cache_size: int = 4096
+    file_info_cache_ttl_seconds: int = 300
 
     class Config:
         env_file = f".env.{ENV}"
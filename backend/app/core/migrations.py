@@ -0,0 +1,109 @@
+"""
+Migraciones idempotentes del esquema.
+
+create_all solo crea tablas nuevas: las columnas e índices añadidos a tablas existentes
+se declaran aquí como sentencias seguras de re-ejecutar en cada arranque.
+"""
+from typing import List, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.modules.documents.models import text_search_expression
+
+
+# (nombre, sentencias) en orden de aplicación
+MIGRATIONS: List[Tuple[str, List[str]]] = [
+    (
+        "embeddings_user_id",
+        [
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS user_id INTEGER",
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_user_id ON embeddings (user_id)",
+            # Backfill de los embeddings creados antes de desnormalizar user_id
+            """
+            UPDATE embeddings AS e
+            SET user_id = d.user_id
+            FROM documents AS d
+            WHERE e.document_id = d.id
+              AND e.user_id IS NULL
+              AND d.user_id IS NOT NULL
+            """,
+        ],
+    ),
+    (
+        "users_corpus_version",
+        [
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS corpus_version INTEGER NOT NULL DEFAULT 0",
+        ],
+    ),
+    (
+        "content_hashes",
+        [
+            "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+            "CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash)",
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(50)",
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_dedup ON embeddings (user_id, embedding_model, content_hash)",
+            # Backfill: hasta ahora todos los embeddings se generaron con voyage-3.5
+            """
+            UPDATE embeddings
+            SET content_hash = encode(sha256(convert_to(text, 'UTF8')), 'hex'),
+                embedding_model = COALESCE(embedding_model, 'voyage-3.5')
+            WHERE content_hash IS NULL
+            """,
+        ],
+    ),
+    (
+        "embeddings_chunk_index",
+        [
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS chunk_index INTEGER",
+        ],
+    ),
+    (
+        "documents_pending_file",
+        [
+            "ALTER TABLE documents ADD COLUMN IF NOT EXISTS pending_file_path VARCHAR",
+            "ALTER TABLE documents ADD COLUMN IF NOT EXISTS pending_file_size_bytes INTEGER",
+        ],
+    ),
+    (
+        "documents_unique_filename_per_user",
+        [
+            # Renombrar duplicados previos (stem_<id>.ext) para poder crear el índice único
+            r"""
+            UPDATE documents AS d
+            SET filename = regexp_replace(d.filename, '(\.[^./]*)?$', '_' || d.id || '\1')
+            WHERE EXISTS (
+                SELECT 1 FROM documents AS o
+                WHERE o.user_id = d.user_id AND o.filename = d.filename AND o.id < d.id
+            )
+            """,
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_documents_user_filename ON documents (user_id, filename)",
+        ],
+    ),
+    (
+        "embeddings_text_search",
+        [
+            # Columna generada: Postgres la rellena para las filas existentes al añadirla
+            "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS text_search tsvector "
+            f"GENERATED ALWAYS AS ({text_search_expression()}) STORED",
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_text_search ON embeddings USING gin (text_search)",
+        ],
+    ),
+    (
+        "embeddings_meta_data_index",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_embeddings_meta_data ON embeddings USING gin (meta_data jsonb_path_ops)",
+        ],
+    ),
+]
+
+
+def run_migrations(engine: Engine) -> None:
+    """Aplica cada migración en su propia transacción"""
+    for name, statements in MIGRATIONS:
+        try:
+            with engine.begin() as conn:
+                for statement in statements:
+                    conn.execute(text(statement))
+        except Exception as e:
+            raise RuntimeError(f"Migration '{name}' failed: {e}") from e
@@ -1,6 +1,9 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 from app.core.database import init_db
+from app.core.clients import clients
+from app.core.environment import settings
 from fastapi.middleware.cors import CORSMiddleware
 from app.modules.auth import init_module as init_auth
 from app.modules.chat import init_module as init_chat
@@ -10,7 +13,26 @@ from app.modules.analytics import init_module as init_analytics
 from app.core.exceptions import register_core_exception_handlers
 from app.core.observability import ObservationMiddleware
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clientes de Voyage/OpenAI compartidos durante toda la vida de la app
+    await clients.startup()
+    # El reranker cross_encoder carga un modelo local: mejor antes de la primera consulta
+    from app.modules.chat.retrieval.reranker import get_reranker
+    get_reranker()
+    if settings.ingestion_background:
+        from app.modules.documents.jobs import ingestion_workers
+        ingestion_workers.start()
+    yield
+    if settings.ingestion_background:
+        ingestion_workers.stop(timeout=5)
+    # Subidas en disco que ningún worker llegó a indexar
+    from app.modules.documents.spool import spooled_files
+    spooled_files.clear()
+    await clients.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Dev CORS: Allow frontend origin with credentials
 app.add_middleware(
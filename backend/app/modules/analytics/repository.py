@@ -29,6 +29,44 @@ class AnalyticsRepository:
         self.db.refresh(event)
         return event
 
+    async def acreate_event(
+        self,
+        user_id: int,
+        event_type: EventType,
+        value: float,
+        meta: Optional[Dict[str, Any]] = None
+    ) -> AnalyticsEvent:
+        """Versión async de create_event (requiere un AsyncSession)"""
+        event = AnalyticsEvent(
+            user_id=user_id,
+            event_type=event_type.value,
+            value=value,
+            meta=meta
+        )
+        self.db.add(event)
+        await self.db.commit()
+        return event
+
+    async def acreate_events(
+        self,
+        user_id: int,
+        event_type: EventType,
+        events: List[Dict[str, Any]]
+    ) -> List[AnalyticsEvent]:
+        """Crea varios eventos ({"value", "meta"}) con un solo commit (requiere un AsyncSession)"""
+        created = [
+            AnalyticsEvent(
+                user_id=user_id,
+                event_type=event_type.value,
+                value=event["value"],
+                meta=event.get("meta")
+            )
+            for event in events
+        ]
+        self.db.add_all(created)
+        await self.db.commit()
+        return created
+
     def get_event_by_user_id(self, user_id: int) -> List[AnalyticsEvent]:
         """Obtener todos los eventos de analytics de un usuario específico"""
         return self.db.query(AnalyticsEvent).filter(AnalyticsEvent.user_id == user_id).all()
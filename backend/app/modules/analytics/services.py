@@ -4,6 +4,11 @@ from app.modules.analytics.repository import AnalyticsRepository
 from app.modules.analytics.types import EventType
 from app.modules.documents.repository import DocumentRepository
 
+
+# Tiempos por etapa que la recuperación guarda en la meta de los eventos RAG
+RETRIEVAL_STAGES = ("query_embedding_time", "retrieval_query_time", "rerank_time", "context_build_time")
+
+
 class AnalyticsService:
     def __init__(self, db_session):
         self.db_session = db_session
@@ -47,6 +52,29 @@ class AnalyticsService:
         llm_p95_value = llm_p95[math.ceil(0.95 * len(llm_p95)) - 1] if llm_p95 else 0
         response_p95_value = response_p95[math.ceil(0.95 * len(response_p95)) - 1] if response_p95 else 0
 
+        # STREAMING: solo los eventos de /chat/answer/stream traen time-to-first-token
+        ttft_values = [event.meta["llm_time_to_first_token"] for event in rag_events if event.meta and "llm_time_to_first_token" in event.meta]
+        llm_time_to_first_token_avg = sum(ttft_values) / len(ttft_values) if ttft_values else 0
+
+        # RETRIEVAL STAGES: desglose de vector_retrieval_time (los aciertos de caché no consultan la base de datos)
+        retrieval_stage_time_avg = {}
+        for stage in RETRIEVAL_STAGES:
+            stage_values = [event.meta[stage] for event in rag_events if event.meta and stage in event.meta]
+            retrieval_stage_time_avg[stage] = sum(stage_values) / len(stage_values) if stage_values else 0
+
+        # ANSWER CACHE
+        answer_cache_hits = sum(1 for event in rag_events if event.meta and event.meta.get("answer_cache_hit"))
+        answer_cache_hit_rate = answer_cache_hits / total_answers if total_answers else 0
+        answer_cache_saved_cost = sum(event.meta.get("answer_cache_saved_cost", 0) for event in rag_events if event.meta)
+
+        # QUERY EMBEDDING CACHE: preguntas que no llamaron a Voyage (solo eventos que lo registran)
+        embedding_cache_values = [event.meta["query_embedding_cache_hit"] for event in rag_events if event.meta and "query_embedding_cache_hit" in event.meta]
+        query_embedding_cache_hit_rate = sum(1 for hit in embedding_cache_values if hit) / len(embedding_cache_values) if embedding_cache_values else 0
+
+        # CONTEXT: tokens de entrada realmente enviados al LLM
+        input_token_values = [event.meta["llm_input_tokens"] for event in rag_events if event.meta and "llm_input_tokens" in event.meta]
+        llm_input_tokens_avg = sum(input_token_values) / len(input_token_values) if input_token_values else 0
+
 
         # DOCUMENT
         documents_repo= DocumentRepository(self.db_session)
@@ -69,7 +97,13 @@ class AnalyticsService:
                 "vector_retrieval_time_p95": vector_p95_value,
                 "llm_response_time_p95": llm_p95_value,
                 "response_time_p95": response_p95_value,
-                "total_indexing_cost": total_indexing_cost
+                "total_indexing_cost": total_indexing_cost,
+                "llm_time_to_first_token_avg": llm_time_to_first_token_avg,
+                "retrieval_stage_time_avg": retrieval_stage_time_avg,
+                "answer_cache_hit_rate": answer_cache_hit_rate,
+                "answer_cache_saved_cost": answer_cache_saved_cost,
+                "query_embedding_cache_hit_rate": query_embedding_cache_hit_rate,
+                "llm_input_tokens_avg": llm_input_tokens_avg
                }
 
 
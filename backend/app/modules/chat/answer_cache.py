@@ -0,0 +1,110 @@
+"""
+Caché semántica de respuestas por usuario.
+
+Una respuesta se reutiliza si la nueva consulta está dentro del umbral de similitud
+coseno de una consulta anterior del mismo usuario y su corpus no ha cambiado desde
+entonces (corpus_version, que se incrementa al indexar o eliminar documentos).
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.environment import settings
+
+
+@dataclass
+class CachedAnswer:
+    embedding: np.ndarray  # normalizado (norma 1)
+    result: Dict[str, Any]
+    corpus_version: int
+    llm_total_cost: float
+    created_at: float
+    similarity: float = 1.0
+
+
+class SemanticAnswerCache:
+
+    def __init__(self, similarity_threshold: float, max_entries_per_user: int, ttl_seconds: Optional[float] = None):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries_per_user = max_entries_per_user
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[int, "OrderedDict[int, CachedAnswer]"] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict_stale(self, user_entries: "OrderedDict[int, CachedAnswer]", corpus_version: int) -> None:
+        now = time.time()
+        stale = [
+            key for key, entry in user_entries.items()
+            if entry.corpus_version != corpus_version
+            or (self.ttl_seconds and now - entry.created_at > self.ttl_seconds)
+        ]
+        for key in stale:
+            del user_entries[key]
+
+    def lookup(self, user_id: int, embedding: List[float], corpus_version: int) -> Optional[CachedAnswer]:
+        """Devuelve la respuesta más similar por encima del umbral, o None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            user_entries = self._entries.get(user_id)
+            if not user_entries:
+                return None
+            self._evict_stale(user_entries, corpus_version)
+            if not user_entries:
+                return None
+
+            keys = list(user_entries.keys())
+            matrix = np.stack([user_entries[key].embedding for key in keys])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+
+            user_entries.move_to_end(keys[best])
+            entry = user_entries[keys[best]]
+            entry.similarity = float(similarities[best])
+            return entry
+
+    def store(
+        self,
+        user_id: int,
+        embedding: List[float],
+        corpus_version: int,
+        result: Dict[str, Any],
+        llm_total_cost: float,
+    ) -> None:
+        entry = CachedAnswer(
+            embedding=self._normalize(embedding),
+            result=result,
+            corpus_version=corpus_version,
+            llm_total_cost=llm_total_cost,
+            created_at=time.time(),
+        )
+        with self._lock:
+            user_entries = self._entries.setdefault(user_id, OrderedDict())
+            self._evict_stale(user_entries, corpus_version)
+            self._next_id += 1
+            user_entries[self._next_id] = entry
+            while len(user_entries) > self.max_entries_per_user:
+                user_entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+answer_cache = SemanticAnswerCache(
+    similarity_threshold=settings.answer_cache_similarity_threshold,
+    max_entries_per_user=settings.answer_cache_max_entries_per_user,
+    ttl_seconds=settings.answer_cache_ttl_seconds,
+)
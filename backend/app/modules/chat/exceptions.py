@@ -9,6 +9,11 @@ class ChunkRetrievalError(Exception):
 	def __init__(self, message: str = "Could not retrieve chunks from the database."):
 		super().__init__(message)
 
+class InvalidSearchCursor(Exception):
+	"""Exception for search cursors that are malformed or belong to another search."""
+	def __init__(self, message: str = "Invalid search cursor."):
+		super().__init__(message)
+
 
 # Exception handlers now live here (merged from handlers.py)
 from fastapi import status
@@ -28,3 +33,10 @@ def handle_chunk_retrieval_error(request, exc: ChunkRetrievalError):
 		content={"detail": str(exc)}
 	)
 
+
+
+def handle_invalid_search_cursor(request, exc: InvalidSearchCursor):
+	return JSONResponse(
+		status_code=status.HTTP_400_BAD_REQUEST,
+		content={"detail": str(exc)}
+	)
@@ -27,7 +27,7 @@ def calculate_indexing_cost(chunks):
     
 
 
-def calculate_prices(chunks, answer, query, request):
+def calculate_prices(chunks, answer, query, request, llm_input_tokens=None):
     price_per_1M_tokens_vector = 0.06  # Precio por 1000 tokens para recuperación vectorial
     price_per_1M_tokens_llm_input = 0.15  # gpt-4o-mini
     price_per_1M_tokens_llm_output = 0.60  # gpt-4o-mini
@@ -36,9 +36,11 @@ def calculate_prices(chunks, answer, query, request):
     encoder = tiktoken.get_encoding("cl100k_base")
     
     # Hallar el numero de tokens de todos los chunks y del query para saber el numero de tokens de input al llm
-    chunks_text = " ".join([chunk.get("text", "") for chunk in chunks])
-    llm_input_text = query + " " + chunks_text
-    llm_input_tokens = len(encoder.encode(llm_input_text))
+    # (si ya se contaron sobre el prompt enviado, se usa ese valor)
+    if llm_input_tokens is None:
+        chunks_text = " ".join([chunk.get("text", "") for chunk in chunks])
+        llm_input_text = query + " " + chunks_text
+        llm_input_tokens = len(encoder.encode(llm_input_text))
     
     # Hallar el numero de tokens del output del llm
     llm_output_tokens = len(encoder.encode(answer))
@@ -1,4 +1,10 @@
-from app.modules.chat.retrieval.retriever import retrieve_relevant_chunks
-from app.modules.chat.retrieval.generator import generate_answer
+from app.modules.chat.retrieval.retriever import retrieve_relevant_chunks, aretrieve_relevant_chunks
+from app.modules.chat.retrieval.generator import generate_answer, agenerate_answer, stream_answer
 
-__all__ = ["retrieve_relevant_chunks", "generate_answer"]
+__all__ = [
+    "retrieve_relevant_chunks",
+    "aretrieve_relevant_chunks",
+    "generate_answer",
+    "agenerate_answer",
+    "stream_answer",
+]
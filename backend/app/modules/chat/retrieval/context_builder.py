@@ -0,0 +1,146 @@
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import tiktoken
+
+from app.core.clients import ANSWER_PROMPT
+from app.core.environment import settings
+
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# Separator used by the stuff-documents chain between context documents
+DOCUMENT_SEPARATOR = "\n\n"
+
+
+@dataclass
+class ContextSelection:
+    """Chunks that will be sent to the LLM and what the selection cost"""
+    chunks: List[Dict[str, any]]
+    context_tokens: int
+    prompt_tokens: int
+    dropped_duplicates: int = 0
+    dropped_over_budget: int = 0
+    truncated: int = 0
+    build_time: float = 0.0
+
+    def to_meta(self) -> Dict[str, any]:
+        return {
+            "llm_input_tokens": self.prompt_tokens,
+            "context_tokens": self.context_tokens,
+            "context_chunks": len(self.chunks),
+            "context_dropped_duplicates": self.dropped_duplicates,
+            "context_dropped_over_budget": self.dropped_over_budget,
+            "context_truncated_chunks": self.truncated,
+            "context_build_time": self.build_time,
+        }
+
+
+_encoder = None
+
+
+def _count_tokens(text: str) -> int:
+    # Same encoding as calculate_prices (gpt-4o-mini input is billed close to cl100k_base)
+    global _encoder
+    if _encoder is None:
+        _encoder = tiktoken.get_encoding("cl100k_base")
+    return len(_encoder.encode(text, disallowed_special=()))
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    global _encoder
+    if _encoder is None:
+        _encoder = tiktoken.get_encoding("cl100k_base")
+    return _encoder.decode(_encoder.encode(text, disallowed_special=())[:max_tokens])
+
+
+def count_prompt_tokens(query: str, chunks: List[Dict[str, any]], count_tokens: Callable[[str], int] = _count_tokens) -> int:
+    """Tokens of the answer prompt exactly as the stuff-documents chain renders it"""
+    context = DOCUMENT_SEPARATOR.join(chunk["text"] for chunk in chunks)
+    return count_tokens(ANSWER_PROMPT.format(context=context, input=query))
+
+
+def _term_vectors(texts: List[str]) -> np.ndarray:
+    """L2-normalized term-frequency rows, so the dot product is the cosine similarity"""
+    tokenized = [[token.lower() for token in _TOKEN_PATTERN.findall(text)] for text in texts]
+    vocabulary = {term: i for i, term in enumerate(dict.fromkeys(t for tokens in tokenized for t in tokens))}
+    vectors = np.zeros((len(texts), max(len(vocabulary), 1)))
+    for row, tokens in enumerate(tokenized):
+        for token in tokens:
+            vectors[row, vocabulary[token]] += 1
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def build_context(
+    query: str,
+    chunks: List[Dict[str, any]],
+    token_budget: Optional[int] = None,
+    max_chunks: Optional[int] = None,
+    mmr_lambda: Optional[float] = None,
+    duplicate_similarity: Optional[float] = None,
+    count_tokens: Callable[[str], int] = _count_tokens,
+    truncate: Callable[[str, int], str] = _truncate,
+) -> ContextSelection:
+    """
+    Selects the chunks to send to the LLM.
+
+    Chunks are picked by maximal marginal relevance: relevance is the position in the
+    incoming ranking and redundancy the term-vector similarity to the chunks already picked.
+    Near-duplicates (overlapping or repeated passages) are skipped, and chunks are added
+    while they fit in the context token budget; the chunk that crosses the budget is
+    truncated when enough room is left for it to be useful.
+    """
+    start = time.time()
+    token_budget = token_budget or settings.context_token_budget
+    max_chunks = max_chunks or settings.context_max_chunks
+    mmr_lambda = settings.context_mmr_lambda if mmr_lambda is None else mmr_lambda
+    duplicate_similarity = settings.context_duplicate_similarity if duplicate_similarity is None else duplicate_similarity
+
+    selection = ContextSelection(chunks=[], context_tokens=0, prompt_tokens=0)
+    if chunks:
+        # Chunks arrive best-first (retrieval or rerank order): relevance follows that order
+        # so the MMR step does not undo the reranker
+        relevance = 1.0 - np.arange(len(chunks)) / len(chunks)
+        similarity = _term_vectors([chunk["text"] for chunk in chunks])
+        similarity = similarity @ similarity.T
+
+        remaining = list(range(len(chunks)))
+        picked: List[int] = []
+        # Separators count against the budget as well
+        separator_tokens = count_tokens(DOCUMENT_SEPARATOR)
+        while remaining and len(selection.chunks) < max_chunks:
+            if picked:
+                redundancy = similarity[np.ix_(remaining, picked)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining))
+            scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+            best = int(np.argmax(scores))
+            index = remaining.pop(best)
+
+            if picked and redundancy[best] >= duplicate_similarity:
+                selection.dropped_duplicates += 1
+                continue
+
+            chunk = chunks[index]
+            cost = count_tokens(chunk["text"]) + (separator_tokens if selection.chunks else 0)
+            available = token_budget - selection.context_tokens
+            if cost > available:
+                if available < settings.context_min_chunk_tokens and selection.chunks:
+                    selection.dropped_over_budget += 1
+                    continue
+                # Keep the beginning of the chunk: sources are split on headings
+                chunk = {**chunk, "text": truncate(chunk["text"], available - (separator_tokens if selection.chunks else 0))}
+                cost = count_tokens(chunk["text"]) + (separator_tokens if selection.chunks else 0)
+                selection.truncated += 1
+
+            picked.append(index)
+            selection.chunks.append(chunk)
+            selection.context_tokens += cost
+
+    selection.prompt_tokens = count_prompt_tokens(query, selection.chunks, count_tokens)
+    selection.build_time = time.time() - start
+    return selection
@@ -1,36 +1,33 @@
-from typing import Dict, List
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from typing import Dict, Iterator, List
 from langchain.schema import Document
-from app.core.environment import settings
+from app.core.clients import clients
+
+
+def _chain_input(query: str, chunks: List[Dict[str, any]]) -> Dict[str, any]:
+    documents = [Document(page_content=chunk["text"], metadata=chunk.get("metadata", {})) for chunk in chunks]
+    return {
+        "input": query,
+        "context": documents
+    }
 
 
 def generate_answer(query: str, chunks: List[Dict[str, any]]) -> Dict[str, any]:
     try:
-        llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.0,
-            api_key=settings.OPENAI_API_KEY
-        )
-        prompt = ChatPromptTemplate.from_template(
-            """
-            Use the following context to answer the question.
-            If the answer is not in the context, say: "I don't have that information."
-
-            Context:
-            {context}
-
-            Question:
-            {input}
-            """
-        )
-        documents = [Document(page_content=chunk["text"], metadata=chunk.get("metadata", {})) for chunk in chunks]
-        combine_docs_chain = create_stuff_documents_chain(llm=llm, prompt=prompt)
-        result = combine_docs_chain.invoke({
-            "input": query,
-            "context": documents
-        })
+        combine_docs_chain = clients.answer_chain
+        result = combine_docs_chain.invoke(_chain_input(query, chunks))
+        return {
+            "answer": result,
+            "sources": chunks, 
+        }
+    except Exception as e:
+        from app.modules.chat.exceptions import LLMServiceError
+        raise LLMServiceError(f"Error invoking the LLM: {str(e)}")
+
+
+async def agenerate_answer(query: str, chunks: List[Dict[str, any]]) -> Dict[str, any]:
+    try:
+        combine_docs_chain = clients.answer_chain
+        result = await combine_docs_chain.ainvoke(_chain_input(query, chunks))
         return {
             "answer": result,
             "sources": chunks, 
@@ -38,3 +35,15 @@ def generate_answer(query: str, chunks: List[Dict[str, any]]) -> Dict[str, any]:
     except Exception as e:
         from app.modules.chat.exceptions import LLMServiceError
         raise LLMServiceError(f"Error invoking the LLM: {str(e)}")
+
+
+def stream_answer(query: str, chunks: List[Dict[str, any]]) -> Iterator[str]:
+    """Yields the answer text as the LLM produces it"""
+    try:
+        combine_docs_chain = clients.answer_chain
+        for token in combine_docs_chain.stream(_chain_input(query, chunks)):
+            if token:
+                yield token
+    except Exception as e:
+        from app.modules.chat.exceptions import LLMServiceError
+        raise LLMServiceError(f"Error invoking the LLM: {str(e)}")
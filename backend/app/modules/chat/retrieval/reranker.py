@@ -0,0 +1,242 @@
+import asyncio
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.environment import settings
+
+
+RERANKERS = ("none", "lexical", "cross_encoder")
+
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+
+
+class Reranker(ABC):
+    """Scores (query, chunk) pairs in one batch; higher scores rank first"""
+
+    @abstractmethod
+    def score(self, query: str, chunks: List[Dict[str, any]]) -> np.ndarray:
+        ...
+
+
+class LexicalReranker(Reranker):
+    """
+    Deterministic BM25 reranker over the candidate set, blended with the vector similarity.
+
+    IDF and average length come from the candidates themselves, so it needs no index
+    or model. The blend keeps the semantic signal for questions that share few words
+    with their answer: with no term overlap the vector order is preserved.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, lexical_weight: Optional[float] = None):
+        self.k1 = k1
+        self.b = b
+        self.lexical_weight = settings.rerank_lexical_weight if lexical_weight is None else lexical_weight
+
+    def score(self, query: str, chunks: List[Dict[str, any]]) -> np.ndarray:
+        similarity = np.array([1.0 - chunk["cosine_distance"] for chunk in chunks])
+        terms = list(dict.fromkeys(_tokenize(query)))
+        if not terms:
+            return similarity
+
+        # Term frequency matrix (chunks x query terms)
+        term_index = {term: i for i, term in enumerate(terms)}
+        tf = np.zeros((len(chunks), len(terms)))
+        lengths = np.zeros(len(chunks))
+        for row, chunk in enumerate(chunks):
+            tokens = _tokenize(chunk["text"])
+            lengths[row] = len(tokens)
+            for token in tokens:
+                column = term_index.get(token)
+                if column is not None:
+                    tf[row, column] += 1
+
+        n = len(chunks)
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        length_norm = 1 - self.b + self.b * lengths / max(lengths.mean(), 1.0)
+        bm25 = (idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm[:, None])).sum(axis=1)
+
+        top = bm25.max()
+        lexical = bm25 / top if top > 0 else bm25
+        return (1 - self.lexical_weight) * similarity + self.lexical_weight * lexical
+
+
+class CrossEncoderReranker(Reranker):
+    """Local CPU cross-encoder (requires the optional sentence-transformers package)"""
+
+    def __init__(self, model_name: Optional[str] = None):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise RuntimeError("RERANKER=cross_encoder requires the sentence-transformers package") from e
+        self.model = CrossEncoder(model_name or settings.cross_encoder_model, device="cpu")
+
+    def score(self, query: str, chunks: List[Dict[str, any]]) -> np.ndarray:
+        pairs = [(query, chunk["text"]) for chunk in chunks]
+        return np.asarray(self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False))
+
+
+def _tokenize(text: str) -> List[str]:
+    return [token.lower() for token in _TOKEN_PATTERN.findall(text)]
+
+
+_reranker: Optional[Reranker] = None
+_reranker_lock = threading.Lock()
+_rerank_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_reranker() -> Optional[Reranker]:
+    """Configured reranker, created on first use (the cross-encoder loads a model)"""
+    global _reranker
+    name = settings.reranker.lower()
+    if name not in RERANKERS:
+        raise ValueError(f"Unsupported reranker: {name}")
+    if name == "none":
+        return None
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker() if name == "cross_encoder" else LexicalReranker()
+    return _reranker
+
+
+def _get_rerank_executor() -> ThreadPoolExecutor:
+    # Dedicated threads: a scoring call that blows the budget keeps running here
+    # without holding up the request that gave up on it
+    global _rerank_executor
+    if _rerank_executor is None:
+        with _reranker_lock:
+            if _rerank_executor is None:
+                _rerank_executor = ThreadPoolExecutor(max_workers=settings.rerank_workers, thread_name_prefix="rerank")
+    return _rerank_executor
+
+
+def rerank_candidate_count(top_k: int) -> int:
+    """Chunks to retrieve before reranking down to top_k"""
+    if settings.reranker.lower() == "none":
+        return top_k
+    return max(top_k, settings.rerank_candidates)
+
+
+def _apply_scores(chunks: List[Dict[str, any]], scores: np.ndarray, top_k: int) -> List[Dict[str, any]]:
+    # Stable sort: equal scores keep the retrieval order
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [chunks[i] for i in order]
+
+
+def _record_rerank_stats(stats: Optional[Dict], start: float, fallback: bool) -> None:
+    if stats is not None:
+        stats["rerank_time"] = time.time() - start
+        stats["rerank_fallback"] = fallback
+
+
+def rerank_chunks(query: str, chunks: List[Dict[str, any]], top_k: int, stats: Optional[Dict] = None) -> List[Dict[str, any]]:
+    """
+    Reorders the over-fetched candidates and trims them to top_k.
+
+    If scoring fails or exceeds settings.rerank_timeout_ms the retrieval order is kept.
+    """
+    reranker = get_reranker()
+    if reranker is None or len(chunks) <= 1:
+        return chunks[:top_k]
+
+    start = time.time()
+    future = _get_rerank_executor().submit(reranker.score, query, chunks)
+    try:
+        scores = future.result(timeout=settings.rerank_timeout_ms / 1000)
+    except FutureTimeoutError:
+        _record_rerank_stats(stats, start, fallback=True)
+        return chunks[:top_k]
+    except Exception as e:
+        print(f"Warning: Reranking failed, keeping retrieval order: {e}")
+        _record_rerank_stats(stats, start, fallback=True)
+        return chunks[:top_k]
+
+    _record_rerank_stats(stats, start, fallback=False)
+    return _apply_scores(chunks, scores, top_k)
+
+
+async def arerank_chunks(query: str, chunks: List[Dict[str, any]], top_k: int, stats: Optional[Dict] = None) -> List[Dict[str, any]]:
+    """Async version of rerank_chunks: scoring runs off the event loop"""
+    reranker = get_reranker()
+    if reranker is None or len(chunks) <= 1:
+        return chunks[:top_k]
+
+    start = time.time()
+    loop = asyncio.get_running_loop()
+    try:
+        scores = await asyncio.wait_for(
+            loop.run_in_executor(_get_rerank_executor(), reranker.score, query, chunks),
+            timeout=settings.rerank_timeout_ms / 1000,
+        )
+    except asyncio.TimeoutError:
+        _record_rerank_stats(stats, start, fallback=True)
+        return chunks[:top_k]
+    except Exception as e:
+        print(f"Warning: Reranking failed, keeping retrieval order: {e}")
+        _record_rerank_stats(stats, start, fallback=True)
+        return chunks[:top_k]
+
+    _record_rerank_stats(stats, start, fallback=False)
+    return _apply_scores(chunks, scores, top_k)
+
+
+async def arerank_chunks_batch(
+    queries: List[str],
+    chunk_lists: List[List[Dict[str, any]]],
+    top_k: int,
+    item_stats: Optional[List[Dict]] = None,
+) -> List[List[Dict[str, any]]]:
+    """
+    Reranks the candidates of several queries in a single executor call.
+
+    Per-query calls would queue on the small rerank pool and spend their own timeout
+    waiting there. Instead the batch gets rerank_timeout_ms per query to score; queries
+    still unscored when that budget runs out keep the retrieval order. item_stats (one
+    dict per query) receives rerank_time and rerank_fallback.
+    """
+    results = [chunks[:top_k] for chunks in chunk_lists]
+    reranker = get_reranker()
+    pending = [i for i, chunks in enumerate(chunk_lists) if len(chunks) > 1]
+    if reranker is None or not pending:
+        return results
+
+    scores: List[Optional[np.ndarray]] = [None] * len(chunk_lists)
+    cancelled = threading.Event()
+
+    def score_all() -> None:
+        for i in pending:
+            if cancelled.is_set():
+                return
+            try:
+                scores[i] = reranker.score(queries[i], chunk_lists[i])
+            except Exception as e:
+                print(f"Warning: Reranking failed, keeping retrieval order: {e}")
+
+    start = time.time()
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(
+            loop.run_in_executor(_get_rerank_executor(), score_all),
+            timeout=settings.rerank_timeout_ms / 1000 * len(pending),
+        )
+    except asyncio.TimeoutError:
+        # The thread stops before its next query
+        cancelled.set()
+
+    # The batch time is spread over its queries so averages stay per query
+    rerank_time = (time.time() - start) / len(pending)
+    for i in pending:
+        query_scores = scores[i]
+        if query_scores is not None:
+            results[i] = _apply_scores(chunk_lists[i], query_scores, top_k)
+        if item_stats is not None:
+            item_stats[i]["rerank_time"] = rerank_time
+            item_stats[i]["rerank_fallback"] = query_scores is None
+    return results
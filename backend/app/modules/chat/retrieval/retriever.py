@@ -1,8 +1,30 @@
-from typing import List, Dict
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, List, Dict, Optional, Tuple
 from app.modules.documents.indexing_pipeline.embeddings.embedder import Embedder
-from sqlalchemy import select, func
-from app.modules.documents.models import Embedding, Document
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Integer, and_, or_, select, func, bindparam, cast, column, literal, true, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.modules.documents.models import EMBEDDING_DIMENSIONS, Embedding, embedding_column_type
+from app.modules.documents.vector_index import (
+    apply_vector_search_params,
+    binary_quantized,
+    candidate_count,
+    get_storage_mode,
+    vector_search_params,
+)
+from sqlalchemy.orm import Session
 from app.core.database import SessionLocal
+from app.core.environment import settings
+from app.modules.chat.retrieval.reranker import arerank_chunks, arerank_chunks_batch, rerank_candidate_count, rerank_chunks
+
+
+RETRIEVAL_MODES = ("vector", "hybrid")
+
+# Words and identifiers (policy numbers, error codes, SKUs such as "AB-1234" or "v2.1")
+_LEXICAL_TERM_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+_IDENTIFIER_PUNCTUATION = re.compile(r"[-./:]")
 
 
 def _normalize_relevance_score(raw_score: float) -> float:
@@ -27,7 +49,278 @@ def _normalize_relevance_score(raw_score: float) -> float:
         return 95 + ((raw_score - 50) / 50) * 5
 
 
-def retrieve_relevant_chunks(query: str, user_id: int, top_k: int = 5) -> List[Dict[str, any]]:
+def _user_filter(user_id: int):
+    # user_id inline (literal_execute) so the planner can match per-user partial indexes
+    return Embedding.user_id == bindparam("user_id", user_id, literal_execute=True)
+
+
+def _binary_candidates(query_embedding, user_filter, limit: int, lateral: bool = False):
+    # Binary mode: the Hamming index over the quantized vectors picks the candidates
+    # that are then rescored with the full-precision cosine distance
+    query_bits = binary_quantized(cast(query_embedding, Vector(EMBEDDING_DIMENSIONS)))
+    candidates = (
+        select(Embedding.id)
+        .where(user_filter)
+        .order_by(binary_quantized(Embedding.embedding).op("<~>")(query_bits))
+        .limit(candidate_count(limit))
+    )
+    if lateral:
+        # Inside a LATERAL the candidates depend on the outer query row; embeddings stays
+        # in its own FROM even when the outer statement also joins it
+        return candidates.correlate_except(Embedding).lateral()
+    return candidates.subquery()
+
+
+def _build_vector_query(query_embedding: List[float], user_id: int, top_k: int):
+    # Calculate cosine distance for ordering and relevance scoring
+    distance_calc = Embedding.embedding.cosine_distance(query_embedding)
+    user_filter = _user_filter(user_id)
+
+    if get_storage_mode() != "binary":
+        return (
+            select(Embedding, distance_calc.label('cosine_distance'))
+            .where(user_filter)
+            .order_by(distance_calc)
+            .limit(top_k)
+        )
+
+    candidates = _binary_candidates(query_embedding, user_filter, top_k)
+    return (
+        select(Embedding, distance_calc.label('cosine_distance'))
+        .join(candidates, Embedding.id == candidates.c.id)
+        .order_by(distance_calc)
+        .limit(top_k)
+    )
+
+
+def _build_batch_vector_query(query_embeddings: List[List[float]], user_id: int, top_k: int):
+    """
+    Nearest chunks of several queries in one statement.
+
+    The query vectors go in a VALUES list and a LATERAL subquery runs the same
+    ORDER BY distance LIMIT top_k (index scan) for each of them.
+    """
+    queries = values(
+        column("query_index", Integer),
+        column("query_embedding", Vector(EMBEDDING_DIMENSIONS)),
+        name="queries",
+    ).data([(i, embedding) for i, embedding in enumerate(query_embeddings)])
+    # VALUES parameters arrive untyped: cast them to the column type so the ANN index applies
+    query_vector = cast(queries.c.query_embedding, embedding_column_type(get_storage_mode()))
+    distance_calc = Embedding.embedding.cosine_distance(query_vector)
+    user_filter = _user_filter(user_id)
+
+    nearest = select(Embedding.id, distance_calc.label("cosine_distance")).where(user_filter)
+    if get_storage_mode() == "binary":
+        candidates = _binary_candidates(query_vector, user_filter, top_k, lateral=True)
+        nearest = select(Embedding.id, distance_calc.label("cosine_distance")).join(
+            candidates, Embedding.id == candidates.c.id
+        )
+    nearest = nearest.order_by(distance_calc).limit(top_k).correlate_except(Embedding).lateral("nearest")
+
+    return (
+        select(queries.c.query_index, Embedding, nearest.c.cosine_distance)
+        .select_from(queries)
+        .join(nearest, true())
+        .join(Embedding, Embedding.id == nearest.c.id)
+        .order_by(queries.c.query_index, nearest.c.cosine_distance)
+    )
+
+
+def _build_search_query(
+    query_embedding: List[float],
+    user_id: int,
+    limit: int,
+    meta_filter: Optional[Dict[str, Any]] = None,
+    after: Optional[Tuple[float, int]] = None,
+    seen: int = 0,
+):
+    """
+    One page of chunks ordered by (cosine distance, id), starting after the `after` key.
+
+    The inner query orders by (distance, id) as well, so LIMIT cuts groups of equal
+    distances (chunks with identical text share one vector) at the same place as the
+    keyset condition; Postgres still walks the ANN index by distance and only sorts
+    within ties (incremental sort). The metadata filter is a JSONB containment
+    (meta_data @> filter) served by the jsonb_path_ops GIN index.
+    """
+    distance_calc = Embedding.embedding.cosine_distance(query_embedding)
+    filters = [_user_filter(user_id)]
+    if meta_filter:
+        filters.append(Embedding.meta_data.contains(meta_filter))
+    keyset = []
+    if after is not None:
+        after_distance, after_id = after
+        keyset.append(or_(
+            distance_calc > after_distance,
+            and_(distance_calc == after_distance, Embedding.id > after_id),
+        ))
+
+    page = select(Embedding.id, distance_calc.label("cosine_distance"))
+    if get_storage_mode() == "binary":
+        # Enough Hamming candidates to cover the previous pages plus this one
+        candidates = _binary_candidates(query_embedding, and_(*filters), seen + limit)
+        page = page.join(candidates, Embedding.id == candidates.c.id).where(*keyset)
+    else:
+        page = page.where(*filters, *keyset)
+    page = page.order_by(distance_calc, Embedding.id).limit(limit).subquery("page")
+
+    return (
+        select(Embedding, page.c.cosine_distance)
+        .join(page, Embedding.id == page.c.id)
+        .order_by(page.c.cosine_distance, Embedding.id)
+    )
+
+
+def _lexical_query(query: str) -> Optional[str]:
+    """
+    to_tsquery expression matching any of the query terms.
+
+    OR semantics: a question only shares a few words with the passage that answers it.
+    When the query contains identifiers (terms with digits or inner punctuation) only
+    those are searched, since Postgres ranking has no IDF and common words would
+    otherwise outrank the exact match. Stopwords are dropped by to_tsquery itself when
+    text_search_config is a language configuration. Each term is quoted so punctuation
+    inside identifiers is not parsed as an operator.
+    """
+    terms = dict.fromkeys(term.lower() for term in _LEXICAL_TERM_PATTERN.findall(query))
+    identifiers = [term for term in terms if any(c.isdigit() for c in term) or _IDENTIFIER_PUNCTUATION.search(term)]
+    terms = identifiers or [term for term in terms if len(term) > 2]
+    if not terms:
+        return None
+    return " | ".join(f"'{term}'" for term in terms)
+
+
+def _build_hybrid_query(query_embedding: List[float], lexical_query: str, user_id: int, top_k: int):
+    """
+    Vector and full-text candidates fused with reciprocal rank fusion in a single statement.
+
+    Each leg returns its best hybrid_candidates ids; a chunk scores sum(1 / (k + rank))
+    over the legs that found it, so exact identifier matches surface even when their
+    embedding is not among the nearest ones.
+    """
+    limit = settings.hybrid_candidates
+    rrf_k = settings.hybrid_rrf_k
+    user_filter = _user_filter(user_id)
+    distance_calc = Embedding.embedding.cosine_distance(query_embedding)
+
+    vector_leg = select(Embedding.id, distance_calc.label("cosine_distance")).where(user_filter)
+    if get_storage_mode() == "binary":
+        candidates = _binary_candidates(query_embedding, user_filter, limit)
+        vector_leg = select(Embedding.id, distance_calc.label("cosine_distance")).join(
+            candidates, Embedding.id == candidates.c.id
+        )
+    vector_leg = vector_leg.order_by(distance_calc).limit(limit).subquery("vector_leg")
+
+    ts_query = func.to_tsquery(settings.text_search_config, lexical_query)
+    # Normalization 1 divides by 1 + log(length) so long chunks do not win on term count alone
+    lexical_rank_calc = func.ts_rank_cd(Embedding.text_search, ts_query, 1)
+    lexical_leg = (
+        select(Embedding.id, lexical_rank_calc.label("lexical_score"))
+        .where(user_filter, Embedding.text_search.op("@@")(ts_query))
+        .order_by(lexical_rank_calc.desc())
+        .limit(limit)
+        .subquery("lexical_leg")
+    )
+
+    vector_ranked = select(
+        vector_leg.c.id,
+        func.row_number().over(order_by=vector_leg.c.cosine_distance).label("rank"),
+    ).subquery("vector_ranked")
+    lexical_ranked = select(
+        lexical_leg.c.id,
+        func.row_number().over(order_by=lexical_leg.c.lexical_score.desc()).label("rank"),
+    ).subquery("lexical_ranked")
+
+    rrf_score = (
+        func.coalesce(literal(1.0) / (rrf_k + vector_ranked.c.rank), 0)
+        + func.coalesce(literal(1.0) / (rrf_k + lexical_ranked.c.rank), 0)
+    )
+    fused = (
+        select(
+            func.coalesce(vector_ranked.c.id, lexical_ranked.c.id).label("id"),
+            vector_ranked.c.rank.label("vector_rank"),
+            lexical_ranked.c.rank.label("lexical_rank"),
+            rrf_score.label("rrf_score"),
+        )
+        .select_from(vector_ranked.outerjoin(lexical_ranked, vector_ranked.c.id == lexical_ranked.c.id, full=True))
+        .order_by(rrf_score.desc())
+        .limit(top_k)
+        .subquery("fused")
+    )
+
+    # Lexical-only hits still get their cosine distance for the relevance score
+    return (
+        select(
+            Embedding,
+            distance_calc.label("cosine_distance"),
+            fused.c.vector_rank,
+            fused.c.lexical_rank,
+        )
+        .join(fused, Embedding.id == fused.c.id)
+        .order_by(fused.c.rrf_score.desc())
+    )
+
+
+def _build_retrieval_query(query: str, query_embedding: List[float], user_id: int, top_k: int):
+    """Returns the statement for the configured retrieval mode and the top_k to tune the ANN search for"""
+    mode = settings.retrieval_mode.lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unsupported retrieval mode: {mode}")
+
+    lexical_query = _lexical_query(query) if mode == "hybrid" else None
+    if lexical_query is None:
+        return _build_vector_query(query_embedding, user_id, top_k), top_k
+    stmt = _build_hybrid_query(query_embedding, lexical_query, user_id, top_k)
+    return stmt, max(top_k, settings.hybrid_candidates)
+
+
+def _record_retrieval_stats(stats: Optional[Dict], results, query_start: float) -> None:
+    if stats is None:
+        return
+    stats["retrieval_query_time"] = time.time() - query_start
+    stats["retrieval_mode"] = settings.retrieval_mode.lower()
+    # Which leg contributed each returned chunk (hybrid statements only)
+    if results and "lexical_rank" in results[0]._fields:
+        stats["hybrid_vector_hits"] = sum(1 for row in results if row.vector_rank is not None)
+        stats["hybrid_lexical_hits"] = sum(1 for row in results if row.lexical_rank is not None)
+
+
+def _rows_to_chunks(results) -> List[Dict[str, any]]:
+    chunks = []
+    
+    for row in results:
+        embedding_obj = row[0]
+        cosine_distance = float(row[1])
+        
+        # Convert cosine distance to similarity score (0-100%, higher = more relevant)
+        # Cosine similarity = 1 - cosine distance
+        raw_score = (1.0 - cosine_distance) * 100
+        
+        # Apply custom normalization
+        relevance_score = _normalize_relevance_score(raw_score)
+        
+        chunks.append({
+            "text": embedding_obj.text,
+            "metadata": embedding_obj.meta_data,
+            "document_id": embedding_obj.document_id,
+            "relevance_score": round(relevance_score, 2),
+            "cosine_distance": round(cosine_distance, 4)
+        })
+    
+    return chunks
+
+
+def retrieve_relevant_chunks(
+    query: str,
+    user_id: int,
+    top_k: int = 5,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    query_embedding: Optional[List[float]] = None,
+    db: Optional[Session] = None,
+    stats: Optional[Dict] = None,
+) -> List[Dict[str, any]]:
     """
     Retrieve the most relevant chunks for a given query from the user's documents.
     
@@ -35,49 +328,192 @@ def retrieve_relevant_chunks(query: str, user_id: int, top_k: int = 5) -> List[D
         query: The search query
         user_id: The ID of the user to filter documents by
         top_k: Number of top results to return
+        ef_search: HNSW candidate list size for this query (defaults to settings.hnsw_ef_search)
+        probes: IVFFlat lists to scan for this query (defaults to settings.ivfflat_probes)
+        query_embedding: Precomputed embedding of the query (skips the embedding call)
+        db: Request session to reuse; without it a short-lived session is opened
+        stats: Optional dict (e.g. the analytics meta) that receives per-stage timings
     
+    With settings.retrieval_mode == "hybrid" the vector and full-text candidates are
+    fused with reciprocal rank fusion in the same statement. With a reranker configured,
+    settings.rerank_candidates chunks are fetched and reranked down to top_k.
+
     Returns chunks with relevance scores calculated from cosine similarity:
     - relevance_score: cosine similarity (0-1, higher is more relevant)
     - cosine_distance: raw cosine distance (lower is more similar)
     """
     try:
-        query_embedding = Embedder.generate_embedding_from_question(query)
+        if query_embedding is None:
+            embedding_start = time.time()
+            query_embedding = Embedder.generate_embedding_from_question(query, stats)
+            if stats is not None:
+                stats["query_embedding_time"] = time.time() - embedding_start
         
-        # Calculate cosine distance for ordering and relevance scoring
-        distance_calc = Embedding.embedding.cosine_distance(query_embedding)
+        stmt, search_top_k = _build_retrieval_query(query, query_embedding, user_id, rerank_candidate_count(top_k))
         
-        stmt = (
-            select(Embedding, distance_calc.label('cosine_distance'))
-            .join(Document, Embedding.document_id == Document.id)
-            .where(Document.user_id == user_id)
-            .order_by(distance_calc)
-            .limit(top_k)
-        )
+        if db is not None:
+            # Una sola conexión por petición: los parámetros son locales a la transacción
+            query_start = time.time()
+            apply_vector_search_params(db, ef_search=ef_search, probes=probes, top_k=search_top_k)
+            results = db.execute(stmt).all()
+        else:
+            with SessionLocal() as session:
+                query_start = time.time()
+                apply_vector_search_params(session, ef_search=ef_search, probes=probes, top_k=search_top_k)
+                results = session.execute(stmt).all()
+        _record_retrieval_stats(stats, results, query_start)
+    except Exception as e:
+        from app.modules.chat.exceptions import ChunkRetrievalError
+        raise ChunkRetrievalError(f"Error retrieving chunks from the database: {str(e)}")
+
+    return rerank_chunks(query, _rows_to_chunks(results), top_k, stats)
+
+
+async def aretrieve_relevant_chunks(
+    query: str,
+    user_id: int,
+    db: AsyncSession,
+    top_k: int = 5,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    query_embedding: Optional[List[float]] = None,
+    stats: Optional[Dict] = None,
+    rerank: bool = True,
+) -> List[Dict[str, any]]:
+    """
+    Async version of retrieve_relevant_chunks that runs the retrieval query on the given AsyncSession.
+
+    With rerank=False the over-fetched candidates are returned as retrieved, for callers
+    that rerank them themselves.
+    """
+    try:
+        if query_embedding is None:
+            embedding_start = time.time()
+            query_embedding = await Embedder.agenerate_embedding_from_question(query, stats)
+            if stats is not None:
+                stats["query_embedding_time"] = time.time() - embedding_start
         
-        with SessionLocal() as session:
-            results = session.execute(stmt).all()
-            chunks = []
-            
-            for row in results:
-                embedding_obj = row[0]
-                cosine_distance = float(row[1])
-                
-                # Convert cosine distance to similarity score (0-100%, higher = more relevant)
-                # Cosine similarity = 1 - cosine distance
-                raw_score = (1.0 - cosine_distance) * 100
-                
-                # Apply custom normalization
-                relevance_score = _normalize_relevance_score(raw_score)
-                
-                chunks.append({
-                    "text": embedding_obj.text,
-                    "metadata": embedding_obj.meta_data,
-                    "document_id": embedding_obj.document_id,
-                    "relevance_score": round(relevance_score, 2),
-                    "cosine_distance": round(cosine_distance, 4)
-                })
+        stmt, search_top_k = _build_retrieval_query(query, query_embedding, user_id, rerank_candidate_count(top_k))
         
+        # Search params are transaction-local: run them in the same transaction as the query
+        query_start = time.time()
+        for param_stmt, params in vector_search_params(ef_search=ef_search, probes=probes, top_k=search_top_k):
+            await db.execute(param_stmt, params)
+        results = (await db.execute(stmt)).all()
+        await db.commit()
+        _record_retrieval_stats(stats, results, query_start)
+    except Exception as e:
+        from app.modules.chat.exceptions import ChunkRetrievalError
+        raise ChunkRetrievalError(f"Error retrieving chunks from the database: {str(e)}")
+
+    chunks = _rows_to_chunks(results)
+    if not rerank:
         return chunks
+    return await arerank_chunks(query, chunks, top_k, stats)
+
+
+async def aretrieve_relevant_chunks_batch(
+    queries: List[str],
+    query_embeddings: List[List[float]],
+    user_id: int,
+    db: AsyncSession,
+    top_k: int = 5,
+    stats: Optional[Dict] = None,
+    item_stats: Optional[List[Dict]] = None,
+) -> List[List[Dict[str, any]]]:
+    """
+    Retrieves the chunks of several queries, in the same order as the queries.
+
+    In vector mode all lookups run as one LATERAL statement; hybrid mode runs its
+    per-query fusion statement for each query on the same session. Reranking runs
+    once for the whole batch; item_stats (one dict per query) gets its rerank stats.
+    """
+    if not queries:
+        return []
+    fetch_k = rerank_candidate_count(top_k)
+
+    if settings.retrieval_mode.lower() == "hybrid":
+        query_start = time.time()
+        chunk_lists = []
+        for query, query_embedding in zip(queries, query_embeddings):
+            chunk_lists.append(await aretrieve_relevant_chunks(
+                query, user_id=user_id, db=db, top_k=top_k, query_embedding=query_embedding, rerank=False
+            ))
+        if stats is not None:
+            stats["retrieval_query_time"] = time.time() - query_start
+            stats["retrieval_mode"] = "hybrid"
+        return await arerank_chunks_batch(queries, chunk_lists, top_k, item_stats)
+
+    try:
+        stmt = _build_batch_vector_query(query_embeddings, user_id, fetch_k)
+        query_start = time.time()
+        for param_stmt, params in vector_search_params(top_k=fetch_k):
+            await db.execute(param_stmt, params)
+        results = (await db.execute(stmt)).all()
+        await db.commit()
+        if stats is not None:
+            stats["retrieval_query_time"] = time.time() - query_start
+            stats["retrieval_mode"] = "vector"
+    except Exception as e:
+        from app.modules.chat.exceptions import ChunkRetrievalError
+        raise ChunkRetrievalError(f"Error retrieving chunks from the database: {str(e)}")
+
+    rows_by_query = [[] for _ in queries]
+    for row in results:
+        rows_by_query[row[0]].append(row[1:])
+
+    chunk_lists = [_rows_to_chunks(rows) for rows in rows_by_query]
+    return await arerank_chunks_batch(queries, chunk_lists, top_k, item_stats)
+
+
+@dataclass
+class SearchPage:
+    chunks: List[Dict[str, any]]
+    # (cosine distance, chunk id) of the last chunk when there are more results
+    next_after: Optional[Tuple[float, int]]
+
+
+async def asearch_chunks(
+    query: str,
+    user_id: int,
+    db: AsyncSession,
+    limit: int = 10,
+    meta_filter: Optional[Dict[str, Any]] = None,
+    after: Optional[Tuple[float, int]] = None,
+    seen: int = 0,
+    query_embedding: Optional[List[float]] = None,
+) -> SearchPage:
+    """
+    Retrieval-only search: one page of scored chunks in vector order, without reranking
+    so pages stay stable under keyset pagination.
+
+    Args:
+        after: (distance, id) of the last chunk of the previous page
+        seen: chunks returned by the previous pages; HNSW must look at least this far.
+            ef_search is capped by pgvector, so past that point the iterative scan
+            (settings.search_iterative_scan) is what keeps deep or filtered pages complete
+    """
+    try:
+        if query_embedding is None:
+            query_embedding = await Embedder.agenerate_embedding_from_question(query)
+
+        # One extra row tells whether there is a next page
+        stmt = _build_search_query(query_embedding, user_id, limit + 1, meta_filter, after, seen)
+        search_params = vector_search_params(top_k=seen + limit + 1, iterative_scan=settings.search_iterative_scan)
+        for param_stmt, params in search_params:
+            await db.execute(param_stmt, params)
+        rows = (await db.execute(stmt)).all()
+        await db.commit()
     except Exception as e:
         from app.modules.chat.exceptions import ChunkRetrievalError
         raise ChunkRetrievalError(f"Error retrieving chunks from the database: {str(e)}")
+
+    page = rows[:limit]
+    next_after = None
+    if len(rows) > limit:
+        next_after = (float(page[-1][1]), page[-1][0].id)
+
+    chunks = _rows_to_chunks(page)
+    for chunk, row in zip(chunks, page):
+        chunk["chunk_id"] = row[0].id
+    return SearchPage(chunks=chunks, next_after=next_after)
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
 
 from app.core.security import get_and_verify_user
-from app.modules.chat.schemas import QueryRequest
+from app.modules.chat.schemas import BatchQueryRequest, QueryRequest, SearchRequest
 from app.modules.chat.services import ChatService
-from app.core.database import get_db
+from app.core.database import get_db, get_async_db
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
@@ -16,7 +17,46 @@ async def answer_query(
     request: Request,
     user: dict = Depends(get_and_verify_user),
     service: ChatService = Depends(get_chat_service),
-    db=Depends(get_db)
+    db=Depends(get_async_db)
+):
+    return await service.aanswer_query(request_body.query, request, user, db)
+
+
+@router.post("/answer/batch")
+async def answer_queries_batch(
+    request_body: BatchQueryRequest,
+    request: Request,
+    user: dict = Depends(get_and_verify_user),
+    service: ChatService = Depends(get_chat_service),
+    db=Depends(get_async_db)
 ):
-    return service.answer_query(request_body.query, request, user, db)
+    """Answers several questions; each result carries its answer and sources or its error"""
+    return await service.aanswer_batch(request_body.queries, request, user, db)
+
 
+@router.post("/search")
+async def search_chunks(
+    request_body: SearchRequest,
+    user: dict = Depends(get_and_verify_user),
+    service: ChatService = Depends(get_chat_service),
+    db=Depends(get_async_db)
+):
+    """Scored chunks for a query without generating an answer, paginated with next_cursor"""
+    return await service.asearch(request_body, user, db)
+
+
+@router.post("/answer/stream")
+def answer_query_stream(
+    request_body: QueryRequest,
+    request: Request,
+    user: dict = Depends(get_and_verify_user),
+    service: ChatService = Depends(get_chat_service),
+    db=Depends(get_db)
+):
+    """Same as /answer but streams sources, tokens and a final done event as Server-Sent Events"""
+    events = service.stream_answer_query(request_body.query, request, user, db)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
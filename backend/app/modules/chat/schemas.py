@@ -1,5 +1,29 @@
-from pydantic import BaseModel
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from app.core.environment import settings
 
 
 class QueryRequest(BaseModel):
     query: str
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=settings.chat_batch_max_queries)
+
+
+class SearchFilters(BaseModel):
+    """Exact matches on chunk metadata"""
+    source: Optional[str] = None
+    page: Optional[int] = None
+    h1: Optional[str] = None
+    h2: Optional[str] = None
+    file_type: Optional[str] = None  # pdf, docx, md
+
+
+class SearchRequest(BaseModel):
+    query: str
+    limit: int = Field(settings.search_default_limit, ge=1, le=settings.search_max_limit)
+    filters: Optional[SearchFilters] = None
+    cursor: Optional[str] = None  # next_cursor of the previous page
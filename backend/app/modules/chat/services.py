@@ -1,26 +1,54 @@
 
-from app.modules.chat.retrieval.retriever import retrieve_relevant_chunks
-from app.modules.chat.retrieval.generator import generate_answer
-from app.modules.chat.exceptions import ChunkRetrievalError, LLMServiceError
+from app.modules.chat.retrieval.retriever import retrieve_relevant_chunks, aretrieve_relevant_chunks, aretrieve_relevant_chunks_batch, asearch_chunks
+from app.modules.chat.retrieval.generator import generate_answer, agenerate_answer, stream_answer
+from app.modules.chat.retrieval.context_builder import build_context
+from app.modules.chat.exceptions import ChunkRetrievalError, LLMServiceError, InvalidSearchCursor
 from app.modules.analytics.repository import AnalyticsRepository
 from app.modules.analytics.types import EventType
 from app.modules.chat.pricing import calculate_prices
+from app.modules.chat.answer_cache import answer_cache
+from app.modules.documents.indexing_pipeline.embeddings.embedder import Embedder
+from app.modules.documents.indexing_pipeline.embeddings.cache import normalize_query
+from app.modules.documents.vector_index import search_depth_limit
+from app.modules.users.repository import UserRepository
+from app.core.environment import settings
 
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
 import time
 
 
+NO_CONTEXT_ANSWER = "I don't have any relevant information to answer that question."
+NO_ANSWER = "I don't have that information."
+
+
 class ChatService:
     def answer_query(self, query: str, request, user: dict, db):
         vector_start = time.time()
-        chunks = retrieve_relevant_chunks(query, user_id=user.id, top_k=5)
+        query_embedding = Embedder.generate_embedding_from_question(query, request.state.meta)
+        request.state.meta["query_embedding_time"] = time.time() - vector_start
+
+        corpus_version = None
+        if settings.answer_cache_enabled:
+            corpus_version = UserRepository(db).get_corpus_version(user.id)
+            cached = answer_cache.lookup(user.id, query_embedding, corpus_version)
+            if cached:
+                request.state.meta["vector_retrieval_time"] = time.time() - vector_start
+                return self._answer_from_cache(cached, query, request, user, db)
+
+        chunks = retrieve_relevant_chunks(query, user_id=user.id, top_k=settings.context_candidates, query_embedding=query_embedding, db=db, stats=request.state.meta)
         if not chunks:
             return {
-                "answer": "I don't have any relevant information to answer that question.",
+                "answer": NO_CONTEXT_ANSWER,
                 "sources": []
             }
         vector_end = time.time()
         request.state.meta["vector_retrieval_time"] = vector_end - vector_start
-        
+        chunks = self._select_context(query, chunks, request)
+
         llm_start = time.time()
         result = generate_answer(query, chunks)
         llm_end = time.time()
@@ -28,25 +56,328 @@ class ChatService:
 
         process_time = time.time() - request.state.start_time
 
-        if result["answer"]=="I don't have that information.":
-            request.state.meta["no_answer"] = True
+        llm_total_cost = self._record_answer_meta(request.state.meta, chunks, result, query, request)
+
+        if corpus_version is not None:
+            answer_cache.store(user.id, query_embedding, corpus_version, result, llm_total_cost)
+
+        repo = AnalyticsRepository(db)
+        repo.create_event(user_id=user.id, event_type=EventType.RAG_QUERY_COMPLETED , value=process_time, meta=request.state.meta)
+
+
+        return result
+
+    async def aanswer_query(self, query: str, request, user: dict, db):
+        """
+        Versión async de answer_query: embedding, consulta vectorial, LLM y escritura de
+        analytics no bloquean el event loop. db debe ser un AsyncSession.
+        """
+        vector_start = time.time()
+        query_embedding = await Embedder.agenerate_embedding_from_question(query, request.state.meta)
+        request.state.meta["query_embedding_time"] = time.time() - vector_start
+
+        corpus_version = None
+        if settings.answer_cache_enabled:
+            corpus_version = await UserRepository(db).aget_corpus_version(user.id)
+            cached = answer_cache.lookup(user.id, query_embedding, corpus_version)
+            if cached:
+                request.state.meta["vector_retrieval_time"] = time.time() - vector_start
+                self._record_cache_hit_meta(request.state.meta, cached, query, request)
+                await self._arecord_event(request, user, db)
+                return cached.result
+
+        chunks = await aretrieve_relevant_chunks(query, user_id=user.id, db=db, top_k=settings.context_candidates, query_embedding=query_embedding, stats=request.state.meta)
+        if not chunks:
+            return {
+                "answer": NO_CONTEXT_ANSWER,
+                "sources": []
+            }
+        request.state.meta["vector_retrieval_time"] = time.time() - vector_start
+        chunks = self._select_context(query, chunks, request)
+
+        llm_start = time.time()
+        result = await agenerate_answer(query, chunks)
+        request.state.meta["llm_response_time"] = time.time() - llm_start
+
+        llm_total_cost = self._record_answer_meta(request.state.meta, chunks, result, query, request)
+
+        if corpus_version is not None:
+            answer_cache.store(user.id, query_embedding, corpus_version, result, llm_total_cost)
+
+        await self._arecord_event(request, user, db)
+        return result
+
+    async def aanswer_batch(self, queries, request, user: dict, db):
+        """
+        Responde varias preguntas: los embeddings van en un solo lote a Voyage, la búsqueda
+        vectorial es una sola consulta para todas y las llamadas al LLM se hacen en paralelo
+        (como mucho chat_batch_llm_concurrency a la vez). Un fallo del LLM solo afecta a su
+        pregunta. No usa la caché de respuestas: los lotes son sobre todo evaluaciones.
+        """
+        retrieval_start = time.time()
+        # Meta propia de cada pregunta: acierto de caché de embedding y reranking
+        item_stats = [{} for _ in queries]
+        query_embeddings = await Embedder.agenerate_embeddings_from_questions(queries, item_stats)
+        embedding_time = time.time() - retrieval_start
+        stats = {}
+        chunk_lists = await aretrieve_relevant_chunks_batch(
+            queries, query_embeddings, user_id=user.id, db=db, top_k=settings.context_candidates,
+            stats=stats, item_stats=item_stats
+        )
+        # Los tiempos del lote se reparten entre sus preguntas para que las medias sigan siendo por consulta
+        batch_meta = {
+            "batch_size": len(queries),
+            "retrieval_mode": stats.get("retrieval_mode"),
+            "query_embedding_time": embedding_time / len(queries),
+            "retrieval_query_time": stats.get("retrieval_query_time", 0) / len(queries),
+            "vector_retrieval_time": (time.time() - retrieval_start) / len(queries),
+        }
+
+        semaphore = asyncio.Semaphore(settings.chat_batch_llm_concurrency)
+
+        async def answer(query: str, chunks, rerank_stats: dict):
+            if not chunks:
+                return {"query": query, "answer": NO_CONTEXT_ANSWER, "sources": [], "error": None}, None
+
+            meta = {**batch_meta, **rerank_stats}
+            context = build_context(query, chunks)
+            meta.update(context.to_meta())
+            async with semaphore:
+                llm_start = time.time()
+                try:
+                    result = await agenerate_answer(query, context.chunks)
+                except LLMServiceError as e:
+                    return {"query": query, "answer": None, "sources": [], "error": str(e)}, None
+                meta["llm_response_time"] = time.time() - llm_start
+
+            self._record_answer_meta(meta, context.chunks, result, query, request)
+            event = {"value": meta["vector_retrieval_time"] + meta["llm_response_time"], "meta": meta}
+            return {"query": query, "answer": result["answer"], "sources": result["sources"], "error": None}, event
+
+        outcomes = await asyncio.gather(*(
+            answer(query, chunks, rerank_stats)
+            for query, chunks, rerank_stats in zip(queries, chunk_lists, item_stats)
+        ))
+
+        events = [event for _, event in outcomes if event]
+        if events:
+            repo = AnalyticsRepository(db)
+            await repo.acreate_events(user_id=user.id, event_type=EventType.RAG_QUERY_COMPLETED, events=events)
+
+        results = [item for item, _ in outcomes]
+        return {
+            "results": results,
+            "failed": sum(1 for item in results if item["error"])
+        }
+
+    async def asearch(self, search, user: dict, db):
+        """
+        Búsqueda sin LLM: una página de chunks con su puntuación en orden vectorial.
+
+        La paginación es por cursor (distancia, id) del último chunk, así cada página es
+        una consulta indexada. El cursor solo vale para la misma consulta y filtros, y la
+        paginación se detiene en search_depth_limit() resultados.
+        """
+        meta_filter = _search_meta_filter(search.filters)
+        fingerprint = _search_fingerprint(search.query, meta_filter)
+        max_depth = search_depth_limit()
+        after, seen = None, 0
+        if search.cursor:
+            after, seen = _decode_search_cursor(search.cursor, fingerprint, max_depth)
+
+        page = await asearch_chunks(
+            search.query,
+            user_id=user.id,
+            db=db,
+            # La última página no pasa de la profundidad máxima
+            limit=min(search.limit, max_depth - seen),
+            meta_filter=meta_filter,
+            after=after,
+            seen=seen,
+        )
+        next_cursor = None
+        seen += len(page.chunks)
+        if page.next_after is not None and seen < max_depth:
+            next_cursor = _encode_search_cursor(page.next_after, seen, fingerprint)
+        return {
+            "results": page.chunks,
+            "next_cursor": next_cursor
+        }
+
+    async def _arecord_event(self, request, user: dict, db):
+        process_time = time.time() - request.state.start_time
+        repo = AnalyticsRepository(db)
+        await repo.acreate_event(user_id=user.id, event_type=EventType.RAG_QUERY_COMPLETED , value=process_time, meta=request.state.meta)
+
+    def stream_answer_query(self, query: str, request, user: dict, db):
+        """
+        Prepara la respuesta en streaming (Server-Sent Events).
+
+        La recuperación se hace antes de devolver el generador para que sus errores
+        sigan respondiendo con su código HTTP; el generador emite primero las fuentes,
+        luego los tokens y al cerrar registra el evento de analytics.
+
+        La sesión de la petición se cierra antes de devolver el generador: su conexión
+        vuelve al pool en lugar de quedar "idle in transaction" durante todo el stream, y
+        la misma sesión vuelve a pedir una solo para escribir el evento al final.
+        """
+        vector_start = time.time()
+        query_embedding = Embedder.generate_embedding_from_question(query, request.state.meta)
+        request.state.meta["query_embedding_time"] = time.time() - vector_start
+
+        corpus_version = None
+        if settings.answer_cache_enabled:
+            corpus_version = UserRepository(db).get_corpus_version(user.id)
+            cached = answer_cache.lookup(user.id, query_embedding, corpus_version)
+            if cached:
+                request.state.meta["vector_retrieval_time"] = time.time() - vector_start
+                db.close()
+                return self._stream_cached(cached, query, request, user, db)
+
+        chunks = retrieve_relevant_chunks(query, user_id=user.id, top_k=settings.context_candidates, query_embedding=query_embedding, db=db, stats=request.state.meta)
+        request.state.meta["vector_retrieval_time"] = time.time() - vector_start
+        if chunks:
+            chunks = self._select_context(query, chunks, request)
+
+        db.close()
+        return self._stream_generated(chunks, query, query_embedding, corpus_version, request, user, db)
+
+    def _stream_generated(self, chunks, query: str, query_embedding, corpus_version, request, user, db):
+        yield _sse("sources", chunks)
+        if not chunks:
+            yield _sse("token", {"token": NO_CONTEXT_ANSWER})
+            yield _sse("done", {"answer": NO_CONTEXT_ANSWER})
+            return
+
+        llm_start = time.time()
+        tokens = []
+        try:
+            for token in stream_answer(query, chunks):
+                if not tokens:
+                    request.state.meta["llm_time_to_first_token"] = time.time() - llm_start
+                tokens.append(token)
+                yield _sse("token", {"token": token})
+        except LLMServiceError as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        request.state.meta["llm_response_time"] = time.time() - llm_start
+
+        result = {"answer": "".join(tokens), "sources": chunks}
+        yield _sse("done", {"answer": result["answer"]})
+
+        llm_total_cost = self._record_answer_meta(request.state.meta, chunks, result, query, request)
+        if corpus_version is not None:
+            answer_cache.store(user.id, query_embedding, corpus_version, result, llm_total_cost)
+        self._record_event_after_stream(request, user, db)
+
+    def _stream_cached(self, cached, query: str, request, user, db):
+        result = cached.result
+        yield _sse("sources", result["sources"])
+        yield _sse("token", {"token": result["answer"]})
+        yield _sse("done", {"answer": result["answer"]})
+
+        self._record_cache_hit_meta(request.state.meta, cached, query, request)
+        self._record_event_after_stream(request, user, db)
+
+    def _record_event_after_stream(self, request, user: dict, db):
+        # Una sesión cerrada sigue siendo usable: abre una transacción nueva para el evento
+        # (get_db puede haberla cerrado ya cuando termina el stream)
+        process_time = time.time() - request.state.start_time
+        try:
+            repo = AnalyticsRepository(db)
+            repo.create_event(user_id=user.id, event_type=EventType.RAG_QUERY_COMPLETED , value=process_time, meta=request.state.meta)
+        finally:
+            db.close()
+
+    def _select_context(self, query: str, chunks, request):
+        # MMR + presupuesto de tokens: solo los chunks elegidos llegan al LLM y a sources
+        context = build_context(query, chunks)
+        request.state.meta.update(context.to_meta())
+        return context.chunks
+
+    def _record_answer_meta(self, meta: dict, chunks, result, query: str, request) -> float:
+        if result["answer"]==NO_ANSWER:
+            meta["no_answer"] = True
         else:
-            request.state.meta["no_answer"] = False
+            meta["no_answer"] = False
 
         if "sources" in result and result["sources"]:
-            request.state.meta["response_quality"] = result["sources"][0]["relevance_score"]
-        else : 
-            request.state.meta["response_quality"] = None
+            meta["response_quality"] = result["sources"][0]["relevance_score"]
+        else :
+            meta["response_quality"] = None
 
-        vector_cost, llm_total_cost=calculate_prices(chunks, result["answer"], query, request)
+        vector_cost, llm_total_cost=calculate_prices(chunks, result["answer"], query, request, llm_input_tokens=meta.get("llm_input_tokens"))
             # Guardar en metadata
-        request.state.meta["vector_cost"] = round(vector_cost, 6)
-        request.state.meta["llm_total_cost"] = round(llm_total_cost, 6)
+        meta["vector_cost"] = round(vector_cost, 6)
+        meta["llm_total_cost"] = round(llm_total_cost, 6)
+        meta["answer_cache_hit"] = False
+        return llm_total_cost
+
+    def _record_cache_hit_meta(self, meta: dict, cached, query: str, request) -> None:
+        # Solo se paga el embedding de la consulta, la generación se reutiliza
+        result = cached.result
+        meta["llm_response_time"] = 0
+        meta["no_answer"] = result["answer"] == NO_ANSWER
+        meta["response_quality"] = result["sources"][0]["relevance_score"] if result.get("sources") else None
 
+        vector_cost, _ = calculate_prices([], "", query, request)
+        meta["vector_cost"] = round(vector_cost, 6)
+        meta["llm_total_cost"] = 0
+        meta["answer_cache_hit"] = True
+        meta["answer_cache_similarity"] = round(cached.similarity, 4)
+        meta["answer_cache_saved_cost"] = round(cached.llm_total_cost, 6)
+
+    def _answer_from_cache(self, cached, query: str, request, user: dict, db):
+        self._record_cache_hit_meta(request.state.meta, cached, query, request)
+
+        process_time = time.time() - request.state.start_time
         repo = AnalyticsRepository(db)
         repo.create_event(user_id=user.id, event_type=EventType.RAG_QUERY_COMPLETED , value=process_time, meta=request.state.meta)
 
+        return cached.result
 
-        return result
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Campos de SearchFilters -> claves de meta_data de los chunks
+SEARCH_FILTER_KEYS = {"source": "source", "page": "page", "h1": "h1", "h2": "h2", "file_type": "type"}
+
+
+def _search_meta_filter(filters) -> dict:
+    if filters is None:
+        return {}
+    values = filters.model_dump(exclude_none=True)
+    return {SEARCH_FILTER_KEYS[name]: value for name, value in values.items()}
+
+
+def _search_fingerprint(query: str, meta_filter: dict) -> str:
+    payload = json.dumps([normalize_query(query), meta_filter], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _encode_search_cursor(after, seen: int, fingerprint: str) -> str:
+    distance, chunk_id = after
+    # repr del float: la distancia debe compararse exacta en la siguiente página
+    payload = json.dumps({"d": repr(distance), "id": chunk_id, "n": seen, "f": fingerprint})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
 
 
+def _decode_search_cursor(cursor: str, fingerprint: str, max_depth: int):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        after = (float(payload["d"]), int(payload["id"]))
+        seen = int(payload["n"])
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise InvalidSearchCursor()
+    if payload.get("f") != fingerprint:
+        raise InvalidSearchCursor("Search cursor does not match this query and filters.")
+    if not 0 <= seen < max_depth:
+        raise InvalidSearchCursor(f"Search cursor depth is out of range (maximum {max_depth} results).")
+    # Distancia coseno en [0, 2] e id dentro de INTEGER: lo demás no sale de un cursor nuestro
+    distance, chunk_id = after
+    if not (0 <= distance <= 2 and 0 < chunk_id < 2 ** 31):
+        raise InvalidSearchCursor()
+    return after, seen
@@ -10,6 +10,18 @@ class InvalidAuthenticationContext(Exception):
     pass
 
 
+class IngestionJobNotFound(Exception):
+    pass
+
+
+class InvalidDocumentUpdate(Exception):
+    pass
+
+
+class DocumentUploadError(Exception):
+    pass
+
+
 
 # Exception handlers
 from fastapi import FastAPI
@@ -21,6 +33,18 @@ def register_document_handlers(app: FastAPI):
     async def document_not_found_handler(_, exc: DocumentNotFound):
         return JSONResponse(status_code=404, content={"detail": str(exc)})
 
+    @app.exception_handler(IngestionJobNotFound)
+    async def ingestion_job_not_found_handler(_, exc: IngestionJobNotFound):
+        return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+    @app.exception_handler(InvalidDocumentUpdate)
+    async def invalid_document_update_handler(_, exc: InvalidDocumentUpdate):
+        return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+    @app.exception_handler(DocumentUploadError)
+    async def document_upload_error_handler(_, exc: DocumentUploadError):
+        return JSONResponse(status_code=502, content={"detail": str(exc)})
+
     @app.exception_handler(ForbiddenDocumentAccess)
     async def forbidden_document_access_handler(_, exc: ForbiddenDocumentAccess):
         return JSONResponse(status_code=403, content={"detail": str(exc)})
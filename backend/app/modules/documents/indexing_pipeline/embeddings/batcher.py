@@ -0,0 +1,136 @@
+"""
+Batcher de embeddings - divide los textos en lotes que respetan los límites de Voyage
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import tiktoken
+from voyageai.error import APIConnectionError, RateLimitError, ServerError, ServiceUnavailableError
+
+from app.core.clients import clients
+from app.core.environment import settings
+
+
+# Errores transitorios que merecen reintento (throttling o caída del proveedor)
+RETRYABLE_ERRORS = (RateLimitError, ServiceUnavailableError, ServerError, APIConnectionError)
+
+
+class RateLimiter:
+    """Limita las peticiones por minuto espaciándolas de forma uniforme (thread-safe)"""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _count_tokens_factory() -> Callable[[str], int]:
+    # cl100k_base aproxima el tokenizer de Voyage; el presupuesto deja margen para la diferencia
+    encoder = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoder.encode(text, disallowed_special=()))
+
+
+class EmbeddingBatcher:
+    """
+    Genera embeddings de muchos textos respetando los límites de lote del proveedor.
+
+    Los textos se agrupan por número de elementos y por presupuesto de tokens, los lotes
+    se envían en paralelo bajo un rate limiter compartido, los errores de throttling se
+    reintentan con backoff exponencial y los embeddings se devuelven en el orden original.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_items: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: Optional[int] = None,
+        backoff_seconds: Optional[float] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        input_type: Optional[str] = None
+    ):
+        self.model = model
+        self.max_items = max_items or settings.embedding_batch_max_items
+        self.max_tokens = max_tokens or settings.embedding_batch_max_tokens
+        self.concurrency = concurrency or settings.embedding_concurrency
+        self.rate_limiter = rate_limiter or embedding_rate_limiter
+        self.max_retries = settings.embedding_max_retries if max_retries is None else max_retries
+        self.backoff_seconds = settings.embedding_retry_backoff_seconds if backoff_seconds is None else backoff_seconds
+        self._count_tokens = count_tokens
+        self.input_type = input_type
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """Agrupa los índices de los textos en lotes de como mucho max_items y max_tokens"""
+        if self._count_tokens is None:
+            self._count_tokens = _count_tokens_factory()
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = self._count_tokens(text)
+            if current and (len(current) >= self.max_items or current_tokens + tokens > self.max_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            # Un texto que supera el presupuesto va solo en su lote (el proveedor lo trunca)
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        batches = self.make_batches(texts)
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+
+        def run(batch: List[int]) -> None:
+            batch_embeddings = self._embed_batch([texts[i] for i in batch])
+            for i, emb in zip(batch, batch_embeddings):
+                embeddings[i] = emb
+
+        if len(batches) == 1 or self.concurrency <= 1:
+            for batch in batches:
+                run(batch)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as executor:
+                # list() propaga la primera excepción de cualquier lote
+                list(executor.map(run, batches))
+
+        return embeddings
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                # Un único nivel de reintentos: los internos del cliente no pasarían por el rate limiter
+                response = clients.voyage_batch.embed(texts=texts, model=self.model, input_type=self.input_type)
+                return response.embeddings
+            except RETRYABLE_ERRORS:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                # Backoff exponencial con jitter para no sincronizar los reintentos de los hilos
+                delay = self.backoff_seconds * (2 ** (attempt - 1))
+                time.sleep(delay + random.uniform(0, delay))
+
+
+# Compartido por todos los pipelines del proceso: el límite del proveedor es por API key
+embedding_rate_limiter = RateLimiter(settings.embedding_requests_per_minute)
@@ -0,0 +1,97 @@
+"""
+Caché de embeddings de consultas - evita llamar a Voyage para preguntas repetidas
+"""
+import hashlib
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.core.cache import CacheBackend, CacheStats, TTLCache
+from app.core.environment import settings
+
+
+def normalize_query(query: str) -> str:
+    """Normaliza la consulta para que variaciones triviales compartan entrada"""
+    return " ".join(query.split()).casefold()
+
+
+class QueryEmbeddingCache:
+    """
+    Caché de embeddings por (modelo, consulta normalizada) con contadores de aciertos.
+
+    stats (la meta de la petición) recibe query_embedding_cache_hit, que analytics agrega
+    por usuario; los contadores del proceso están en get_stats.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.stats = CacheStats()
+
+    @staticmethod
+    def make_key(query: str, model: str) -> str:
+        digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"query_embedding:{model}:{digest}"
+
+    def get_or_compute(self, query: str, model: str, compute: Callable[[str], List[float]], stats: Optional[Dict] = None) -> List[float]:
+        key = self.make_key(query, model)
+        embedding = self.backend.get(key)
+        self._record(embedding is not None, stats)
+        if embedding is None:
+            embedding = list(compute(query))
+            self.backend.set(key, embedding)
+        return embedding
+
+    async def aget_or_compute(self, query: str, model: str, compute: Callable[[str], Awaitable[List[float]]], stats: Optional[Dict] = None) -> List[float]:
+        key = self.make_key(query, model)
+        embedding = self.backend.get(key)
+        self._record(embedding is not None, stats)
+        if embedding is None:
+            embedding = list(await compute(query))
+            self.backend.set(key, embedding)
+        return embedding
+
+    async def aget_or_compute_many(
+        self,
+        queries: List[str],
+        model: str,
+        compute_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+        item_stats: Optional[List[Dict]] = None
+    ) -> List[List[float]]:
+        """
+        Como aget_or_compute para varias consultas: los fallos se calculan en una sola llamada.
+        item_stats tiene un dict por consulta.
+        """
+        keys = [self.make_key(query, model) for query in queries]
+        embeddings = [self.backend.get(key) for key in keys]
+        # Una sola petición por clave aunque la consulta se repita en el lote
+        missing = {}
+        for i, (query, key, embedding) in enumerate(zip(queries, keys, embeddings)):
+            self._record(embedding is not None, item_stats[i] if item_stats is not None else None)
+            if embedding is None:
+                missing.setdefault(key, query)
+
+        if missing:
+            computed = dict(zip(missing.keys(), await compute_many(list(missing.values()))))
+            for key, embedding in computed.items():
+                self.backend.set(key, list(embedding))
+            embeddings = [computed[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)]
+        return [list(embedding) for embedding in embeddings]
+
+    def _record(self, hit: bool, stats: Optional[Dict]) -> None:
+        self.stats.record(hit=hit)
+        if stats is not None:
+            stats["query_embedding_cache_hit"] = hit
+
+    def use_backend(self, backend: CacheBackend) -> None:
+        """Sustituye el backend (p. ej. uno compartido entre workers)"""
+        self.backend = backend
+
+    def get_stats(self) -> Dict[str, float]:
+        return self.stats.as_dict()
+
+
+# Instancia global, en memoria por proceso por defecto
+query_embedding_cache = QueryEmbeddingCache(
+    TTLCache(
+        maxsize=settings.query_embedding_cache_size,
+        ttl=settings.query_embedding_cache_ttl_seconds,
+    )
+)
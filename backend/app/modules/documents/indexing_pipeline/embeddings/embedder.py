@@ -1,77 +1,189 @@
 """
 Embedder - Generación y almacenamiento de embeddings
 """
-from typing import List, Dict, Any
-from voyageai import Client
+from typing import List, Dict, Any, Optional
+import hashlib
+import numpy as np
+from pgvector import HalfVector
+from pgvector.psycopg import register_vector
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
+from app.core.clients import clients
 from app.core.environment import settings
 from app.modules.documents.models import Embedding
+from app.modules.documents.repository import DocumentRepository
+from .cache import query_embedding_cache
+from .batcher import EmbeddingBatcher
+
+
+EMBEDDING_MODEL = "voyage-3.5"
+
+COPY_EMBEDDINGS_SQL = (
+    "COPY embeddings (embedding, meta_data, text, document_id, user_id, "
+    "content_hash, embedding_model, chunk_index) "
+    "FROM STDIN WITH (FORMAT BINARY)"
+)
+
+
+def _copy_vector(value: Any):
+    # Los vectores reutilizados de una columna halfvec llegan como HalfVector
+    array = value.to_numpy() if hasattr(value, "to_numpy") else value
+    array = np.asarray(array, dtype=np.float32)
+    return HalfVector(array) if settings.vector_storage_mode == "halfvec" else array
+
+
+def content_hash(text: str) -> str:
+    """Hash del texto de un chunk: textos iguales producen el mismo vector con el mismo modelo"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
 class Embedder:
     
     def __init__(self, db_session: Session):
         self.db = db_session
-        self.client = Client(api_key=settings.VOYAGE_API_KEY)
+        self.client = clients.voyage
+        self.batcher = EmbeddingBatcher(EMBEDDING_MODEL)
     
-    def generate_embeddings_from_chunks(self, chunks: List) -> List[Dict[str, Any]]:
+    def generate_embeddings_from_chunks(self, chunks: List, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Genera los embeddings de los chunks.
 
+        Si se indica user_id, los chunks cuyo hash ya tiene vector para ese usuario y modelo
+        lo reutilizan (marcados con reused=True) y solo el resto se envía a Voyage.
+        """
         texts = [chunk.page_content for chunk in chunks]
-        
-        response = self.client.embed(
-            model="voyage-3.5",
-            texts=texts
-        )
-        
+        hashes = [content_hash(text) for text in texts]
+
+        existing = {}
+        if user_id is not None:
+            existing = DocumentRepository(self.db).get_embeddings_by_content_hash(user_id, EMBEDDING_MODEL, hashes)
+
+        # Un solo envío por texto nuevo aunque se repita dentro del documento
+        pending = {h: text for h, text in zip(hashes, texts) if h not in existing}
+        if pending:
+            # Lotes por número de textos y tokens, en paralelo y en el orden original
+            new_embeddings = self.batcher.embed(list(pending.values()))
+            existing = {**existing, **dict(zip(pending.keys(), new_embeddings))}
+
         embeddings_with_meta = [
             {
-                "embedding": emb,
+                "embedding": existing[h],
                 "metadata": chunk.metadata,
-                "text": chunk.page_content
+                "text": chunk.page_content,
+                "content_hash": h,
+                "reused": h not in pending
             }
-            for emb, chunk in zip(response.embeddings, chunks)
+            for h, chunk in zip(hashes, chunks)
         ]
         
         return embeddings_with_meta
     
-    def store_embeddings(self, embeddings_data: List[Dict[str, Any]], document_id: int) -> int:
-        
-        stored_count = 0
-        
+    def store_embeddings(self, embeddings_data: List[Dict[str, Any]], document_id: int, user_id: Optional[int] = None, commit: bool = True) -> int:
+        """
+        Guarda los embeddings en bloque y, salvo commit=False, hace commit.
+
+        method "copy" usa COPY binario de psycopg (vectores en formato binario de pgvector);
+        "insert" usa INSERTs multi-fila por lotes. Ambos evitan crear un objeto ORM por fila.
+        """
+        rows = [
+            {
+                "embedding": item["embedding"],
+                "meta_data": item["metadata"],
+                "text": item["text"],
+                "document_id": document_id,
+                "user_id": user_id,
+                "content_hash": item.get("content_hash") or content_hash(item["text"]),
+                "embedding_model": EMBEDDING_MODEL,
+                "chunk_index": item.get("chunk_index", i)
+            }
+            for i, item in enumerate(embeddings_data)
+        ]
+        if not rows:
+            return 0
+
         try:
-            for item in embeddings_data:
-                embedding_record = Embedding(
-                    embedding=item["embedding"],
-                    meta_data=item["metadata"],
-                    text=item["text"],
-                    document_id=document_id
-                )
-                self.db.add(embedding_record)
-                stored_count += 1
-            
-            self.db.commit()
-            print(f"Stored {stored_count} embeddings in database")
-            
+            if settings.embedding_insert_method == "copy":
+                self._copy_embeddings(rows)
+            else:
+                self._insert_embeddings(rows)
+            if commit:
+                self.db.commit()
+            print(f"Stored {len(rows)} embeddings in database")
+
         except Exception as e:
-            print(f"Error preparing embeddings for storage: {e}")
+            self.db.rollback()
+            print(f"Error storing embeddings: {e}")
             raise e
-        
-        return stored_count
-    
-    def generate_and_store_embeddings(self, chunks: List, document_id: int) -> int:
 
-        embeddings_data = self.generate_embeddings_from_chunks(chunks)
-        stored_count = self.store_embeddings(embeddings_data, document_id)
+        return len(rows)
+
+    def _insert_embeddings(self, rows: List[Dict[str, Any]]) -> None:
+        batch_size = settings.embedding_insert_batch_size
+        for start in range(0, len(rows), batch_size):
+            self.db.execute(insert(Embedding.__table__), rows[start:start + batch_size])
+
+    def _copy_embeddings(self, rows: List[Dict[str, Any]]) -> None:
+        # COPY dentro de la transacción de la sesión, sobre la conexión psycopg subyacente
+        conn = self.db.connection().connection.driver_connection
+        register_vector(conn)
+        batch_size = settings.embedding_insert_batch_size
+        vector_type = "halfvec" if settings.vector_storage_mode == "halfvec" else "vector"
+        with conn.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                with cursor.copy(COPY_EMBEDDINGS_SQL) as copy:
+                    copy.set_types([vector_type, "jsonb", "text", "int4", "int4", "text", "text", "int4"])
+                    for row in rows[start:start + batch_size]:
+                        copy.write_row((
+                            _copy_vector(row["embedding"]),
+                            row["meta_data"],
+                            row["text"],
+                            row["document_id"],
+                            row["user_id"],
+                            row["content_hash"],
+                            row["embedding_model"],
+                            row["chunk_index"]
+                        ))
+
+    def generate_and_store_embeddings(self, chunks: List, document_id: int, user_id: Optional[int] = None) -> int:
+
+        embeddings_data = self.generate_embeddings_from_chunks(chunks, user_id)
+        stored_count = self.store_embeddings(embeddings_data, document_id, user_id)
         return stored_count
 
     @staticmethod
-    def generate_embedding_from_question(query: str):
+    def generate_embedding_from_question(query: str, stats: Optional[Dict] = None):
+        return query_embedding_cache.get_or_compute(query, EMBEDDING_MODEL, Embedder._embed_question, stats)
 
-        client = Client(api_key=settings.VOYAGE_API_KEY)
-        
-        response = client.embed(
-            model="voyage-3.5",
+    @staticmethod
+    def _embed_question(query: str):
+        response = clients.voyage.embed(
+            model=EMBEDDING_MODEL,
             texts=[query]
         )
         
-        return response.embeddings[0]
\ No newline at end of file
+        return response.embeddings[0]
+
+    @staticmethod
+    async def agenerate_embedding_from_question(query: str, stats: Optional[Dict] = None):
+        return await query_embedding_cache.aget_or_compute(query, EMBEDDING_MODEL, Embedder._aembed_question, stats)
+
+    @staticmethod
+    async def _aembed_question(query: str):
+        response = await clients.aembed([query], model=EMBEDDING_MODEL)
+        
+        return response.embeddings[0]
+
+    @staticmethod
+    async def agenerate_embeddings_from_questions(queries: List[str], item_stats: Optional[List[Dict]] = None) -> List[List[float]]:
+        """Embeddings de varias preguntas: las que no están en caché van juntas a Voyage"""
+        return await query_embedding_cache.aget_or_compute_many(queries, EMBEDDING_MODEL, Embedder._aembed_questions, item_stats)
+
+    @staticmethod
+    async def _aembed_questions(queries: List[str]) -> List[List[float]]:
+        # Las preguntas son cortas: el límite que aplica es el de elementos por petición
+        embeddings = []
+        batch_size = settings.embedding_batch_max_items
+        for start in range(0, len(queries), batch_size):
+            response = await clients.aembed(queries[start:start + batch_size], model=EMBEDDING_MODEL)
+            embeddings.extend(response.embeddings)
+        return embeddings
\ No newline at end of file
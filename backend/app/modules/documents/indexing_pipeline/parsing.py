@@ -0,0 +1,40 @@
+"""
+Parsing y chunking de documentos - ejecutable en un pool de procesos
+"""
+from pathlib import Path
+from typing import List, Optional
+
+from .preprocessing.preprocessor import Preprocessor
+from .chunks.chunker import Chunker
+
+
+# Componentes por proceso del pool de parsing (se crean una vez por proceso hijo)
+_worker_preprocessor: Optional[Preprocessor] = None
+_worker_chunker: Optional[Chunker] = None
+
+
+def parse_and_chunk(file_path: Path, original_filename: str, preprocessor: Preprocessor = None, chunker: Chunker = None) -> List:
+    """
+    Extrae el contenido de un archivo y lo divide en chunks.
+
+    Es una función de módulo para poder ejecutarse en el ProcessPoolExecutor
+    (el parsing de PDFs con PyMuPDF es CPU-bound).
+    """
+    global _worker_preprocessor, _worker_chunker
+    if preprocessor is None:
+        _worker_preprocessor = _worker_preprocessor or Preprocessor()
+        preprocessor = _worker_preprocessor
+    if chunker is None:
+        _worker_chunker = _worker_chunker or Chunker()
+        chunker = _worker_chunker
+
+    filename_mapping = {file_path.name: original_filename}
+    process_results = preprocessor.process_files([file_path], filename_mapping)
+    docs = process_results.get(file_path.name, [])
+    if not docs:
+        raise ValueError(f"No content could be extracted from {original_filename}")
+
+    final_chunks = chunker.chunk_documents(docs)
+    if not final_chunks:
+        raise ValueError(f"No chunks could be created from {original_filename}")
+    return final_chunks
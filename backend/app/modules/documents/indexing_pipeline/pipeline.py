@@ -2,117 +2,275 @@
 Pipeline de ingestion - Orquestador del procesamiento de documentos
 """
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
+from collections import defaultdict
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass, field
 from sqlalchemy.orm import Session
 
 from .preprocessing.preprocessor import Preprocessor
 from .chunks.chunker import Chunker
-from .embeddings.embedder import Embedder
-from app.modules.documents.storage_utils import SupabaseStorage
+from .embeddings.embedder import Embedder, content_hash
+from .parsing import parse_and_chunk
+from app.core.environment import settings
+from app.modules.documents.storage_utils import StorageBackend
 from app.modules.documents.repository import DocumentRepository
+from app.modules.documents.spool import file_sha256, spooled_files
+from app.modules.users.repository import UserRepository
 from app.modules.chat.pricing import calculate_indexing_cost
-import tempfile
-import os
+import multiprocessing
+import threading
+
+
+@dataclass
+class ChunkDiff:
+    """Cambios para pasar de los chunks indexados de un documento a los nuevos"""
+    added_positions: List[int] = field(default_factory=list)
+    removed_ids: List[int] = field(default_factory=list)
+    updates: List[Dict[str, Any]] = field(default_factory=list)  # {"id", "chunk_index", "meta_data"}
+
+
+def diff_chunks(existing_rows: List[Any], chunks: List) -> ChunkDiff:
+    """
+    Empareja los chunks nuevos con los indexados por hash de contenido.
+
+    Un chunk con el mismo texto conserva su fila (y su vector) aunque cambie de posición;
+    solo se actualizan chunk_index y metadata si cambiaron. Las filas sin pareja se borran
+    y los chunks sin pareja se insertan.
+    """
+    rows_by_hash: Dict[str, List[Any]] = defaultdict(list)
+    for row in existing_rows:
+        rows_by_hash[row.content_hash].append(row)
+
+    diff = ChunkDiff()
+    for position, chunk in enumerate(chunks):
+        candidates = rows_by_hash.get(content_hash(chunk.page_content))
+        if not candidates:
+            diff.added_positions.append(position)
+            continue
+        # Preferir la fila que ya estaba en esta posición
+        row = next((r for r in candidates if r.chunk_index == position), candidates[0])
+        candidates.remove(row)
+        if row.chunk_index != position or row.meta_data != chunk.metadata:
+            diff.updates.append({"id": row.id, "chunk_index": position, "meta_data": chunk.metadata})
+
+    diff.removed_ids = [row.id for rows in rows_by_hash.values() for row in rows]
+    return diff
+
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Pool de procesos compartido para el parsing, creado al primer uso"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn: hacer fork de un proceso con hilos (uvicorn, workers) puede bloquearse
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=settings.ingestion_parse_processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _parse_pool
 
 
 class IngestionPipeline:
     """Pipeline completo de ingestion de documentos"""
-    
-    def __init__(self, db_session: Session, storage: SupabaseStorage):
+
+    def __init__(self, db_session: Session, storage: StorageBackend, concurrency: Optional[int] = None):
         self.db = db_session
         self.storage = storage
-        
+        # Documentos procesados a la vez (1 = secuencial en la sesión recibida)
+        self.concurrency = concurrency or settings.ingestion_concurrency
+
         # Inicializar componentes del pipeline
         self.preprocessor = Preprocessor()
         self.chunker = Chunker()
         self.embedder = Embedder(db_session)
         self.repository = DocumentRepository(db_session)
-    
-    
-    def process_documents(self, document_ids: List[int]) -> List[Dict[str, Any]]:
-        results = []
-        
-        for document_id in document_ids:
-            temp_file_path = None
-            try:
-                # Get document
-                document = self.repository.get_document_by_id(document_id)
-                if not document:
-                    raise ValueError(f"Document with id {document_id} not found")
-                
-                # Descargar archivo desde Supabase a un archivo temporal
-                file_content = self.storage.download_file(document.file_path)
-                
-                # Crear archivo temporal para procesamiento
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=Path(document.filename).suffix)
-                temp_file.write(file_content)
-                temp_file.close()
-                temp_file_path = Path(temp_file.name)
-                
-                # Marcar como procesando
-                self.repository.update_document_status(document_id, "processing")
-                
-                # 1. Pre-procesar archivo temporal con mapeo al nombre original
-                temp_filename = temp_file_path.name
-                filename_mapping = {temp_filename: document.filename}
-                process_results = self.preprocessor.process_files([temp_file_path], filename_mapping)
-                docs = process_results.get(temp_filename, [])
-                
-                if not docs:
-                    self.repository.update_document_status(document_id, "failed")
-                    raise ValueError(f"No content could be extracted from {document.filename}")
-                
-                # 2. Crear chunks
-                final_chunks = self.chunker.chunk_documents(docs)
-                
-                if not final_chunks:
-                    self.repository.update_document_status(document_id, "failed")
-                    raise ValueError(f"No chunks could be created from {document.filename}")
-                
-                # Calcular costo de indexación
-                indexing_cost = calculate_indexing_cost(final_chunks)
-                
-                # 3. Generar y guardar embeddings
-                stored_count = self.embedder.generate_and_store_embeddings(final_chunks, document_id)
-                
-                # 4. Actualizar documento con chunks count y estado
-                self.repository.update_document_processing_result(
-                    document_id, 
-                    chunks_count=len(final_chunks), 
-                    status="processed",
-                    indexing_cost=indexing_cost
-                )
-                
-                results.append({
+        self.user_repository = UserRepository(db_session)
+
+
+    def process_documents(
+        self,
+        document_ids: List[int],
+        on_progress: Optional[Callable[[int, str], None]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Procesa los documentos y devuelve un resultado por documento, en el orden recibido.
+
+        on_progress(document_id, stage) se llama al entrar en cada etapa:
+        downloading, parsing (incluye chunking), embedding, storing.
+
+        Con concurrency > 1 cada documento corre en su propio hilo y sesión de base de
+        datos (descarga, embeddings y guardado son I/O) y el parsing se delega al pool de
+        procesos.
+        """
+        report = on_progress or (lambda document_id, stage: None)
+
+        if self.concurrency <= 1 or len(document_ids) <= 1:
+            def parse(file_path: Path, filename: str) -> List:
+                return parse_and_chunk(file_path, filename, self.preprocessor, self.chunker)
+
+            return [
+                self._process_document(document_id, self.db, report, parse, self.embedder)
+                for document_id in document_ids
+            ]
+
+        return self._process_documents_concurrently(document_ids, report)
+
+    def _process_documents_concurrently(self, document_ids: List[int], report: Callable[[int, str], None]) -> List[Dict[str, Any]]:
+        from app.core.database import SessionLocal
+
+        # on_progress suele escribir con una sesión compartida: serializar las llamadas
+        report_lock = threading.Lock()
+
+        def locked_report(document_id: int, stage: str) -> None:
+            with report_lock:
+                report(document_id, stage)
+
+        parse_pool = get_parse_pool()
+
+        def parse(file_path: Path, filename: str) -> List:
+            return parse_pool.submit(parse_and_chunk, file_path, filename).result()
+
+        def process(document_id: int) -> Dict[str, Any]:
+            with SessionLocal() as db:
+                return self._process_document(document_id, db, locked_report, parse, Embedder(db))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # map conserva el orden de entrada
+            return list(executor.map(process, document_ids))
+
+    def _process_document(
+        self,
+        document_id: int,
+        db: Session,
+        report: Callable[[int, str], None],
+        parse: Callable[[Path, str], List],
+        embedder: Embedder
+    ) -> Dict[str, Any]:
+        repository = DocumentRepository(db)
+        user_repository = UserRepository(db)
+        # Archivos locales del documento (spool de la subida o copia del storage) a liberar al terminar
+        local_files = ExitStack()
+        try:
+            # Get document
+            document = repository.get_document_by_id(document_id)
+            if not document:
+                raise ValueError(f"Document with id {document_id} not found")
+
+            # Usar el archivo que dejó la subida en disco; si no está (otro proceso,
+            # reintento) pedirlo al storage (descarga temporal o ruta local según backend).
+            # Tras un PUT se indexa la versión pendiente; file_path sigue siendo la indexada
+            pending_file_path = document.pending_file_path
+            local_path = spooled_files.pop(document_id)
+            if local_path is not None:
+                local_files.callback(local_path.unlink, missing_ok=True)
+            else:
+                report(document_id, "downloading")
+                local_path = local_files.enter_context(self.storage.open_local(pending_file_path or document.file_path))
+            file_hash = file_sha256(local_path)
+
+            # Re-subida idéntica de un documento ya indexado: nada que hacer
+            if document.status == "processed" and document.content_hash == file_hash:
+                if pending_file_path and repository.discard_pending_file(document_id, pending_file_path):
+                    self._delete_stored_file(pending_file_path, document_id)
+                return {
                     "document_id": document_id,
                     "filename": document.filename,
                     "status": "processed",
-                    "chunks_count": len(final_chunks),
-                    "embeddings_stored": stored_count,
-                    "indexing_cost": indexing_cost
-                })
-                
+                    "chunks_count": document.chunks_count,
+                    "unchanged": True,
+                    "indexing_cost": 0
+                }
+
+            # Marcar como procesando
+            repository.update_document_status(document_id, "processing")
+
+            # 1-2. Pre-procesar archivo temporal (con el nombre original) y crear chunks
+            report(document_id, "parsing")
+            final_chunks = parse(local_path, document.filename)
+
+            # Comparar con los chunks ya indexados (re-index o reintento): solo se embeben los nuevos
+            diff = diff_chunks(repository.get_document_chunks(document_id), final_chunks)
+
+            # 3. Generar embeddings de los chunks nuevos (reutilizando los de chunks ya indexados)
+            report(document_id, "embedding")
+            new_chunks = [final_chunks[position] for position in diff.added_positions]
+            embeddings_data = embedder.generate_embeddings_from_chunks(new_chunks, document.user_id)
+            for position, item in zip(diff.added_positions, embeddings_data):
+                item["chunk_index"] = position
+            new_embeddings = [item for item in embeddings_data if not item["reused"]]
+
+            # Calcular costo de indexación: solo se pagan los chunks enviados a Voyage
+            indexing_cost = calculate_indexing_cost(new_embeddings)
+
+            # 4. Aplicar el diff y actualizar el documento en una sola transacción:
+            # las consultas ven el conjunto de chunks anterior o el nuevo, nunca uno a medias
+            report(document_id, "storing")
+            previous_file_path = document.file_path
+            repository.delete_embeddings_by_ids(diff.removed_ids)
+            repository.update_embeddings(diff.updates)
+            stored_count = embedder.store_embeddings(embeddings_data, document_id, document.user_id, commit=False)
+            repository.update_document_processing_result(
+                document_id,
+                chunks_count=len(final_chunks),
+                status="processed",
+                # Acumulado: analytics suma el costo de indexación de todos los documentos
+                indexing_cost=(document.indexing_cost or 0) + indexing_cost,
+                content_hash=file_hash,
+                # La versión nueva del archivo se publica junto con sus chunks
+                promote_file_path=pending_file_path
+            )
+            promoted = pending_file_path and document.file_path == pending_file_path
+            if promoted and previous_file_path and previous_file_path != pending_file_path:
+                self._delete_stored_file(previous_file_path, document_id)
+
+            # Invalida las respuestas cacheadas del usuario
+            if document.user_id:
+                user_repository.bump_corpus_version(document.user_id)
+
+            return {
+                "document_id": document_id,
+                "filename": document.filename,
+                "status": "processed",
+                "chunks_count": len(final_chunks),
+                "embeddings_stored": stored_count,
+                "embeddings_reused": len(embeddings_data) - len(new_embeddings),
+                "chunks_kept": len(final_chunks) - len(diff.added_positions),
+                "chunks_removed": len(diff.removed_ids),
+                "indexing_cost": indexing_cost
+            }
+
+        except Exception as e:
+            # Si hay error, actualizar estado
+            db.rollback()
+            repository.update_document_status(document_id, "failed")
+            return {
+                "document_id": document_id,
+                "status": "failed",
+                "error": str(e)
+            }
+        finally:
+            # Limpiar archivos temporales
+            try:
+                local_files.close()
             except Exception as e:
-                # Si hay error, actualizar estado
-                self.repository.update_document_status(document_id, "failed")
-                results.append({
-                    "document_id": document_id,
-                    "status": "failed",
-                    "error": str(e)
-                })
-            finally:
-                # Limpiar archivo temporal
-                if temp_file_path and temp_file_path.exists():
-                    try:
-                        os.unlink(temp_file_path)
-                    except Exception as e:
-                        print(f"Warning: Could not delete temp file {temp_file_path}: {e}")
-        
-        return results
-    
+                print(f"Warning: Could not clean up local files for document {document_id}: {e}")
+
+    def _delete_stored_file(self, file_path: str, document_id: int) -> None:
+        # Versión del archivo que ya no referencia el documento: si falla solo queda huérfana
+        try:
+            self.storage.delete_file(file_path)
+        except Exception as e:
+            print(f"Warning: Could not delete old file {file_path} of document {document_id}: {e}")
+
     def validate_file_for_processing(self, file_path: str) -> bool:
 
         if not self.storage.file_exists(file_path):
             return False
-        
-        return self.preprocessor.is_supported_file(Path(file_path))
\ No newline at end of file
+
+        return self.preprocessor.is_supported_file(Path(file_path))
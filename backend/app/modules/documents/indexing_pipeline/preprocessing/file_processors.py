@@ -4,10 +4,44 @@ Capa de infraestructura - procesamiento técnico de formatos
 """
 import docx
 import fitz  # PyMuPDF
+import mmap
+from contextlib import contextmanager
 from langchain.schema import Document
 from pathlib import Path
 
 
+@contextmanager
+def open_pdf(file_path):
+    """
+    Abre el PDF sobre un mapeo en memoria del archivo: PyMuPDF lee las páginas
+    directamente de la caché de páginas del SO, sin copiar el archivo al heap.
+    """
+    with open(file_path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Archivo vacío: no se puede mapear, que PyMuPDF reporte el error
+            doc = fitz.open(str(file_path))
+            try:
+                yield doc
+            finally:
+                doc.close()
+            return
+
+        view = memoryview(mapped)
+        doc = None
+        try:
+            doc = fitz.open(stream=view, filetype="pdf")
+            yield doc
+        finally:
+            if doc is not None:
+                doc.close()
+            # Liberar la vista antes de cerrar el mapeo
+            del doc
+            view.release()
+            mapped.close()
+
+
 def process_docx(file_path, original_filename=None):
     """Procesa archivo DOCX y extrae contenido estructurado"""
     try:
@@ -66,49 +100,49 @@ def process_md(file_path, original_filename=None):
 def process_pdf(file_path, original_filename=None):
     """Procesa archivo PDF y extrae contenido con estructura de headers"""
     try:
-        doc = fitz.open(str(file_path))
-        elements = []
+        with open_pdf(file_path) as doc:
+            elements = []
 
-        for page_num, page in enumerate(doc, start=1):
-            blocks = page.get_text("dict")["blocks"]
+            for page_num, page in enumerate(doc, start=1):
+                blocks = page.get_text("dict")["blocks"]
             
-            for block in blocks:
-                if "lines" not in block:
-                    continue
-                
-                for line in block["lines"]:
-                    if "spans" not in line:
+                for block in blocks:
+                    if "lines" not in block:
                         continue
+                
+                    for line in block["lines"]:
+                        if "spans" not in line:
+                            continue
                     
-                    line_text = ""
-                    max_font_size = 0
-                    is_bold = False
+                        line_text = ""
+                        max_font_size = 0
+                        is_bold = False
                     
-                    for span in line["spans"]:
-                        line_text += span.get("text", "")
-                        font_size = span.get("size", 0)
-                        max_font_size = max(max_font_size, font_size)
+                        for span in line["spans"]:
+                            line_text += span.get("text", "")
+                            font_size = span.get("size", 0)
+                            max_font_size = max(max_font_size, font_size)
                         
-                        flags = span.get("flags", 0)
-                        font_name = span.get("font", "").lower()
-                        if (flags & (1 << 4)) or "bold" in font_name:
-                            is_bold = True
+                            flags = span.get("flags", 0)
+                            font_name = span.get("font", "").lower()
+                            if (flags & (1 << 4)) or "bold" in font_name:
+                                is_bold = True
                     
-                    text = line_text.strip()
-                    if not text:
-                        continue
+                        text = line_text.strip()
+                        if not text:
+                            continue
                     
-                    is_short = len(text) < 100
-                    page_marker = f"<!--PAGE_{page_num}-->"
+                        is_short = len(text) < 100
+                        page_marker = f"<!--PAGE_{page_num}-->"
                     
-                    if max_font_size > 16 or (is_bold and max_font_size > 14 and is_short):
-                        elements.append(f"# {text} {page_marker}")
-                    elif max_font_size > 14 or (is_bold and max_font_size > 12 and is_short):
-                        elements.append(f"## {text} {page_marker}")
-                    elif max_font_size > 12 or (is_bold and is_short):
-                        elements.append(f"### {text} {page_marker}")
-                    else:
-                        elements.append(f"{text} {page_marker}")
+                        if max_font_size > 16 or (is_bold and max_font_size > 14 and is_short):
+                            elements.append(f"# {text} {page_marker}")
+                        elif max_font_size > 14 or (is_bold and max_font_size > 12 and is_short):
+                            elements.append(f"## {text} {page_marker}")
+                        elif max_font_size > 12 or (is_bold and is_short):
+                            elements.append(f"### {text} {page_marker}")
+                        else:
+                            elements.append(f"{text} {page_marker}")
 
         structured_text = "\n\n".join(elements)
         
@@ -0,0 +1,145 @@
+"""
+Cola de indexación en segundo plano
+
+POST /documents solo encola un IngestionJob; un pool de hilos worker reclama jobs de la
+tabla ingestion_jobs (FOR UPDATE SKIP LOCKED) y ejecuta el IngestionPipeline. Como la
+cola vive en Postgres, un job que quedó "running" al reiniciarse el proceso se vuelve a
+reclamar cuando su latido caduca.
+"""
+import threading
+from typing import List, Optional
+
+from app.core.database import SessionLocal
+from app.core.environment import settings
+from app.modules.documents.models import IngestionJob
+from app.modules.documents.repository import IngestionJobRepository
+from app.modules.documents.indexing_pipeline.pipeline import IngestionPipeline
+from app.modules.documents.storage_utils import get_storage
+
+
+def enqueue_ingestion_job(db, document_ids: List[int], user_id: Optional[int]) -> IngestionJob:
+    """Crea el job en la cola; los workers lo recogen en el siguiente sondeo"""
+    return IngestionJobRepository(db).create_job(
+        document_ids,
+        user_id=user_id,
+        max_attempts=settings.ingestion_max_attempts
+    )
+
+
+def _heartbeat(job_id: int, interval: float, done: threading.Event) -> None:
+    # Mantiene vivo el job mientras una etapa larga (p. ej. embeddings) no reporta progreso
+    while not done.wait(interval):
+        try:
+            with SessionLocal() as db:
+                IngestionJobRepository(db).touch(job_id)
+        except Exception as e:
+            print(f"Warning: Could not update heartbeat for job {job_id}: {e}")
+
+
+def run_job(job: IngestionJob) -> None:
+    """Ejecuta un job ya reclamado con sesiones propias (no comparte la de la petición)"""
+    done = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat,
+        args=(job.id, settings.ingestion_job_stale_seconds / 3, done),
+        daemon=True
+    )
+    heartbeat.start()
+    try:
+        _run_job(job)
+    finally:
+        done.set()
+
+
+def _run_job(job: IngestionJob) -> None:
+    with SessionLocal() as db:
+        jobs = IngestionJobRepository(db)
+        pipeline = IngestionPipeline(db, get_storage())
+
+        # En los reintentos solo se reprocesan los documentos que no terminaron
+        pending_ids = [
+            doc_id for doc_id in job.document_ids
+            if (job.progress or {}).get(str(doc_id), {}).get("status") != "processed"
+        ]
+
+        def on_progress(document_id: int, stage: str) -> None:
+            jobs.update_progress(job.id, document_id, stage=stage, status="running")
+
+        try:
+            results = pipeline.process_documents(pending_ids, on_progress=on_progress)
+        except Exception as e:
+            results = [{"document_id": doc_id, "status": "failed", "error": str(e)} for doc_id in pending_ids]
+
+        for result in results:
+            jobs.update_progress(
+                job.id,
+                result["document_id"],
+                stage=result["status"],
+                status=result["status"],
+                error=result.get("error"),
+                chunks_count=result.get("chunks_count"),
+                indexing_cost=result.get("indexing_cost")
+            )
+
+        failed = [r for r in results if r["status"] != "processed"]
+        if not failed:
+            jobs.finish_job(job.id, "completed")
+        elif job.attempts < job.max_attempts:
+            # Backoff exponencial entre reintentos
+            delay = settings.ingestion_retry_backoff_seconds * (2 ** (job.attempts - 1))
+            jobs.requeue_job(job.id, delay, error=failed[0].get("error"))
+        else:
+            jobs.finish_job(job.id, "failed", error=failed[0].get("error"))
+
+
+class IngestionWorkerPool:
+    """Pool de hilos que drena la cola de ingestion_jobs"""
+
+    def __init__(self, concurrency: int, poll_interval: float, stale_after_seconds: float):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stale_after_seconds = stale_after_seconds
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"ingestion-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Deja de reclamar jobs; el job en curso termina o se recupera por latido caducado"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+                if job is None:
+                    self._stop.wait(self.poll_interval)
+                    continue
+                run_job(job)
+            except Exception as e:
+                print(f"Error in ingestion worker: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _claim(self) -> Optional[IngestionJob]:
+        with SessionLocal() as db:
+            job = IngestionJobRepository(db).claim_next_job(self.stale_after_seconds)
+            if job is not None:
+                db.expunge(job)
+            return job
+
+
+ingestion_workers = IngestionWorkerPool(
+    concurrency=settings.ingestion_workers,
+    poll_interval=settings.ingestion_poll_interval_seconds,
+    stale_after_seconds=settings.ingestion_job_stale_seconds
+)
@@ -1,11 +1,28 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float
-from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import JSONB
-from pgvector.sqlalchemy import Vector
+from sqlalchemy import Column, Computed, Integer, String, DateTime, ForeignKey, Float, Text, Index
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from pgvector.sqlalchemy import HALFVEC, Vector
 from app.core.database import Base
+from app.core.environment import settings
 from datetime import datetime
 
 
+EMBEDDING_DIMENSIONS = 1024
+
+
+def embedding_column_type(storage_mode: str):
+    """Tipo de embeddings.embedding: halfvec guarda float16, vector y binary float32"""
+    if storage_mode == "halfvec":
+        return HALFVEC(EMBEDDING_DIMENSIONS)
+    # binary conserva el vector completo para el rescoring; lo cuantizado es solo el índice
+    return Vector(EMBEDDING_DIMENSIONS)
+
+
+def text_search_expression() -> str:
+    """Expresión de la columna generada text_search (también la usa la migración)"""
+    return f"to_tsvector('{settings.text_search_config}', text)"
+
+
 class Document(Base):
     __tablename__ = "documents"
 
@@ -19,17 +36,65 @@ class Document(Base):
     file_size_bytes = Column(Integer, nullable=True)
     status = Column(String(20), default="processed", nullable=False)  # processing, processed, failed
     indexing_cost = Column(Float, nullable=True)  # Costo de indexación en usd
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 del archivo
+    # Versión nueva subida con PUT que aún no se ha indexado: pasa a file_path en la misma
+    # transacción que el nuevo conjunto de chunks
+    pending_file_path = Column(String, nullable=True)
+    pending_file_size_bytes = Column(Integer, nullable=True)
     
     embeddings = relationship("Embedding", back_populates="document", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Nombres únicos por usuario (generate_unique_filename reintenta si hay conflicto)
+        Index("uq_documents_user_filename", "user_id", "filename", unique=True),
+    )
+
 
 class Embedding(Base):
     __tablename__ = "embeddings"
 
     id = Column(Integer, primary_key=True, index=True)
-    embedding = Column(Vector(1024), nullable=False)
+    embedding = Column(embedding_column_type(settings.vector_storage_mode), nullable=False)
     meta_data = Column(JSONB, nullable=True)
     text = Column(String, nullable=False)
     document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=True, index=True)
+    user_id = Column(Integer, nullable=True, index=True)  # Copia de Document.user_id para filtrar sin join
+    content_hash = Column(String(64), nullable=True)  # sha256 del texto del chunk
+    embedding_model = Column(String(50), nullable=True)
+    chunk_index = Column(Integer, nullable=True)  # posición del chunk dentro del documento
+    # Búsqueda full-text de la recuperación híbrida; la calcula Postgres, no se carga con la fila
+    text_search = deferred(Column(TSVECTOR, Computed(text_search_expression(), persisted=True)))
     
     document = relationship("Document", back_populates="embeddings")
+
+    __table_args__ = (
+        # Búsqueda de vectores reutilizables por hash del chunk
+        Index("ix_embeddings_dedup", "user_id", "embedding_model", "content_hash"),
+        Index("ix_embeddings_text_search", "text_search", postgresql_using="gin"),
+        # Filtros de /chat/search por contención (meta_data @> {...})
+        Index(
+            "ix_embeddings_meta_data",
+            "meta_data",
+            postgresql_using="gin",
+            postgresql_ops={"meta_data": "jsonb_path_ops"},
+        ),
+    )
+
+
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=True, index=True)
+    document_ids = Column(JSONB, nullable=False)
+    status = Column(String(20), default="queued", nullable=False, index=True)  # queued, running, completed, failed
+    # {document_id: {"stage": ..., "status": ..., "error": ...}}
+    progress = Column(JSONB, nullable=False, default=dict)
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    error = Column(Text, nullable=True)
+    available_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # no reclamar antes (backoff de reintentos)
+    heartbeat_at = Column(DateTime, nullable=True)  # jobs "running" sin latido se consideran huérfanos
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
@@ -1,7 +1,23 @@
+from sqlalchemy import or_, and_, update, func, cast, Integer
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app.modules.documents.models import Document
-from typing import List, Optional
+from app.modules.documents.models import Document, Embedding, IngestionJob
+from typing import Callable, List, Optional, Dict, Any
 from pathlib import Path
+from datetime import datetime, timedelta
+import re
+
+
+def numbered_filename_pattern(filename: str) -> str:
+    """
+    Regex de Postgres que captura N en las copias stem_N.ext de filename.
+
+    Stem y extensión van escapados. Como mucho 9 dígitos para que el cast a INTEGER no
+    desborde con nombres tipo scan_20241018093011.pdf (esos sufijos no pueden coincidir
+    con N + 1).
+    """
+    path = Path(filename)
+    return f"^{re.escape(path.stem)}_([0-9]{{1,9}}){re.escape(path.suffix)}$"
 
 
 class DocumentRepository:
@@ -39,23 +55,60 @@ class DocumentRepository:
         """Obtener un documento por su nombre de archivo"""
         return self.db.query(Document).filter(Document.filename == filename).first()
     
-    def generate_unique_filename(self, filename: str) -> str:
-        """Generar un nombre de archivo único si ya existe"""
+    def generate_unique_filename(self, filename: str, user_id: Optional[int] = None) -> str:
+        """
+        Generar un nombre de archivo único para el usuario si ya existe.
+
+        Una sola consulta: indica si el nombre original está ocupado y el mayor sufijo
+        existente (stem_N.ext); el nuevo nombre usa N + 1.
+        """
         path = Path(filename)
         stem = path.stem  # nombre sin extensión
         suffix = path.suffix  # .pdf, .docx, etc.
-        
-        # Verificar si el nombre original ya existe
-        if not self.get_document_by_filename(filename):
+
+        pattern = numbered_filename_pattern(filename)
+        like_prefix = stem.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+        name_taken, max_counter = self.db.query(
+            func.coalesce(func.bool_or(Document.filename == filename), False),
+            func.max(cast(func.substring(Document.filename, pattern), Integer))
+        ).filter(
+            Document.user_id == user_id,
+            Document.filename.like(f"{like_prefix}%", escape="\\")
+        ).one()
+
+        if not name_taken:
             return filename
-        
-        # Buscar un nombre único incrementando el contador
-        counter = 1
-        while True:
-            new_filename = f"{stem}_{counter}{suffix}"
-            if not self.get_document_by_filename(new_filename):
-                return new_filename
-            counter += 1
+        return f"{stem}_{(max_counter or 0) + 1}{suffix}"
+
+    def create_document_with_unique_filename(
+        self,
+        filename: str,
+        user_id: Optional[int],
+        build_file_path: Callable[[str], Optional[str]],
+        max_attempts: int = 5,
+        **fields: Any
+    ) -> Document:
+        """
+        Crear un documento con un nombre único para el usuario.
+
+        Dos subidas simultáneas pueden elegir el mismo nombre: el índice único
+        (user_id, filename) rechaza la segunda y se reintenta con el siguiente sufijo.
+        build_file_path recibe el nombre elegido y devuelve la ruta en storage.
+        """
+        for attempt in range(1, max_attempts + 1):
+            unique_filename = self.generate_unique_filename(filename, user_id)
+            try:
+                return self.create_document(
+                    filename=unique_filename,
+                    file_path=build_file_path(unique_filename),
+                    user_id=user_id,
+                    **fields
+                )
+            except IntegrityError:
+                self.db.rollback()
+                if attempt == max_attempts:
+                    raise
 
     def get_document_by_filename_and_user(self, filename: str, user_id: int) -> Optional[Document]:
         """Obtener un documento por su nombre de archivo y usuario"""
@@ -95,19 +148,59 @@ class DocumentRepository:
             return True
         return False
 
-    def update_document_processing_result(self, document_id: int, chunks_count: int, status: str, indexing_cost: float | None = None) -> bool:
-        """Actualizar resultado completo del procesamiento"""
+    def delete_reserved_documents(self, document_ids: List[int]) -> None:
+        """
+        Eliminar documentos reservados que no llegaron a subirse (sin embeddings).
+
+        Descarta antes la transacción en curso, que puede haber quedado abortada por el error.
+        """
+        self.db.rollback()
+        if document_ids:
+            self.db.query(Document).filter(Document.id.in_(document_ids)).delete(synchronize_session=False)
+            self.db.commit()
+
+    def update_document_processing_result(self, document_id: int, chunks_count: int, status: str, indexing_cost: float | None = None, content_hash: Optional[str] = None, promote_file_path: Optional[str] = None) -> bool:
+        """
+        Actualizar resultado completo del procesamiento.
+
+        promote_file_path (la versión pendiente que se indexó) pasa a ser file_path en el
+        mismo commit, salvo que otra subida la haya sustituido mientras tanto.
+        """
         document = self.get_document_by_id(document_id)
         if document:
             document.chunks_count = chunks_count
             document.status = status
             if indexing_cost is not None:
                 document.indexing_cost = indexing_cost
+            if content_hash is not None:
+                document.content_hash = content_hash
+            if promote_file_path:
+                self.db.query(Document).filter(
+                    Document.id == document_id,
+                    Document.pending_file_path == promote_file_path
+                ).update({
+                    Document.file_path: Document.pending_file_path,
+                    Document.file_size_bytes: Document.pending_file_size_bytes,
+                    Document.pending_file_path: None,
+                    Document.pending_file_size_bytes: None,
+                }, synchronize_session=False)
             self.db.commit()
             self.db.refresh(document)
             return True
         return False
 
+    def discard_pending_file(self, document_id: int, pending_file_path: str) -> bool:
+        """Olvidar la versión pendiente indicada (si otra subida no la ha sustituido ya)"""
+        discarded = self.db.query(Document).filter(
+            Document.id == document_id,
+            Document.pending_file_path == pending_file_path
+        ).update({
+            Document.pending_file_path: None,
+            Document.pending_file_size_bytes: None,
+        }, synchronize_session=False)
+        self.db.commit()
+        return bool(discarded)
+
     def update_document_status(self, document_id: int, status: str) -> bool:
         """Actualizar solo el estado del documento"""
         document = self.get_document_by_id(document_id)
@@ -118,6 +211,50 @@ class DocumentRepository:
             return True
         return False
 
+    def delete_embeddings(self, document_id: int) -> int:
+        """Eliminar los embeddings de un documento (p. ej. antes de reprocesarlo)"""
+        deleted = self.db.query(Embedding).filter(Embedding.document_id == document_id).delete(synchronize_session=False)
+        self.db.commit()
+        return deleted
+
+    def get_document_chunks(self, document_id: int) -> List[Any]:
+        """Chunks indexados de un documento (sin el vector) para compararlos en un re-index"""
+        return (
+            self.db.query(Embedding.id, Embedding.content_hash, Embedding.chunk_index, Embedding.meta_data)
+            .filter(Embedding.document_id == document_id)
+            .order_by(Embedding.chunk_index, Embedding.id)
+            .all()
+        )
+
+    def delete_embeddings_by_ids(self, embedding_ids: List[int]) -> int:
+        """Eliminar embeddings por ID sin hacer commit (parte de un re-index atómico)"""
+        if not embedding_ids:
+            return 0
+        return self.db.query(Embedding).filter(Embedding.id.in_(embedding_ids)).delete(synchronize_session=False)
+
+    def update_embeddings(self, updates: List[Dict[str, Any]]) -> None:
+        """Actualizar en bloque por ID (p. ej. chunk_index, meta_data) sin hacer commit"""
+        if updates:
+            self.db.execute(update(Embedding), updates)
+
+    def get_embeddings_by_content_hash(self, user_id: int, embedding_model: str, content_hashes: List[str], batch_size: int = 1000) -> Dict[str, Any]:
+        """Vectores ya calculados del usuario para los hashes de chunk dados (uno por hash)"""
+        found: Dict[str, Any] = {}
+        unique_hashes = list(dict.fromkeys(content_hashes))
+        for start in range(0, len(unique_hashes), batch_size):
+            rows = (
+                self.db.query(Embedding.content_hash, Embedding.embedding)
+                .filter(
+                    Embedding.user_id == user_id,
+                    Embedding.embedding_model == embedding_model,
+                    Embedding.content_hash.in_(unique_hashes[start:start + batch_size])
+                )
+                .distinct(Embedding.content_hash)
+                .all()
+            )
+            found.update({content_hash: embedding for content_hash, embedding in rows})
+        return found
+
     def update_document_metadata(self, document_id: int, **kwargs) -> bool:
         """Actualizar metadata del documento"""
         document = self.get_document_by_id(document_id)
@@ -130,3 +267,114 @@ class DocumentRepository:
             return True
         return False
 
+
+class IngestionJobRepository:
+    """Repositorio para la cola de jobs de indexación"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def create_job(self, document_ids: List[int], user_id: Optional[int], max_attempts: int) -> IngestionJob:
+        """Encolar un job para indexar los documentos dados"""
+        job = IngestionJob(
+            user_id=user_id,
+            document_ids=document_ids,
+            status="queued",
+            progress={str(doc_id): {"stage": "queued", "status": "queued"} for doc_id in document_ids},
+            max_attempts=max_attempts
+        )
+        self.db.add(job)
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    def get_job(self, job_id: int) -> Optional[IngestionJob]:
+        """Obtener un job por su ID"""
+        return self.db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+
+    def claim_next_job(self, stale_after_seconds: float) -> Optional[IngestionJob]:
+        """
+        Reclamar el siguiente job disponible y marcarlo como running.
+
+        También recoge jobs running cuyo worker dejó de latir (reinicio o caída), salvo que
+        ya hayan agotado sus intentos: esos se marcan como failed para que un documento que
+        tumba el proceso (p. ej. por memoria) no se reclame indefinidamente.
+        FOR UPDATE SKIP LOCKED permite varios workers/procesos sin reclamar el mismo job.
+        """
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=stale_after_seconds)
+        stale = and_(IngestionJob.status == "running", IngestionJob.heartbeat_at < stale_before)
+
+        exhausted_ids = self.db.execute(
+            update(IngestionJob)
+            .where(stale, IngestionJob.attempts >= IngestionJob.max_attempts)
+            .values(status="failed", error="Worker died while processing the job", finished_at=now)
+            .returning(IngestionJob.document_ids)
+        ).scalars().all()
+        document_ids = [doc_id for ids in exhausted_ids for doc_id in ids]
+        if document_ids:
+            self.db.query(Document).filter(
+                Document.id.in_(document_ids),
+                Document.status == "processing"
+            ).update({Document.status: "failed"}, synchronize_session=False)
+        if exhausted_ids:
+            self.db.commit()
+
+        job = (
+            self.db.query(IngestionJob)
+            .filter(or_(
+                and_(IngestionJob.status == "queued", IngestionJob.available_at <= now),
+                and_(stale, IngestionJob.attempts < IngestionJob.max_attempts),
+            ))
+            .order_by(IngestionJob.available_at, IngestionJob.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if not job:
+            self.db.rollback()
+            return None
+        job.status = "running"
+        job.attempts += 1
+        job.heartbeat_at = now
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    def update_progress(self, job_id: int, document_id: int, **fields: Any) -> None:
+        """Actualizar el progreso de un documento del job (y el latido del worker)"""
+        job = self.get_job(job_id)
+        if not job:
+            return
+        progress = dict(job.progress or {})
+        entry = dict(progress.get(str(document_id), {}))
+        entry.update(fields)
+        progress[str(document_id)] = entry
+        job.progress = progress
+        job.heartbeat_at = datetime.utcnow()
+        self.db.commit()
+
+    def touch(self, job_id: int) -> None:
+        """Actualizar solo el latido del job"""
+        self.db.query(IngestionJob).filter(
+            IngestionJob.id == job_id,
+            IngestionJob.status == "running"
+        ).update({IngestionJob.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+        self.db.commit()
+
+    def finish_job(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        """Marcar el job como terminado (completed/failed)"""
+        job = self.get_job(job_id)
+        if job:
+            job.status = status
+            job.error = error
+            job.finished_at = datetime.utcnow()
+            self.db.commit()
+
+    def requeue_job(self, job_id: int, delay_seconds: float, error: Optional[str] = None) -> None:
+        """Devolver el job a la cola para reintentarlo tras delay_seconds"""
+        job = self.get_job(job_id)
+        if job:
+            job.status = "queued"
+            job.error = error
+            job.available_at = datetime.utcnow() + timedelta(seconds=delay_seconds)
+            self.db.commit()
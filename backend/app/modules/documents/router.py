@@ -1,15 +1,17 @@
 from typing import Optional, Annotated, List
-from fastapi import APIRouter, Depends, UploadFile, File, Form, Request
+from fastapi import APIRouter, Depends, UploadFile, File, Form, Request, status
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
 from app.core.security import get_and_verify_user
 from app.modules.documents.services import DocumentService
 from app.modules.documents.repository import DocumentRepository
-from app.modules.documents.schemas import DocumentListResponse, DocumentResponse
+from app.modules.documents.schemas import DocumentListResponse, DocumentResponse, IngestionJobResponse
 from app.modules.documents.indexing_pipeline.pipeline import IngestionPipeline
-from app.modules.documents.storage_utils import storage
+from app.modules.documents.storage_utils import get_storage
 from app.modules.users.schemas import UserContext
+from app.core.environment import settings
 
 
 router = APIRouter(prefix="/documents", tags=["Documents"])
@@ -17,7 +19,7 @@ router = APIRouter(prefix="/documents", tags=["Documents"])
 
 def get_document_service(db: Annotated[Session, Depends(get_db)]) -> DocumentService:
 	repository = DocumentRepository(db)
-	pipeline = IngestionPipeline(db, storage)
+	pipeline = IngestionPipeline(db, get_storage())
 	return DocumentService(repository, pipeline)
 
 
@@ -28,9 +30,62 @@ async def upload_and_process_documents(
     user: UserContext = Depends(get_and_verify_user),
     service: DocumentService = Depends(get_document_service)
 ):
-    documents = await service.upload_documents(files, user)
+    documents, failed_uploads = await service.upload_documents(files, user)
     document_ids = [doc.id for doc in documents]
-    return service.index_documents(document_ids, user)
+    # Los archivos que no se pudieron subir se informan junto al resto
+    failed_results = [
+        {"filename": failed["filename"], "status": "failed", "error": failed["error"]}
+        for failed in failed_uploads
+    ]
+    if not settings.ingestion_background:
+        response = service.index_documents(document_ids, user)
+        response["results"].extend(failed_results)
+        return response
+
+    # La indexación corre en los workers: responder ya con el job para consultar su progreso
+    job = service.enqueue_indexing(document_ids, user)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "message": "Files uploaded. Indexing in progress.",
+            "job_id": job.id,
+            "document_ids": document_ids,
+            "failed_uploads": failed_results,
+        }
+    )
+
+
+@router.put("/{document_id}")
+async def update_document(
+    document_id: int,
+    file: UploadFile = File(...),
+    user: UserContext = Depends(get_and_verify_user),
+    service: DocumentService = Depends(get_document_service)
+):
+    """Sube una nueva versión del documento y re-indexa solo los chunks que cambiaron"""
+    await service.replace_document_file(document_id, file, user)
+    if not settings.ingestion_background:
+        return service.index_documents([document_id], user)
+
+    job = service.enqueue_indexing([document_id], user)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "message": "File updated. Re-indexing in progress.",
+            "job_id": job.id,
+            "document_ids": [document_id],
+        }
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJobResponse)
+def get_ingestion_job(
+    job_id: int,
+    user: UserContext = Depends(get_and_verify_user),
+    service: DocumentService = Depends(get_document_service),
+):
+    """Estado y progreso por etapa de un job de indexación"""
+    return service.get_ingestion_job(job_id, user)
 
 
 
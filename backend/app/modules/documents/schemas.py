@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 
@@ -21,3 +21,19 @@ class DocumentResponse(BaseModel):
 class DocumentListResponse(BaseModel):
     total: int
     documents: List[DocumentResponse]
+
+
+
+class IngestionJobResponse(BaseModel):
+    id: int
+    status: str
+    document_ids: List[int]
+    progress: Dict[str, Dict[str, Any]]
+    attempts: int
+    max_attempts: int
+    error: Optional[str]
+    created_at: datetime
+    finished_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
@@ -1,13 +1,18 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import uuid
 from fastapi import UploadFile
 
-from app.modules.documents.repository import DocumentRepository
+from app.modules.documents.repository import DocumentRepository, IngestionJobRepository
+from app.modules.users.repository import UserRepository
 from app.modules.users.schemas import UserContext
 from app.modules.documents.models import Document
-from app.modules.documents.exceptions import DocumentNotFound, ForbiddenDocumentAccess, InvalidAuthenticationContext
-from app.modules.documents.schemas import DocumentResponse, DocumentListResponse
+from app.modules.documents.exceptions import DocumentNotFound, ForbiddenDocumentAccess, InvalidAuthenticationContext, IngestionJobNotFound, InvalidDocumentUpdate, DocumentUploadError
+from app.modules.documents.schemas import DocumentResponse, DocumentListResponse, IngestionJobResponse
+from app.modules.documents.jobs import enqueue_ingestion_job
 from app.modules.documents.indexing_pipeline.pipeline import IngestionPipeline
-from app.modules.documents.storage_utils import storage
+from app.modules.documents.storage_utils import get_storage
+from app.modules.documents.spool import spool_upload, spooled_files
 
 class DocumentService:
     
@@ -21,6 +26,21 @@ class DocumentService:
         results = self.pipeline.process_documents(document_ids)
         
         return {"results": results}
+
+    def enqueue_indexing(self, document_ids: List[int], user: UserContext) -> IngestionJobResponse:
+        """Encola la indexación en segundo plano y devuelve el job para consultar su progreso"""
+        self._validate_user(user)
+        job = enqueue_ingestion_job(self.repository.db, document_ids, user.id)
+        return IngestionJobResponse.model_validate(job)
+
+    def get_ingestion_job(self, job_id: int, user: UserContext) -> IngestionJobResponse:
+        self._validate_user(user)
+        job = IngestionJobRepository(self.repository.db).get_job(job_id)
+        if not job:
+            raise IngestionJobNotFound(f"Ingestion job with id {job_id} not found")
+        if job.user_id != user.id:
+            raise ForbiddenDocumentAccess("You don't have access to this ingestion job")
+        return IngestionJobResponse.model_validate(job)
     
     def delete_document(self, document_id: int, user: UserContext) -> bool:
 
@@ -29,9 +49,14 @@ class DocumentService:
         document = self._get_owned_document_or_404(document_id, user.id)
 
         if document.file_path:
-            storage.delete_file(document.file_path)
+            get_storage().delete_file(document.file_path)
+        if document.pending_file_path:
+            get_storage().delete_file(document.pending_file_path)
         
-        return self.repository.delete_document(document_id)
+        deleted = self.repository.delete_document(document_id)
+        if deleted:
+            UserRepository(self.repository.db).bump_corpus_version(user.id)
+        return deleted
     
     def get_document(self, document_id: int, user: UserContext) -> DocumentResponse:
         document = self._get_owned_document_or_404(document_id, user.id)
@@ -50,31 +75,116 @@ class DocumentService:
         )
 
 
-    async def upload_documents(self, files: List[UploadFile], user: UserContext) -> List[Document]:
+    async def upload_documents(self, files: List[UploadFile], user: UserContext) -> Tuple[List[Document], List[Dict]]:
+        """
+        Sube los archivos en paralelo y crea un documento por cada subida correcta.
+        Returns: (documentos creados, [{"filename", "error"}] de los archivos que fallaron)
+        """
         self._validate_user(user)
-        file_paths = await storage.save_uploaded_files(files, user_id=user.id)
-        
-        documents = []
-        for file_path in file_paths:
-            file_info = storage.get_file_info(file_path)
-            original_filename = file_info["filename"]
-            
-            # Generar un nombre único si ya existe en la base de datos
-            unique_filename = self.repository.generate_unique_filename(original_filename)
-            
-            # Crear el documento con el nombre único
-            document = self.repository.create_document(
-                filename=unique_filename,
-                file_path=file_info["file_path"],
-                file_type=file_info["file_type"],
-                chunks_count=0,
-                file_size_bytes=file_info["file_size_bytes"],
+        storage = get_storage()
+
+        # Volcar cada subida a disco por bloques (sin el archivo entero en memoria)
+        spooled_uploads = [await spool_upload(file) for file in files]
+        reserved = []
+        reserved_ids = []  # aparte: tras un error la sesión no puede recargar document.id
+        try:
+            # Reservar primero el nombre único: el archivo se guarda en storage con ese
+            # nombre y dos documentos homónimos no comparten (ni pisan) el mismo objeto
+            for spooled in spooled_uploads:
+                reserved.append(self.repository.create_document_with_unique_filename(
+                    filename=spooled.filename,
+                    user_id=user.id,
+                    build_file_path=lambda name: storage.build_path(name, user.id),
+                    file_type=Path(spooled.filename).suffix.lower().replace(".", ""),
+                    chunks_count=0,
+                    file_size_bytes=spooled.size,
+                    status="uploading"
+                ))
+                reserved_ids.append(reserved[-1].id)
+
+            # Tamaño y tipo se miden al subir: no hace falta consultar el storage
+            stored_files = await storage.save_spooled_files(
+                spooled_uploads,
                 user_id=user.id,
-                status="uploaded"
+                filenames=[document.filename for document in reserved]
             )
-            documents.append(document)
-        
-        return documents
+
+            documents = []
+            failed = []
+            for document, spooled, file_info in zip(reserved, spooled_uploads, stored_files):
+                if "error" in file_info:
+                    failed.append(file_info)
+                    self.repository.delete_document(document.id)
+                    spooled.cleanup()
+                    continue
+
+                self.repository.update_document_status(document.id, "uploaded")
+                # El pipeline indexa desde el archivo local en lugar de descargarlo de storage
+                spooled_files.put(document.id, spooled.path)
+                documents.append(document)
+        except Exception:
+            # Ningún documento de la petición sigue adelante: sin las reservas quedarían
+            # filas "uploading" huérfanas que además bloquean sus nombres
+            for document_id in reserved_ids:
+                spooled_files.pop(document_id)
+            try:
+                self.repository.delete_reserved_documents(reserved_ids)
+            except Exception as e:
+                print(f"Warning: Could not delete reserved documents {reserved_ids}: {e}")
+            for spooled in spooled_uploads:
+                spooled.cleanup()
+            raise
+
+        if not documents and failed:
+            raise DocumentUploadError(f"Could not upload any file: {failed[0]['error']}")
+
+        return documents, failed
+
+    async def replace_document_file(self, document_id: int, file: UploadFile, user: UserContext) -> Document:
+        """
+        Sustituye el archivo de un documento existente conservando su ID y nombre.
+
+        El archivo nuevo se sube a una ruta versionada y queda como pending_file_path: el
+        documento sigue apuntando al archivo indexado hasta que la re-indexación guarda los
+        chunks nuevos, y en esa misma transacción pasa a file_path. Si la indexación falla,
+        storage e índice siguen siendo los de la versión anterior. La re-indexación compara
+        los chunks nuevos con los indexados y solo embebe los que cambiaron.
+        """
+        self._validate_user(user)
+        document = self._get_owned_document_or_404(document_id, user.id)
+
+        file_type = Path(file.filename or "").suffix.lower().replace(".", "")
+        if file_type != document.file_type:
+            raise InvalidDocumentUpdate(
+                f"Expected a .{document.file_type} file to update '{document.filename}', got '{file.filename}'"
+            )
+
+        storage = get_storage()
+        previous_pending = document.pending_file_path
+        spooled = await spool_upload(file)
+        try:
+            stem, suffix = Path(document.filename).stem, Path(document.filename).suffix
+            version_name = f"{stem}.{uuid.uuid4().hex[:12]}{suffix}"
+            file_info = await storage.save_spooled_file(spooled, filename=version_name, user_id=user.id)
+            self.repository.update_document_metadata(
+                document_id,
+                pending_file_path=file_info["file_path"],
+                pending_file_size_bytes=file_info["file_size_bytes"]
+            )
+        except Exception:
+            spooled.cleanup()
+            raise
+
+        # Otra versión subida antes y aún sin indexar: ya no la referencia nadie
+        if previous_pending and previous_pending != file_info["file_path"]:
+            try:
+                storage.delete_file(previous_pending)
+            except Exception as e:
+                print(f"Warning: Could not delete pending file {previous_pending}: {e}")
+
+        spooled_files.put(document_id, spooled.path)
+        return document
+
     # Security Section
 
     def _validate_user(self, user: UserContext) -> None:
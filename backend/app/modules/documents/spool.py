@@ -0,0 +1,126 @@
+"""
+Spool de subidas - los archivos subidos se escriben a disco por bloques
+
+Evita tener el archivo completo en memoria: la subida a storage se hace en streaming
+desde el archivo en disco y el pipeline de indexación lo lee directamente, sin volver
+a descargarlo de storage.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi import UploadFile
+
+from app.core.environment import settings
+
+
+@dataclass
+class SpooledUpload:
+    """Archivo subido ya volcado a disco"""
+    path: Path
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+    def cleanup(self) -> None:
+        _unlink(self.path)
+
+
+async def spool_upload(file: UploadFile, filename: Optional[str] = None) -> SpooledUpload:
+    """Copia el UploadFile a un archivo temporal por bloques, calculando tamaño y hash"""
+    filename = filename or file.filename or "upload"
+    digest = hashlib.sha256()
+    size = 0
+    # El sufijo se conserva: el preprocesador elige el parser por extensión
+    fd, path = tempfile.mkstemp(suffix=Path(filename).suffix, dir=settings.upload_spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await file.read(settings.upload_chunk_size_bytes)
+                if not block:
+                    break
+                digest.update(block)
+                size += len(block)
+                out.write(block)
+    except Exception:
+        _unlink(Path(path))
+        raise
+
+    return SpooledUpload(
+        path=Path(path),
+        filename=filename,
+        content_type=file.content_type or "application/octet-stream",
+        size=size,
+        sha256=digest.hexdigest()
+    )
+
+
+def file_sha256(path: Path) -> str:
+    """sha256 de un archivo leyendo por bloques"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(settings.upload_chunk_size_bytes), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SpoolRegistry:
+    """
+    Archivos en disco pendientes de indexar, por document_id.
+
+    El pipeline los toma (pop) en lugar de descargar de storage y se hace cargo de
+    borrarlos. Si el documento lo indexa otro proceso la entrada caduca y el archivo
+    se borra en la siguiente escritura o al cerrar la app.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[Path, float]] = {}
+
+    def put(self, document_id: int, path: Path) -> None:
+        with self._lock:
+            self._evict_expired()
+            previous = self._entries.pop(document_id, None)
+            self._entries[document_id] = (path, time.monotonic() + self.ttl_seconds)
+        if previous:
+            _unlink(previous[0])
+
+    def pop(self, document_id: int) -> Optional[Path]:
+        with self._lock:
+            entry = self._entries.pop(document_id, None)
+        if entry and entry[0].exists():
+            return entry[0]
+        return None
+
+    def clear(self) -> None:
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        for path, _ in entries.values():
+            _unlink(path)
+
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        for document_id, (path, expires_at) in list(self._entries.items()):
+            if expires_at <= now:
+                del self._entries[document_id]
+                _unlink(path)
+
+
+def _unlink(path: Path) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Warning: Could not delete spooled file {path}: {e}")
+
+
+# Instancia global del proceso
+spooled_files = SpoolRegistry(ttl_seconds=settings.upload_spool_ttl_seconds)
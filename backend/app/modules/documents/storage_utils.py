@@ -1,18 +1,200 @@
 """
-Utilidades para manejo de archivos con Supabase Storage
+Utilidades para manejo de archivos: backends de Supabase Storage y sistema de archivos local
 """
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from fastapi import UploadFile
-from typing import List, Optional, Dict
+from typing import Iterator, List, Optional, Dict
 from supabase import create_client, Client
+from app.core.cache import TTLCache
 from app.core.environment import settings
+from app.modules.documents.spool import SpooledUpload, spool_upload
+import asyncio
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
 import uuid
 from pathlib import Path
 
 
-class SupabaseStorage:
+_upload_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_upload_executor() -> ThreadPoolExecutor:
+    # Pool propio: el executor por defecto de asyncio tiene pocos hilos en máquinas con pocas CPUs
+    global _upload_executor
+    if _upload_executor is None:
+        _upload_executor = ThreadPoolExecutor(max_workers=settings.upload_concurrency, thread_name_prefix="storage-upload")
+    return _upload_executor
+
+
+class StorageBackend(ABC):
+    """
+    Interfaz de almacenamiento de archivos.
+
+    Las rutas son relativas (user_<id>/archivo.ext) e iguales en todos los backends,
+    así Document.file_path no depende del backend configurado.
+    """
+
+    def __init__(self):
+        # Metadata por ruta: se llena al subir, así get_file_info no consulta al backend
+        self._file_info_cache = TTLCache(
+            maxsize=settings.file_info_cache_size,
+            ttl=settings.file_info_cache_ttl_seconds
+        )
+
+    async def save_uploaded_file(self, file: UploadFile, filename: Optional[str] = None, user_id: Optional[int] = None) -> Dict:
+        """
+        Guarda un archivo en el storage
+        Si se proporciona user_id, guarda en carpeta user_<user_id>/filename
+        Returns: Dict con file_path (path/to/file.ext), filename, file_type, file_size_bytes,
+        content_type y public_url, medidos durante la subida
+        """
+        base_filename = filename or file.filename or f"uploaded_{uuid.uuid4()}"
+
+        # Volcar a disco por bloques en lugar de leer el archivo entero en memoria
+        spooled = await spool_upload(file, base_filename)
+        try:
+            return await self.save_spooled_file(spooled, base_filename, user_id)
+        finally:
+            spooled.cleanup()
+
+    async def save_spooled_file(self, spooled: SpooledUpload, filename: Optional[str] = None, user_id: Optional[int] = None) -> Dict:
+        """Sube un archivo ya volcado a disco sin bloquear el event loop; devuelve su metadata"""
+        dest_name = self.build_path(filename or spooled.filename, user_id)
+        loop = asyncio.get_running_loop()
+        file_path = await loop.run_in_executor(
+            _get_upload_executor(), self.upload_local_file, spooled.path, dest_name, spooled.content_type
+        )
+        file_info = self.build_file_info(file_path, spooled.size, spooled.content_type)
+        self._file_info_cache.set(file_path, file_info)
+        return file_info
+
+    def build_file_info(self, file_path: str, file_size_bytes: int, content_type: Optional[str] = None) -> Dict:
+        path_obj = Path(file_path)
+        return {
+            "filename": path_obj.name,
+            "file_type": path_obj.suffix.lower().replace(".", ""),
+            "file_size_bytes": file_size_bytes,
+            "file_path": file_path,
+            "content_type": content_type,
+            "public_url": self.get_public_url(file_path)
+        }
+
+    def get_file_info(self, file_path: str) -> Dict:
+        """
+        Obtiene información de un archivo (caché por ruta, si no una consulta al backend)
+        Returns: Dict con filename, file_type, file_size_bytes, file_path, content_type, public_url
+        """
+        file_info = self._file_info_cache.get(file_path)
+        if file_info is None:
+            file_info = self._fetch_file_info(file_path)
+            if file_info:
+                self._file_info_cache.set(file_path, file_info)
+        return dict(file_info)
+
+    def forget_file_info(self, file_path: str) -> None:
+        self._file_info_cache.delete(file_path)
+
+    def build_path(self, filename: str, user_id: Optional[int] = None) -> str:
+        # Organizar por usuario si se proporciona user_id
+        if user_id:
+            return f"user_{user_id}/{filename}"
+        return filename
+
+    async def save_uploaded_files(self, files: List[UploadFile], user_id: Optional[int] = None) -> List[Dict]:
+        """
+        Guarda múltiples archivos en el storage en paralelo
+        Returns: Un Dict por archivo, en el mismo orden; los que fallan traen filename y error
+        """
+        spooled_uploads = [await spool_upload(file) for file in files]
+        try:
+            return await self.save_spooled_files(spooled_uploads, user_id=user_id)
+        finally:
+            for spooled in spooled_uploads:
+                spooled.cleanup()
+
+    async def save_spooled_files(
+        self,
+        spooled_uploads: List[SpooledUpload],
+        user_id: Optional[int] = None,
+        filenames: Optional[List[Optional[str]]] = None
+    ) -> List[Dict]:
+        """
+        Sube varios archivos volcados a disco con como mucho settings.upload_concurrency
+        subidas a la vez. El fallo de un archivo no cancela los demás.
+        filenames permite guardar cada archivo con otro nombre (mismo orden).
+        """
+        semaphore = asyncio.Semaphore(settings.upload_concurrency)
+        filenames = filenames or [None] * len(spooled_uploads)
+
+        async def save(spooled: SpooledUpload, filename: Optional[str]) -> Dict:
+            async with semaphore:
+                try:
+                    return await self.save_spooled_file(spooled, filename=filename, user_id=user_id)
+                except Exception as e:
+                    print(f"Warning: Could not upload {spooled.filename}: {e}")
+                    return {"filename": filename or spooled.filename, "error": str(e)}
+
+        # gather conserva el orden de entrada
+        return list(await asyncio.gather(*(
+            save(spooled, filename) for spooled, filename in zip(spooled_uploads, filenames)
+        )))
+    
+    @abstractmethod
+    def upload_local_file(self, local_path: Path, dest_name: str, content_type: str) -> str:
+        """Guarda un archivo local en dest_name y devuelve la ruta en el storage"""
+
+    @abstractmethod
+    def download_file(self, file_path: str) -> bytes:
+        """Contenido completo del archivo"""
+
+    @abstractmethod
+    def delete_file(self, file_path: str) -> bool:
+        """Elimina el archivo; False si no se pudo"""
+
+    @abstractmethod
+    def file_exists(self, file_path: str) -> bool:
+        """Indica si el archivo existe"""
+
+    @abstractmethod
+    def _fetch_file_info(self, file_path: str) -> Dict:
+        """Metadata del archivo consultada al backend ({} si no existe)"""
+
+    def get_public_url(self, file_path: str) -> str:
+        return ""
+
+    def get_signed_url(self, file_path: str, expires_in: int = 3600) -> str:
+        return ""
+
+    @contextmanager
+    def open_local(self, file_path: str) -> Iterator[Path]:
+        """
+        Ruta local legible del archivo mientras dure el contexto.
+
+        Por defecto descarga a un archivo temporal que se borra al salir; los backends
+        que ya guardan en disco devuelven la ruta real sin copiar.
+        """
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=Path(file_path).suffix)
+        try:
+            with temp_file:
+                temp_file.write(self.download_file(file_path))
+            yield Path(temp_file.name)
+        finally:
+            try:
+                os.unlink(temp_file.name)
+            except Exception as e:
+                print(f"Warning: Could not delete temp file {temp_file.name}: {e}")
+
+
+class SupabaseStorage(StorageBackend):
     """Manejo de archivos en Supabase Storage"""
     
     def __init__(self, supabase_url: str, supabase_key: str, bucket_name: str):
+        super().__init__()
         self.client: Client = create_client(supabase_url, supabase_key)
         self.bucket_name = bucket_name
         self._ensure_bucket_exists()
@@ -27,56 +209,26 @@ class SupabaseStorage:
         except Exception as e:
             print(f"Warning: Could not verify bucket existence: {e}")
     
-    async def save_uploaded_file(self, file: UploadFile, filename: Optional[str] = None, user_id: Optional[int] = None) -> str:
-        """
-        Guarda un archivo en Supabase Storage
-        Si se proporciona user_id, guarda en carpeta user_<user_id>/filename
-        Returns: La ruta del archivo en Supabase (path/to/file.ext)
-        """
-        base_filename = filename or file.filename or f"uploaded_{uuid.uuid4()}"
-        
-        # Organizar por usuario si se proporciona user_id
-        if user_id:
-            dest_name = f"user_{user_id}/{base_filename}"
-        else:
-            dest_name = base_filename
-        
-        # Leer el contenido del archivo
-        file_content = await file.read()
-        
-        # Subir a Supabase Storage
-        try:
-            response = self.client.storage.from_(self.bucket_name).upload(
-                path=dest_name,
-                file=file_content,
-                file_options={"content-type": file.content_type or "application/octet-stream"}
-            )
-            
+    def upload_local_file(self, local_path: Path, dest_name: str, content_type: str) -> str:
+        """Sube un archivo local en streaming (httpx lo lee por bloques desde disco)"""
+        file_options = {"content-type": content_type or "application/octet-stream"}
+        bucket = self.client.storage.from_(self.bucket_name)
+        try:
+            with open(local_path, "rb") as f:
+                bucket.upload(path=dest_name, file=f, file_options=file_options)
             # Retornar la ruta del archivo en Supabase
             return dest_name
         except Exception as e:
             # Si el archivo ya existe, intentar actualizar
             if "duplicate" in str(e).lower() or "already exists" in str(e).lower():
-                self.client.storage.from_(self.bucket_name).update(
-                    path=dest_name,
-                    file=file_content,
-                    file_options={"content-type": file.content_type or "application/octet-stream"}
-                )
+                with open(local_path, "rb") as f:
+                    bucket.update(path=dest_name, file=f, file_options=file_options)
                 return dest_name
             raise Exception(f"Error uploading file to Supabase: {e}")
     
-    async def save_uploaded_files(self, files: List[UploadFile], user_id: Optional[int] = None) -> List[str]:
-        """Guarda múltiples archivos en Supabase Storage"""
-        saved_paths = []
-        
-        for file in files:
-            path = await self.save_uploaded_file(file, user_id=user_id)
-            saved_paths.append(path)
-        
-        return saved_paths
-    
     def delete_file(self, file_path: str) -> bool:
         """Elimina un archivo de Supabase Storage"""
+        self.forget_file_info(file_path)
         try:
             self.client.storage.from_(self.bucket_name).remove([file_path])
             return True
@@ -85,52 +237,22 @@ class SupabaseStorage:
             return False
     
     def file_exists(self, file_path: str) -> bool:
-        """Verifica si un archivo existe en Supabase Storage"""
+        """Verifica si un archivo existe en Supabase Storage (HEAD sobre el objeto)"""
         try:
-            files = self.client.storage.from_(self.bucket_name).list()
-            return any(f['name'] == file_path for f in files)
+            return self.client.storage.from_(self.bucket_name).exists(file_path)
         except Exception as e:
             print(f"Warning: Could not check file existence: {e}")
             return False
     
-    def get_file_info(self, file_path: str) -> Dict:
-        """
-        Obtiene información de un archivo desde Supabase Storage
-        Returns: Dict con filename, file_type, file_size_bytes, file_path, public_url
-        """
+    def _fetch_file_info(self, file_path: str) -> Dict:
+        """Metadata de un solo objeto (sin listar la carpeta)"""
         try:
-            # Obtener la URL pública del archivo
-            public_url = self.get_public_url(file_path)
-            
-            # Extraer información del path
-            path_obj = Path(file_path)
-            filename = path_obj.name
-            file_type = path_obj.suffix.lower().replace(".", "")
-            
-            # Intentar obtener metadata del archivo
-            try:
-                # Si el path tiene carpetas (ej: user_1/archivo.pdf), listar dentro de esa carpeta
-                path_parts = file_path.split('/')
-                if len(path_parts) > 1:
-                    folder = '/'.join(path_parts[:-1])  # user_1
-                    files = self.client.storage.from_(self.bucket_name).list(folder)
-                    matching_file = next((f for f in files if f['name'] == filename), None)
-                else:
-                    files = self.client.storage.from_(self.bucket_name).list()
-                    matching_file = next((f for f in files if f['name'] == file_path), None)
-                
-                file_size = matching_file.get('metadata', {}).get('size', 0) if matching_file else 0
-            except Exception as e:
-                print(f"Warning: Could not get file size for {file_path}: {e}")
-                file_size = 0
-            
-            return {
-                "filename": filename,
-                "file_type": file_type,
-                "file_size_bytes": file_size,
-                "file_path": file_path,
-                "public_url": public_url
-            }
+            info = self.client.storage.from_(self.bucket_name).info(file_path)
+            file_size = info.get("size")
+            if file_size is None:
+                file_size = (info.get("metadata") or {}).get("size", 0)
+            content_type = info.get("content_type") or (info.get("metadata") or {}).get("mimetype")
+            return self.build_file_info(file_path, file_size, content_type)
         except Exception as e:
             print(f"Warning: Could not get file info for {file_path}: {e}")
             return {}
@@ -168,9 +290,97 @@ class SupabaseStorage:
             raise Exception(f"Error downloading file from Supabase: {e}")
 
 
-# Instancia global para reutilizar
-storage = SupabaseStorage(
-    supabase_url=settings.SUPABASE_URL,
-    supabase_key=settings.SUPABASE_KEY,
-    bucket_name=settings.SUPABASE_BUCKET
-)
+class LocalStorage(StorageBackend):
+    """
+    Archivos en el sistema de archivos local (despliegues de un nodo, benchmarks offline).
+
+    El pipeline lee los archivos en su sitio, sin descarga ni copia temporal.
+    """
+
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _resolve(self, file_path: str) -> Path:
+        path = (self.root / file_path).resolve()
+        # Evitar rutas fuera de la raíz (p. ej. nombres con "..")
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Invalid storage path: {file_path}")
+        return path
+
+    def upload_local_file(self, local_path: Path, dest_name: str, content_type: str) -> str:
+        dest = self._resolve(dest_name)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # Copia a un temporal en el mismo directorio y rename atómico (sobrescribe si existe)
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, suffix=".part")
+        os.close(fd)
+        try:
+            shutil.copyfile(local_path, tmp)
+            os.replace(tmp, dest)
+        except Exception:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return dest_name
+
+    def download_file(self, file_path: str) -> bytes:
+        try:
+            return self._resolve(file_path).read_bytes()
+        except Exception as e:
+            raise Exception(f"Error reading file from local storage: {e}")
+
+    def delete_file(self, file_path: str) -> bool:
+        self.forget_file_info(file_path)
+        try:
+            self._resolve(file_path).unlink(missing_ok=True)
+            return True
+        except Exception as e:
+            print(f"Warning: Could not delete file {file_path}: {e}")
+            return False
+
+    def file_exists(self, file_path: str) -> bool:
+        try:
+            return self._resolve(file_path).is_file()
+        except ValueError:
+            return False
+
+    def _fetch_file_info(self, file_path: str) -> Dict:
+        try:
+            path = self._resolve(file_path)
+            return self.build_file_info(file_path, path.stat().st_size, mimetypes.guess_type(path.name)[0])
+        except Exception as e:
+            print(f"Warning: Could not get file info for {file_path}: {e}")
+            return {}
+
+    @contextmanager
+    def open_local(self, file_path: str) -> Iterator[Path]:
+        yield self._resolve(file_path)
+
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def create_storage() -> StorageBackend:
+    """Crea el backend indicado en settings.storage_backend"""
+    if settings.storage_backend == "local":
+        return LocalStorage(settings.local_storage_path)
+    if settings.storage_backend == "supabase":
+        if not (settings.SUPABASE_URL and settings.SUPABASE_KEY and settings.SUPABASE_BUCKET):
+            raise RuntimeError("SUPABASE_URL, SUPABASE_KEY and SUPABASE_BUCKET are required for the supabase storage backend")
+        return SupabaseStorage(
+            supabase_url=settings.SUPABASE_URL,
+            supabase_key=settings.SUPABASE_KEY,
+            bucket_name=settings.SUPABASE_BUCKET
+        )
+    raise ValueError(f"Unknown storage backend: {settings.storage_backend}")
+
+
+def get_storage() -> StorageBackend:
+    """Instancia compartida, creada al primer uso (no al importar el módulo)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
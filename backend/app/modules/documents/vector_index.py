@@ -0,0 +1,232 @@
+"""
+Índices ANN (pgvector) para la tabla de embeddings
+"""
+from typing import Dict, List, Optional, Tuple
+from pgvector.sqlalchemy import BIT
+from sqlalchemy import Index, cast, func, text
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from app.core.environment import settings
+from app.modules.documents.models import EMBEDDING_DIMENSIONS, Embedding, embedding_column_type
+
+
+VECTOR_INDEX_TYPES = ("hnsw", "ivfflat", "none")
+VECTOR_STORAGE_MODES = ("vector", "halfvec", "binary")
+# pgvector rechaza hnsw.ef_search por encima de este valor
+HNSW_MAX_EF_SEARCH = 1000
+# Primera versión de pgvector con hnsw.iterative_scan
+ITERATIVE_SCAN_MIN_VERSION = (0, 8)
+
+# Operadores de distancia coseno según el tipo de la columna
+_COSINE_OPS = {"vector": "vector_cosine_ops", "halfvec": "halfvec_cosine_ops"}
+
+
+def get_storage_mode(storage_mode: Optional[str] = None) -> str:
+    storage_mode = (storage_mode or settings.vector_storage_mode).lower()
+    if storage_mode not in VECTOR_STORAGE_MODES:
+        raise ValueError(f"Unsupported vector storage mode: {storage_mode}")
+    return storage_mode
+
+
+def binary_quantized(value):
+    """binary_quantize(value)::bit(n): 1 bit por dimensión (signo), 32 veces menos que float32"""
+    return cast(func.binary_quantize(value), BIT(EMBEDDING_DIMENSIONS))
+
+
+def candidate_count(top_k: int, storage_mode: Optional[str] = None) -> int:
+    """Filas que recorre el índice: en binary se sobre-piden candidatos para el rescoring"""
+    if get_storage_mode(storage_mode) == "binary":
+        return top_k * max(settings.binary_rescore_factor, 1)
+    return top_k
+
+
+def validate_vector_search_settings() -> None:
+    """Valida al arrancar los parámetros que acaban en hnsw.ef_search"""
+    if not 1 <= settings.hnsw_ef_search <= HNSW_MAX_EF_SEARCH:
+        raise ValueError(f"HNSW_EF_SEARCH must be between 1 and {HNSW_MAX_EF_SEARCH}")
+    if not 1 <= settings.binary_rescore_factor <= HNSW_MAX_EF_SEARCH:
+        raise ValueError(f"BINARY_RESCORE_FACTOR must be between 1 and {HNSW_MAX_EF_SEARCH}")
+
+
+def build_vector_index(
+    index_type: Optional[str] = None,
+    user_id: Optional[int] = None,
+    storage_mode: Optional[str] = None,
+) -> Optional[Index]:
+    """
+    Construye el índice ANN configurado sobre embeddings.embedding.
+
+    El nombre incluye el tipo para que cambiar de hnsw a ivfflat cree un índice nuevo
+    en vez de reutilizar el anterior. Con user_id se crea un índice parcial solo con
+    los vectores de ese usuario, que el planner usa para sus consultas filtradas.
+
+    En modo halfvec el índice usa distancia coseno sobre float16; en modo binary se
+    indexa la expresión binary_quantize(embedding) con distancia Hamming y la consulta
+    reordena los candidatos con el vector completo.
+    """
+    index_type = (index_type or settings.vector_index_type).lower()
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"Unsupported vector index type: {index_type}")
+    storage_mode = get_storage_mode(storage_mode)
+
+    if index_type == "none":
+        return None
+
+    prefix = "ix_embeddings_embedding" if storage_mode == "vector" else f"ix_embeddings_embedding_{storage_mode}"
+    name = f"{prefix}_{index_type}"
+    kwargs = {}
+    if user_id is not None:
+        name = f"{name}_user_{user_id}"
+        kwargs["postgresql_where"] = Embedding.user_id == user_id
+
+    if storage_mode == "binary":
+        expression = binary_quantized(Embedding.embedding).label("embedding_binary")
+        ops = {"embedding_binary": "bit_hamming_ops"}
+    else:
+        expression = Embedding.embedding
+        ops = {"embedding": _COSINE_OPS[storage_mode]}
+
+    if index_type == "hnsw":
+        return Index(
+            name,
+            expression,
+            postgresql_using="hnsw",
+            postgresql_with={"m": settings.hnsw_m, "ef_construction": settings.hnsw_ef_construction},
+            postgresql_ops=ops,
+            **kwargs,
+        )
+    # IVFFlat calcula sus listas con los datos existentes: crearlo sobre una tabla
+    # vacía produce un índice de baja calidad, conviene recrearlo tras la carga inicial
+    return Index(
+        name,
+        expression,
+        postgresql_using="ivfflat",
+        postgresql_with={"lists": settings.ivfflat_lists},
+        postgresql_ops=ops,
+        **kwargs,
+    )
+
+
+def current_column_type(conn: Connection) -> Optional[str]:
+    """Tipo actual de embeddings.embedding en la base de datos (p.ej. 'vector(1024)')"""
+    return conn.execute(text(
+        """
+        SELECT format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute AS a
+        WHERE a.attrelid = to_regclass('embeddings') AND a.attname = 'embedding' AND NOT a.attisdropped
+        """
+    )).scalar()
+
+
+def pgvector_version(conn: Connection) -> Optional[Tuple[int, ...]]:
+    """Versión instalada de la extensión vector, p.ej. (0, 8, 0)"""
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    if version is None:
+        return None
+    return tuple(int(part) for part in version.split(".") if part.isdigit())
+
+
+def _check_iterative_scan_support(conn: Connection) -> None:
+    # Con una versión anterior cada consulta fallaría al hacer set_config: mejor no arrancar
+    configured = {
+        name: value for name, value in (
+            ("HNSW_ITERATIVE_SCAN", settings.hnsw_iterative_scan),
+            ("SEARCH_ITERATIVE_SCAN", settings.search_iterative_scan),
+        ) if value
+    }
+    if not configured or settings.vector_index_type.lower() != "hnsw":
+        return
+    version = pgvector_version(conn)
+    if version is not None and version < ITERATIVE_SCAN_MIN_VERSION:
+        raise RuntimeError(
+            f"{', '.join(configured)} requires pgvector >= 0.8 (installed: {'.'.join(map(str, version))}): "
+            "upgrade the extension or unset it"
+        )
+
+
+def expected_column_type(storage_mode: Optional[str] = None) -> str:
+    return embedding_column_type(get_storage_mode(storage_mode)).get_col_spec().lower()
+
+
+# Registrar el índice en la metadata para que create_all lo cree junto con la tabla
+vector_index = build_vector_index()
+
+
+def ensure_vector_index(engine: Engine) -> None:
+    """Crea el índice ANN si la tabla ya existía antes de configurarlo"""
+    validate_vector_search_settings()
+    with engine.connect() as conn:
+        _check_iterative_scan_support(conn)
+        column_type = current_column_type(conn)
+    if column_type and column_type != expected_column_type():
+        raise RuntimeError(
+            f"embeddings.embedding is {column_type} but VECTOR_STORAGE_MODE={settings.vector_storage_mode} "
+            f"expects {expected_column_type()}: run "
+            f"'python -m app.modules.documents.vector_storage {settings.vector_storage_mode}'"
+        )
+    if vector_index is not None:
+        vector_index.create(bind=engine, checkfirst=True)
+
+
+def ensure_tenant_vector_indexes(engine: Engine) -> None:
+    """Crea los índices parciales de los usuarios configurados en dedicated_vector_index_user_ids"""
+    for user_id in settings.dedicated_vector_index_user_ids:
+        index = build_vector_index(user_id=user_id)
+        if index is not None:
+            index.create(bind=engine, checkfirst=True)
+
+
+def search_depth_limit() -> int:
+    """
+    Resultados alcanzables paginando /chat/search (nunca más que settings.search_max_depth).
+
+    Sin búsqueda iterativa HNSW devuelve como mucho ef_search filas, y ef_search no pasa de
+    HNSW_MAX_EF_SEARCH (dividido entre el factor de rescoring en modo binary); la fila extra
+    de cada página también cuenta.
+    """
+    if settings.vector_index_type.lower() != "hnsw" or settings.search_iterative_scan:
+        return settings.search_max_depth
+    return min(settings.search_max_depth, HNSW_MAX_EF_SEARCH // candidate_count(1) - 1)
+
+
+def vector_search_params(
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    top_k: int = 0,
+    iterative_scan: Optional[str] = None,
+) -> List[Tuple[TextClause, Dict[str, str]]]:
+    """
+    Sentencias que ajustan los parámetros de búsqueda ANN para la transacción actual.
+
+    Usa set_config(..., true) (equivalente a SET LOCAL) para que el valor no se filtre
+    a otras peticiones que reutilicen la misma conexión del pool. HNSW nunca devuelve más
+    de ef_search filas, por eso se fuerza a ser al menos top_k (o los candidatos del
+    rescoring en modo binary), sin pasar del máximo que acepta pgvector; iterative_scan
+    sustituye a settings.hnsw_iterative_scan para esta consulta.
+    """
+    statement = text("SELECT set_config(:name, :value, true)")
+    index_type = settings.vector_index_type.lower()
+    params = []
+    if index_type == "hnsw":
+        value = min(max(ef_search or settings.hnsw_ef_search, candidate_count(top_k)), HNSW_MAX_EF_SEARCH)
+        params.append((statement, {"name": "hnsw.ef_search", "value": str(value)}))
+        iterative_scan = iterative_scan or settings.hnsw_iterative_scan
+        if iterative_scan:
+            params.append((statement, {"name": "hnsw.iterative_scan", "value": iterative_scan}))
+    elif index_type == "ivfflat":
+        value = probes or settings.ivfflat_probes
+        params.append((statement, {"name": "ivfflat.probes", "value": str(value)}))
+    return params
+
+
+def apply_vector_search_params(
+    session: Session,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None,
+    top_k: int = 0,
+) -> None:
+    """Aplica vector_search_params en la transacción de una sesión síncrona"""
+    for statement, params in vector_search_params(ef_search=ef_search, probes=probes, top_k=top_k):
+        session.execute(statement, params)
@@ -0,0 +1,98 @@
+"""
+Conversión de embeddings.embedding entre modos de almacenamiento (vector | halfvec | binary)
+
+Uso: python -m app.modules.documents.vector_storage halfvec
+
+Reescribe la columna con ALTER TABLE ... TYPE (bloquea la tabla mientras dura) y recrea
+los índices ANN del modo destino. Después hay que arrancar la app con el mismo
+VECTOR_STORAGE_MODE. Volver de halfvec a vector no recupera la precisión perdida.
+"""
+import argparse
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.core.database import create_maintenance_engine
+from app.core.environment import settings
+from app.modules.documents.vector_index import (
+    VECTOR_STORAGE_MODES,
+    build_vector_index,
+    current_column_type,
+    expected_column_type,
+    get_storage_mode,
+)
+
+
+# Nombres generados por build_vector_index en cualquier modo, con o sin índice por usuario
+_VECTOR_INDEX_NAME_PATTERN = r"^ix_embeddings_embedding_((halfvec|binary)_)?(hnsw|ivfflat)(_user_\d+)?$"
+
+
+def migrate_vector_storage(engine: Engine, storage_mode: str) -> List[str]:
+    """
+    Convierte la columna al tipo del modo indicado y recrea sus índices ANN.
+
+    Es idempotente: si la columna ya tiene el tipo correcto solo se recrean los índices
+    que falten. Devuelve los nombres de los índices del modo destino.
+    """
+    storage_mode = get_storage_mode(storage_mode)
+    target_type = expected_column_type(storage_mode)
+    target_indexes = _target_indexes(storage_mode)
+
+    with engine.begin() as conn:
+        column_type = current_column_type(conn)
+        if column_type is None:
+            raise RuntimeError("Table embeddings does not exist: start the app once to create it")
+
+        # Los índices de otros modos no sirven (ni sobreviven al cambio de tipo)
+        index_names = conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = 'embeddings' AND indexname ~ :pattern"),
+            {"pattern": _VECTOR_INDEX_NAME_PATTERN}
+        ).scalars().all()
+        keep = {index.name for index in target_indexes} if column_type == target_type else set()
+        for name in index_names:
+            if name not in keep:
+                conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
+        if column_type != target_type:
+            print(f"Converting embeddings.embedding from {column_type} to {target_type}...")
+            conn.execute(text(
+                f"ALTER TABLE embeddings ALTER COLUMN embedding TYPE {target_type} USING embedding::{target_type}"
+            ))
+
+    for index in target_indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE embeddings"))
+        conn.commit()
+    return [index.name for index in target_indexes]
+
+
+def _target_indexes(storage_mode: str):
+    indexes = [build_vector_index(storage_mode=storage_mode)]
+    indexes += [
+        build_vector_index(user_id=user_id, storage_mode=storage_mode)
+        for user_id in settings.dedicated_vector_index_user_ids
+    ]
+    return [index for index in indexes if index is not None]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert stored embeddings to another vector storage mode")
+    parser.add_argument("storage_mode", choices=VECTOR_STORAGE_MODES)
+    args = parser.parse_args()
+
+    engine = create_maintenance_engine()
+    try:
+        created = migrate_vector_storage(engine, args.storage_mode)
+    finally:
+        engine.dispose()
+
+    print(f"Vector indexes ready: {', '.join(created) or 'none'}")
+    if settings.vector_storage_mode != args.storage_mode:
+        print(f"Set VECTOR_STORAGE_MODE={args.storage_mode} before restarting the app")
+
+
+if __name__ == "__main__":
+    main()
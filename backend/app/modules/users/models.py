@@ -8,4 +8,6 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, index=True, nullable=False)
     email = Column(String(255), unique=True, index=True, nullable=False)
-    hashed_password = Column(String(255), nullable=False)
\ No newline at end of file
+    hashed_password = Column(String(255), nullable=False)
+    # Se incrementa cada vez que cambian los documentos indexados del usuario
+    corpus_version = Column(Integer, default=0, server_default="0", nullable=False)
\ No newline at end of file
@@ -1,3 +1,4 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from fastapi import Depends
 from app.modules.users.models import User
@@ -18,6 +19,22 @@ class UserRepository:
     def get_by_email(self, email: str):
         return self.db.query(User).filter(User.email == email).first()
 
+    def get_corpus_version(self, user_id: int) -> int:
+        version = self.db.query(User.corpus_version).filter(User.id == user_id).scalar()
+        return version or 0
+
+    async def aget_corpus_version(self, user_id: int) -> int:
+        # Versión async (requiere un AsyncSession)
+        result = await self.db.execute(select(User.corpus_version).where(User.id == user_id))
+        return result.scalar() or 0
+
+    def bump_corpus_version(self, user_id: int) -> None:
+        self.db.query(User).filter(User.id == user_id).update(
+            {User.corpus_version: User.corpus_version + 1},
+            synchronize_session=False
+        )
+        self.db.commit()
+
 
 def get_user_repo(db: Session = Depends(get_db)) -> UserRepository:
     return UserRepository(db)
\ No newline at end of file
@@ -0,0 +1,99 @@
+from app.modules.chat.retrieval.context_builder import build_context, count_prompt_tokens
+
+
+# Whitespace tokenizer: tiktoken needs to download its encoding, and one word per token
+# keeps the budgets below easy to follow (the separator counts as zero tokens)
+def count_words(text):
+    return len(text.split())
+
+
+def truncate_words(text, max_tokens):
+    return " ".join(text.split()[:max_tokens])
+
+
+def words(prefix, count, start=0):
+    return " ".join(f"{prefix}{i}" for i in range(start, start + count))
+
+
+def chunk(text, chunk_id):
+    return {"id": chunk_id, "text": text}
+
+
+def build(chunks, **kwargs):
+    kwargs.setdefault("token_budget", 10_000)
+    kwargs.setdefault("max_chunks", 10)
+    kwargs.setdefault("mmr_lambda", 0.7)
+    kwargs.setdefault("duplicate_similarity", 0.9)
+    return build_context("question", chunks, count_tokens=count_words, truncate=truncate_words, **kwargs)
+
+
+def test_distinct_chunks_keep_relevance_order():
+    chunks = [chunk(words(prefix, 20), i) for i, prefix in enumerate("abcd")]
+    selection = build(chunks)
+    assert [c["id"] for c in selection.chunks] == [0, 1, 2, 3]
+    assert selection.context_tokens == 80
+    assert selection.dropped_duplicates == 0
+
+
+def test_near_duplicates_are_dropped():
+    chunks = [chunk(words("a", 50), 0), chunk(words("a", 50), 1), chunk(words("b", 50), 2)]
+    selection = build(chunks)
+    assert [c["id"] for c in selection.chunks] == [0, 2]
+    assert selection.dropped_duplicates == 1
+
+
+def test_mmr_defers_redundant_chunk():
+    # Chunk 1 shares 80% of its terms with chunk 0: below the duplicate threshold, but
+    # redundant enough that the less relevant, unrelated chunk 2 goes first
+    overlapping = words("a", 80) + " " + words("c", 20)
+    chunks = [chunk(words("a", 100), 0), chunk(overlapping, 1), chunk(words("b", 100), 2)]
+    selection = build(chunks, mmr_lambda=0.5)
+    assert [c["id"] for c in selection.chunks] == [0, 2, 1]
+    assert selection.dropped_duplicates == 0
+
+
+def test_max_chunks_limits_selection():
+    chunks = [chunk(words(prefix, 20), i) for i, prefix in enumerate("abcde")]
+    selection = build(chunks, max_chunks=2)
+    assert [c["id"] for c in selection.chunks] == [0, 1]
+
+
+def test_chunks_over_budget_are_dropped_when_little_room_is_left():
+    chunks = [chunk(words(prefix, 200), i) for i, prefix in enumerate("abc")]
+    selection = build(chunks, token_budget=250)
+    assert [c["id"] for c in selection.chunks] == [0]
+    assert selection.context_tokens == 200
+    assert selection.dropped_over_budget == 2
+    assert selection.truncated == 0
+
+
+def test_chunk_crossing_budget_is_truncated():
+    chunks = [chunk(words(prefix, 200), i) for i, prefix in enumerate("abc")]
+    selection = build(chunks, token_budget=350)
+    assert [c["id"] for c in selection.chunks] == [0, 1]
+    assert selection.chunks[1]["text"] == words("b", 150)
+    assert chunks[1]["text"] == words("b", 200)
+    assert selection.context_tokens == 350
+    assert selection.truncated == 1
+    assert selection.dropped_over_budget == 1
+
+
+def test_first_chunk_is_truncated_even_below_minimum():
+    selection = build([chunk(words("a", 200), 0)], token_budget=50)
+    assert selection.chunks[0]["text"] == words("a", 50)
+    assert selection.context_tokens == 50
+    assert selection.truncated == 1
+
+
+def test_prompt_tokens_match_rendered_prompt():
+    chunks = [chunk(words("a", 20), 0), chunk(words("b", 20), 1)]
+    selection = build(chunks)
+    assert selection.prompt_tokens == count_prompt_tokens("question", selection.chunks, count_words)
+    assert selection.prompt_tokens > selection.context_tokens
+
+
+def test_empty_candidates():
+    selection = build([])
+    assert selection.chunks == []
+    assert selection.context_tokens == 0
+    assert selection.prompt_tokens == count_prompt_tokens("question", [], count_words)
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+
+from app.modules.documents.indexing_pipeline.embeddings.embedder import content_hash
+from app.modules.documents.indexing_pipeline.pipeline import diff_chunks
+
+
+def chunk(text, **metadata):
+    return Document(page_content=text, metadata=metadata)
+
+
+def row(row_id, text, chunk_index, **metadata):
+    return SimpleNamespace(id=row_id, content_hash=content_hash(text), chunk_index=chunk_index, meta_data=metadata)
+
+
+def test_identical_chunks_produce_no_changes():
+    rows = [row(1, "a", 0, page=1), row(2, "b", 1, page=1)]
+    diff = diff_chunks(rows, [chunk("a", page=1), chunk("b", page=1)])
+    assert diff.added_positions == []
+    assert diff.removed_ids == []
+    assert diff.updates == []
+
+
+def test_new_and_removed_chunks():
+    rows = [row(1, "a", 0), row(2, "b", 1)]
+    diff = diff_chunks(rows, [chunk("a"), chunk("c")])
+    assert diff.added_positions == [1]
+    assert diff.removed_ids == [2]
+    assert diff.updates == []
+
+
+def test_moved_chunk_keeps_its_row():
+    rows = [row(1, "a", 0), row(2, "b", 1)]
+    diff = diff_chunks(rows, [chunk("new"), chunk("a"), chunk("b")])
+    assert diff.added_positions == [0]
+    assert diff.removed_ids == []
+    assert diff.updates == [
+        {"id": 1, "chunk_index": 1, "meta_data": {}},
+        {"id": 2, "chunk_index": 2, "meta_data": {}},
+    ]
+
+
+def test_metadata_change_updates_row_in_place():
+    rows = [row(1, "a", 0, h1="Old")]
+    diff = diff_chunks(rows, [chunk("a", h1="New")])
+    assert diff.added_positions == []
+    assert diff.updates == [{"id": 1, "chunk_index": 0, "meta_data": {"h1": "New"}}]
+
+
+def test_duplicate_text_prefers_row_at_same_position():
+    rows = [row(1, "dup", 0), row(2, "x", 1), row(3, "dup", 2)]
+    diff = diff_chunks(rows, [chunk("y"), chunk("x"), chunk("dup")])
+    # La fila 3 ya estaba en la posición 2: se conserva; la 1 sobra
+    assert diff.added_positions == [0]
+    assert diff.removed_ids == [1]
+    assert diff.updates == []
+
+
+def test_each_row_is_matched_once():
+    rows = [row(1, "dup", 0)]
+    diff = diff_chunks(rows, [chunk("dup"), chunk("dup")])
+    assert diff.added_positions == [1]
+    assert diff.removed_ids == []
+
+
+def test_empty_document_removes_everything():
+    rows = [row(1, "a", 0), row(2, "b", 1)]
+    diff = diff_chunks(rows, [])
+    assert sorted(diff.removed_ids) == [1, 2]
+    assert diff.added_positions == []
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+from voyageai.error import RateLimitError
+
+from app.modules.documents.indexing_pipeline.embeddings import batcher as batcher_module
+from app.modules.documents.indexing_pipeline.embeddings.batcher import EmbeddingBatcher, RateLimiter
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def make_batcher(**kwargs):
+    options = dict(
+        model="voyage-test",
+        max_items=3,
+        max_tokens=10,
+        concurrency=1,
+        rate_limiter=RateLimiter(0),
+        max_retries=2,
+        backoff_seconds=0,
+        count_tokens=word_count,
+    )
+    options.update(kwargs)
+    return EmbeddingBatcher(**options)
+
+
+class FakeVoyage:
+    """Devuelve como embedding el índice de cada texto ("t<i>") y registra cada petición"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.requests = []
+
+    def embed(self, texts, model, input_type=None):
+        self.requests.append(list(texts))
+        if self.failures:
+            self.failures -= 1
+            raise RateLimitError("rate limited")
+        return SimpleNamespace(embeddings=[[float(text.split()[0][1:])] for text in texts])
+
+
+@pytest.fixture
+def voyage(monkeypatch):
+    fake = FakeVoyage()
+    monkeypatch.setattr(batcher_module, "clients", SimpleNamespace(voyage_batch=fake))
+    return fake
+
+
+def test_make_batches_respects_item_limit():
+    texts = [f"t{i}" for i in range(7)]
+    assert make_batcher().make_batches(texts) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_make_batches_respects_token_budget():
+    texts = ["t0 a b c", "t1 a b c", "t2 a b", "t3"]
+    # 4 + 4 tokens caben; el tercero (3) pasaría de 10
+    assert make_batcher().make_batches(texts) == [[0, 1], [2, 3]]
+
+
+def test_oversized_text_goes_alone():
+    texts = ["t0", "t1 " + "x " * 20, "t2"]
+    assert make_batcher().make_batches(texts) == [[0], [1], [2]]
+
+
+def test_make_batches_empty():
+    assert make_batcher().make_batches([]) == []
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_embed_returns_embeddings_in_input_order(voyage, concurrency):
+    texts = [f"t{i} " + "w " * (i % 4) for i in range(11)]
+    embeddings = make_batcher(concurrency=concurrency).embed(texts)
+    assert embeddings == [[float(i)] for i in range(11)]
+    assert sorted(text for request in voyage.requests for text in request) == sorted(texts)
+
+
+def test_embed_empty_makes_no_requests(voyage):
+    assert make_batcher().embed([]) == []
+    assert voyage.requests == []
+
+
+def test_rate_limited_batch_is_retried_through_the_limiter(voyage, monkeypatch):
+    voyage.failures = 2
+    acquired = []
+    limiter = RateLimiter(0)
+    monkeypatch.setattr(limiter, "acquire", lambda: acquired.append(1))
+
+    embeddings = make_batcher(rate_limiter=limiter).embed(["t0", "t1"])
+
+    assert embeddings == [[0.0], [1.0]]
+    assert len(voyage.requests) == 3
+    # Cada intento, también los reintentos, pasa por el rate limiter
+    assert len(acquired) == 3
+
+
+def test_gives_up_after_max_retries(voyage):
+    voyage.failures = 10
+    with pytest.raises(RateLimitError):
+        make_batcher(max_retries=2).embed(["t0"])
+    assert len(voyage.requests) == 3
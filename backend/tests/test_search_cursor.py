@@ -0,0 +1,93 @@
+import base64
+import json
+
+import pytest
+
+from app.modules.chat.exceptions import InvalidSearchCursor
+from app.modules.chat.schemas import SearchFilters
+from app.modules.chat.services import (
+    _decode_search_cursor,
+    _encode_search_cursor,
+    _search_fingerprint,
+    _search_meta_filter,
+)
+
+
+FINGERPRINT = _search_fingerprint("what is rag", {})
+MAX_DEPTH = 1000
+
+
+def raw_cursor(**payload):
+    payload = {"d": "0.25", "id": 7, "n": 10, "f": FINGERPRINT, **payload}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def test_roundtrip_keeps_exact_distance():
+    distance = 0.1 + 0.2  # not representable in a short decimal
+    cursor = _encode_search_cursor((distance, 42), 20, FINGERPRINT)
+    assert "=" not in cursor
+    after, seen = _decode_search_cursor(cursor, FINGERPRINT, MAX_DEPTH)
+    assert after == (distance, 42)
+    assert seen == 20
+
+
+def test_cursor_from_another_search_is_rejected():
+    cursor = _encode_search_cursor((0.5, 1), 10, FINGERPRINT)
+    other = _search_fingerprint("something else", {})
+    with pytest.raises(InvalidSearchCursor, match="does not match"):
+        _decode_search_cursor(cursor, other, MAX_DEPTH)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode("ascii"),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode("ascii"),
+    base64.urlsafe_b64encode(b'{"d": "0.1"}').decode("ascii"),
+    base64.urlsafe_b64encode(b"[1, 2]").decode("ascii"),
+    raw_cursor(d="far"),
+    raw_cursor(id="seven"),
+])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidSearchCursor):
+        _decode_search_cursor(cursor, FINGERPRINT, MAX_DEPTH)
+
+
+@pytest.mark.parametrize("seen", [-1, MAX_DEPTH, MAX_DEPTH + 1])
+def test_depth_out_of_range_is_rejected(seen):
+    with pytest.raises(InvalidSearchCursor, match="out of range"):
+        _decode_search_cursor(raw_cursor(n=seen), FINGERPRINT, MAX_DEPTH)
+
+
+def test_last_reachable_depth_is_accepted():
+    _, seen = _decode_search_cursor(raw_cursor(n=MAX_DEPTH - 1), FINGERPRINT, MAX_DEPTH)
+    assert seen == MAX_DEPTH - 1
+
+
+@pytest.mark.parametrize("payload", [
+    {"d": "nan"},
+    {"d": "inf"},
+    {"d": "-0.5"},
+    {"d": "2.5"},
+    {"id": 0},
+    {"id": -3},
+    {"id": 2 ** 31},
+])
+def test_values_outside_column_ranges_are_rejected(payload):
+    with pytest.raises(InvalidSearchCursor):
+        _decode_search_cursor(raw_cursor(**payload), FINGERPRINT, MAX_DEPTH)
+
+
+def test_meta_filter_maps_fields_and_drops_empty_ones():
+    filters = SearchFilters(source="guide.pdf", page=3, file_type="pdf")
+    assert _search_meta_filter(filters) == {"source": "guide.pdf", "page": 3, "type": "pdf"}
+    assert _search_meta_filter(SearchFilters()) == {}
+    assert _search_meta_filter(None) == {}
+
+
+def test_fingerprint_ignores_trivial_query_differences():
+    assert _search_fingerprint("  What is   RAG ", {"page": 1}) == _search_fingerprint("what is rag", {"page": 1})
+
+
+def test_fingerprint_depends_on_filters():
+    assert _search_fingerprint("what is rag", {"page": 1}) != _search_fingerprint("what is rag", {"page": 2})
+    assert _search_fingerprint("what is rag", {"page": 1}) != _search_fingerprint("what is rag", {})
@@ -0,0 +1,78 @@
+import re
+
+import pytest
+
+from app.modules.documents.repository import DocumentRepository, numbered_filename_pattern
+
+
+def captured_suffix(pattern, name):
+    # Mismo resultado que substring(name FROM pattern) de Postgres para estas expresiones
+    match = re.search(pattern, name)
+    return match.group(1) if match else None
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("report_1.pdf", "1"),
+    ("report_42.pdf", "42"),
+    ("report_123456789.pdf", "123456789"),
+    ("report.pdf", None),
+    ("report_.pdf", None),
+    ("report_1.docx", None),
+    ("report_1_2.pdf", None),
+    ("other_report_1.pdf", None),
+    ("report_x1.pdf", None),
+])
+def test_pattern_captures_counter(name, expected):
+    assert captured_suffix(numbered_filename_pattern("report.pdf"), name) == expected
+
+
+def test_timestamp_suffixes_are_not_captured():
+    # 10+ dígitos desbordarían el cast a INTEGER en Postgres
+    pattern = numbered_filename_pattern("scan.pdf")
+    assert captured_suffix(pattern, "scan_20241018093011.pdf") is None
+    assert captured_suffix(pattern, "scan_1234567890.pdf") is None
+
+
+def test_pattern_escapes_regex_characters():
+    pattern = numbered_filename_pattern("a.b (v2)+.md")
+    assert captured_suffix(pattern, "a.b (v2)+_3.md") == "3"
+    assert captured_suffix(pattern, "aXb (v2)+_3.md") is None
+    assert captured_suffix(pattern, "a.b (v2)+_3Xmd") is None
+
+
+class FakeQuery:
+    def __init__(self, result):
+        self.result = result
+        self.filters = []
+
+    def filter(self, *conditions):
+        self.filters.extend(conditions)
+        return self
+
+    def one(self):
+        return self.result
+
+
+class FakeSession:
+    def __init__(self, result):
+        self.last_query = FakeQuery(result)
+
+    def query(self, *columns):
+        return self.last_query
+
+
+@pytest.mark.parametrize("result, expected", [
+    ((False, None), "report.pdf"),
+    ((True, None), "report_1.pdf"),
+    ((True, 7), "report_8.pdf"),
+])
+def test_generate_unique_filename(result, expected):
+    repository = DocumentRepository(FakeSession(result))
+    assert repository.generate_unique_filename("report.pdf", user_id=1) == expected
+
+
+def test_like_prefix_escapes_wildcards():
+    session = FakeSession((False, None))
+    DocumentRepository(session).generate_unique_filename("100%_done.pdf", user_id=1)
+    like = next(condition for condition in session.last_query.filters if condition.operator.__name__ == "like_op")
+    assert like.right.value == "100\\%\\_done%"